@@ -1,8 +1,12 @@
 '''
 The `cards` module contains classes related to a deck of cards and how they are used.
-It contains classes for a card (Card) and deck of cards (Deck). It does not
-contain a class for a hand of cards because that is dependent on the game being 
-played and managed by the player of a game.
+It contains classes for a card (Card), a deck of cards (Deck) and a hand of
+cards (Hand).
+
+Internally every card is a small packed int, its code. The rank lives in the
+high bits and the suit in the low two bits, so the 52 codes are 0 to 51. There
+is exactly one Card object per code, built when this module is imported, and
+the Deck and Hand classes store codes rather than Card objects.
 '''
 
 import random
@@ -18,43 +22,208 @@ RANKS = set(['A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K'])
 NUM_CARDS_IN_HAND = 5
 MAX_DISCARD = 3
 
+# Card code layout: ((value - 2) << SUIT_BITS) | suit index
+SUIT_BITS = 2
+SUIT_MASK = (1 << SUIT_BITS) - 1
+NUM_CARDS_IN_DECK = 52
+ALL_CODES = tuple(range(NUM_CARDS_IN_DECK))
+FULL_DECK_MASK = (1 << NUM_CARDS_IN_DECK) - 1
+
+# Suits and ranks in code order. The position in the tuple is the index used
+# in the card code.
+SUIT_ORDER = ('C', 'D', 'H', 'S')
+RANK_ORDER = ('2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A')
+
+# Lookups used to build a code from the char representations
+SUIT_INDEX = {suit: i for i, suit in enumerate(SUIT_ORDER)}
+RANK_VALUES = {rank: i + 2 for i, rank in enumerate(RANK_ORDER)}
+
+UTF_SUITS = {
+    'H': '♥',    # U+2665
+    'D': '♦',    # U+2666
+    'C': '♣',    # U+2663
+    'S': '♠',    # U+2660
+}
+
+
+def card_code(value, suit_index):
+    '''
+    Packs a rank value and a suit index into a card code.
+
+    value: int - the rank value of the card (2 to 14, Ace is 14)
+    suit_index: int - the position of the suit in SUIT_ORDER
+    '''
+    return ((value - 2) << SUIT_BITS) | suit_index
+
+
+def code_value(code):
+    '''
+    Returns the rank value (2 to 14) of a card code.
+
+    code: int - a card code
+    '''
+    return (code >> SUIT_BITS) + 2
+
+
+def code_suit(code):
+    '''
+    Returns the suit index of a card code.
+
+    code: int - a card code
+    '''
+    return code & SUIT_MASK
+
+
+def stream_seed(seed, hand_no):
+    '''
+    Returns the seed of the random stream for one hand of a seeded deck.
+    Each (seed, hand_no) pair gets its own stream.
+
+    seed: int or str - the deck's seed
+    hand_no: int - the number of the hand
+    '''
+    return '{}:{}'.format(seed, hand_no)
+
+
+def card_from_code(code):
+    '''
+    Returns the shared Card object for the given card code.
+
+    code: int - a card code (0 to 51)
+    '''
+    return CARDS[code]
+
 
 class Deck:
     '''
     Represents a standard 52 card deck of playing cards. It does not include
-    Jokers, only the standard suits and ranks.
+    Jokers, only the standard suits and ranks. The deck holds card codes; the
+    Card objects it deals are the shared ones in CARDS.
+
+    The codes live in a fixed 52 slot list used as a ring: cards are dealt
+    from the top and returned cards are placed after the last one, so
+    neither moves any other card. A bitmask with one bit per code records
+    which cards are in the deck, so membership checks are O(1). The storage
+    is reused by reshuffle for every hand.
+
+    Shuffling is lazy. A shuffle only marks the cards as unordered, and each
+    card is picked at random when it is dealt (a partial Fisher-Yates
+    shuffle), so a hand that deals 30 cards does 30 steps of shuffle work.
+    Each deck draws from its own random stream. Given a seed, the order of
+    every hand is fixed by (seed, hand_no), so any hand can be replayed.
     '''
 
-    def __init__(self):
+    def __init__(self, seed=None, rng=None):
         '''
         Creates the inital deck.
+
+        seed: int or str - optional, makes the deck order reproducible
+        rng: Random - optional, the random stream to shuffle with. A new
+                      random.Random is used by default.
         '''
-        self.deck = []
+        self.seed = seed
+        self.rng = rng if rng is not None else random.Random()
+        if seed is not None:
+            self.rng.seed(stream_seed(seed, 0))
+
+        self.slots = [0] * NUM_CARDS_IN_DECK
         self.create()
         self.shuffle()
 
     def create(self):
         '''
-        Builds a 52 card deck from scratch.
+        Builds a 52 card deck from scratch, reusing the existing storage.
         '''
-        for suit in SUITS:
-            for rank in RANKS:
-                self.deck.append(Card(suit, rank))
+        self.slots[:] = ALL_CODES
+        self.top = 0  # slot of the top card
+        self.size = NUM_CARDS_IN_DECK
+        self.pool = 0  # cards from the top that are still in shuffled order
+        self.in_deck = FULL_DECK_MASK  # bit `code` set if the card is in the deck
 
     def shuffle(self):
         '''
-        Suffles the deck.
+        Suffles the cards in the deck. The work is done as cards are dealt.
+        '''
+        self.pool = self.size
+
+    def reshuffle(self, hand_no=None):
+        '''
+        Puts all 52 cards back in the deck and shuffles it, in place. For a
+        seeded deck, the random stream is reset to the one for the hand.
+
+        hand_no: int - optional, the number of the hand about to be dealt
         '''
-        random.shuffle(self.deck)
+        if self.seed is not None and hand_no is not None:
+            self.rng.seed(stream_seed(self.seed, hand_no))
+
+        self.create()
+        self.shuffle()
+
+    def _pick(self, offset):
+        '''
+        Swaps a random card from the shuffled pool into the slot `offset`
+        cards below the top, where the pool starts; one step of the
+        Fisher-Yates shuffle.
+
+        offset: int - the position of the slot below the top of the deck
+        '''
+        slots = self.slots
+        a = (self.top + offset) % NUM_CARDS_IN_DECK
+        b = (a + self.rng.randrange(self.pool)) % NUM_CARDS_IN_DECK
+        slots[a], slots[b] = slots[b], slots[a]
+        self.pool -= 1
 
     def deal_card(self):
         '''
         Removes and returns a card from the top of the deck.
         '''
-        if len(self.deck) <= 0:
+        return CARDS[self.deal_code()]
+
+    def deal_code(self):
+        '''
+        Removes and returns the code of the card on the top of the deck.
+        '''
+        if self.size <= 0:
             raise DeckEmptyError()
 
-        return self.deck.pop()
+        if self.pool:
+            self._pick(0)
+
+        code = self.slots[self.top]
+        self.top = (self.top + 1) % NUM_CARDS_IN_DECK
+        self.size -= 1
+        self.in_deck &= ~(1 << code)
+        return code
+
+    def deal_n(self, num_cards):
+        '''
+        Removes the given number of cards from the top of the deck and returns
+        their codes as a list, top card first.
+
+        num_cards: int - the number of cards to deal
+        '''
+        if num_cards > self.size:
+            raise DeckEmptyError()
+
+        # Pick the cards to deal, leaving them in order at the top
+        for i in range(min(num_cards, self.pool)):
+            self._pick(i)
+
+        top = self.top
+        end = top + num_cards
+        if end <= NUM_CARDS_IN_DECK:
+            codes = self.slots[top:end]
+        else:
+            codes = self.slots[top:] + self.slots[:end - NUM_CARDS_IN_DECK]
+
+        in_deck = self.in_deck
+        for code in codes:
+            in_deck &= ~(1 << code)
+
+        self.in_deck = in_deck
+        self.top = end % NUM_CARDS_IN_DECK
+        self.size -= num_cards
+        return codes
 
     def add_card_to_bottom(self, card):
         '''
@@ -65,27 +234,55 @@ class Deck:
         '''
         if not isinstance(card, Card):
             raise TypeError('card must be of type `Card`')
-        if card in self.deck:
+
+        self.add_code_to_bottom(card.code)
+
+    def add_code_to_bottom(self, code):
+        '''
+        Adds the card with the given code to the bottom of the deck. The card
+        can not be a duplicate of a card already in the deck.
+
+        code: int - a card code
+        '''
+        if self.in_deck >> code & 1:
             raise ValueError('cannot add duplicate card to the deck')
 
-        self.deck.insert(0, card)
+        self.slots[(self.top + self.size) % NUM_CARDS_IN_DECK] = code
+        self.size += 1
+        self.in_deck |= 1 << code
+
+    def __contains__(self, card):
+        '''
+        Returns True if the card, given as a Card or a code, is in the deck.
+        '''
+        code = card.code if isinstance(card, Card) else card
+        return bool(self.in_deck >> code & 1)
+
+    def __len__(self):
+        return self.size
 
     def _print_deck(self):
         '''
         Prints each card of a deck. Should only be needed for debugging.
+        Cards in the shuffled pool are printed in storage order, not the
+        order they will be dealt in.
         '''
-        for card in self.deck:
-            print(card)
+        for i in range(self.size):
+            print(CARDS[self.slots[(self.top + i) % NUM_CARDS_IN_DECK]])
 
 
 class Card:
     '''
-    Represents a standard playing card with a suit and rank.
+    Represents a standard playing card with a suit and rank. Cards are
+    interned: creating a Card returns the shared object for that suit and
+    rank, so two cards with the same suit and rank are the same object.
     '''
 
-    def __init__(self, suit, rank):
+    __slots__ = ('code', 'suit', 'rank', 'value', 'utf_suit')
+
+    def __new__(cls, suit, rank):
         '''
-        Creates a Card.
+        Returns the Card for the given suit and rank.
 
         suit: str - A char representing a suit ('H', 'D', 'C', 'S')
         rank: str - A char representing a rank
@@ -96,46 +293,29 @@ class Card:
         if rank not in RANKS:
             raise ValueError('invalid rank')
 
-        self.suit = suit
-        self.rank = rank
-
-        if self.rank == 'A':
-            self.value = 14
-        if self.rank == 'K':
-            self.value = 13
-        if self.rank == 'Q':
-            self.value = 12
-        if self.rank == 'J':
-            self.value = 11
-        if self.rank == '10':
-            self.value = 10
-        if self.rank == '9':
-            self.value = 9
-        if self.rank == '8':
-            self.value = 8
-        if self.rank == '7':
-            self.value = 7
-        if self.rank == '6':
-            self.value = 6
-        if self.rank == '5':
-            self.value = 5
-        if self.rank == '4':
-            self.value = 4
-        if self.rank == '3':
-            self.value = 3
-        if self.rank == '2':
-            self.value = 2
-
-        # Assign UTF suit also
-        if suit == 'H':
-            self.utf_suit = '♥'    # U+2665
-        elif suit == 'D':
-            self.utf_suit = '♦'    # U+2666
-        elif suit == 'C':
-            self.utf_suit = '♣'    # U+2663
-        else:
-            # Must be spade, from check above
-            self.utf_suit = '♠'    # U+2660
+        return CARDS[card_code(RANK_VALUES[rank], SUIT_INDEX[suit])]
+
+    @classmethod
+    def _build(cls, code):
+        '''
+        Creates the single Card object for a code. Only used while building
+        CARDS at import.
+
+        code: int - a card code
+        '''
+        card = object.__new__(cls)
+        card.code = code
+        card.suit = SUIT_ORDER[code_suit(code)]
+        card.value = code_value(code)
+        card.rank = RANK_ORDER[card.value - 2]
+        card.utf_suit = UTF_SUITS[card.suit]
+        return card
+
+    def __reduce__(self):
+        '''
+        Pickles a card as its code so unpickling returns the shared object.
+        '''
+        return (card_from_code, (self.code,))
 
     def __str__(self):
         '''
@@ -161,9 +341,14 @@ class Card:
         return self.suit + self.rank
 
 
+# The 52 shared Card objects, indexed by card code
+CARDS = tuple(Card._build(code) for code in range(NUM_CARDS_IN_DECK))
+
+
 class Hand:
     '''
-    Hand represents a hand of cards that a poker player might have.
+    Hand represents a hand of cards that a poker player might have. The
+    cards are stored as card codes in `codes`.
     '''
 
     def __init__(self, num_cards):
@@ -173,7 +358,30 @@ class Hand:
         num_cards: int - the number of cards a hand should contain
         '''
         self.max_len = num_cards
-        self.hand = []
+        self.codes = []
+        self._rank_key = None  # cached by rank_key, cleared on any change
+
+    def rank_key(self):
+        '''
+        Returns the rank key of a full hand: an int that orders hands the way
+        poker does, by category, then the ranks that make the category, then
+        the kickers. Equal keys are a split. The key is cached until the cards
+        in the hand change.
+        '''
+        if self._rank_key is None:
+            # Imported here since hand_evaluator builds its tables from this
+            # module when it is imported.
+            import hand_evaluator
+            self._rank_key = hand_evaluator.evaluate(self.codes)
+
+        return self._rank_key
+
+    @property
+    def hand(self):
+        '''
+        The cards in the hand as a list of Card objects.
+        '''
+        return [CARDS[code] for code in self.codes]
 
     def add_card(self, card):
         '''
@@ -184,10 +392,11 @@ class Hand:
         '''
         if not isinstance(card, Card):
             raise TypeError('card must be of type Card')
-        if len(self.hand) >= self.max_len:
+        if len(self.codes) >= self.max_len:
             raise HandFullError()
 
-        self.hand.append(card)
+        self.codes.append(card.code)
+        self._rank_key = None
 
     def remove_card(self, card_id):
         '''
@@ -197,13 +406,11 @@ class Hand:
 
         card_id: int - the 1-indexed position of the card to remove
         '''
-        print(card_id)
-        if not 0 < card_id <= len(self.hand):
+        if not 0 < card_id <= len(self.codes):
             raise ValueError('card_id must be a valid index (1 to 5)')
 
-        card = self.hand[card_id - 1]
-        self.hand.remove(card)
-        return card
+        self._rank_key = None
+        return CARDS[self.codes.pop(card_id - 1)]
 
     def swap_cards(self, card_id_1, card_id_2):
         '''
@@ -212,29 +419,29 @@ class Hand:
         card_id_1: int - the 1-indexed position of the first card to swap
         card_id_2: int - the 1-indexed position of the second card to swap
         '''
-        if not 0 < card_id_1 <= len(self.hand):
+        if not 0 < card_id_1 <= len(self.codes):
             raise ValueError('card_id_1 must be a valid index (1 to len)')
-        if not 0 < card_id_2 <= len(self.hand):
+        if not 0 < card_id_2 <= len(self.codes):
             raise ValueError('card_id_2 must be a valid index (1 to len)')
 
         i = card_id_1 - 1
         j = card_id_2 - 1
-        self.hand[i], self.hand[j] = self.hand[j], self.hand[i]
+        self.codes[i], self.codes[j] = self.codes[j], self.codes[i]
 
     def print_hand(self):
         '''
         Displays each card in the hand along with its ID number.
         '''
-        for i, card in enumerate(self.hand):
+        for i, code in enumerate(self.codes):
             print(i+1)
-            print(card)
+            print(CARDS[code])
 
     def __repr__(self):
         '''
         Provides a simple representation of the hand.
         '''
         # Get the representation of each card in the hand
-        hand_repr = map(lambda card: card.__repr__(), self.hand)
+        hand_repr = map(lambda code: CARDS[code].__repr__(), self.codes)
 
         # Return them as comma seperated values
         return "Hand(" + ', '.join(hand_repr) + ")"
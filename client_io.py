@@ -0,0 +1,170 @@
+'''
+The `client_io` module lets the client wait on the server and the player at
+the same time. The client reads the server and the terminal in turn, so a
+message that arrives while the player is still typing an answer would sit
+unread until they pressed enter. ServerConnection instead waits on both with
+a selector: messages are read the moment they arrive, notifications are
+shown right away, and a prompt is given up as soon as the server says the
+player ran out of time, rather than sending an answer it would throw away.
+
+Waiting on the terminal with a selector needs a POSIX system.
+'''
+
+import collections
+import os
+import selectors
+import sys
+
+import framing
+
+NOTIFY = 'notify'
+TIMEOUT = 'Timeout'
+
+# Queued in place of a message where the server said the player ran out of
+# time
+_TIMED_OUT = object()
+
+
+class ServerConnection(framing.Connection):
+    '''
+    The client's connection to the server, read together with the terminal.
+    '''
+
+    def __init__(self, sock, stdin=None, show=print):
+        '''
+        Wraps a connected socket.
+
+        sock: socket - a connected TCP socket
+        stdin: file - optional, where the player types, sys.stdin if None
+        show: function - prints a message to the player
+        '''
+        super().__init__(sock)
+        self.stdin = sys.stdin if stdin is None else stdin
+        self.show = show
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(sock, selectors.EVENT_READ)
+        # Messages received and not yet looked at. They are only handled
+        # when they are reached, as the codec may change after a message.
+        self.frames = collections.deque()
+        # Messages handled and not yet returned, in order
+        self.messages = collections.deque()
+        self.closed = False
+        # Bytes typed and not yet returned as a line
+        self.typed = bytearray()
+
+    def recv_bytes(self):
+        '''
+        Waits for the next message and returns it as bytes. Notifications and
+        TIMEOUT are handled when reached and never returned. Raises a
+        ConnectionClosedError if the server closes the connection first.
+        '''
+        while True:
+            if self.messages:
+                message = self.messages.popleft()
+                if message is not _TIMED_OUT:
+                    return message
+            elif self.frames:
+                self._arrived(self.frames.popleft())
+            elif self.closed:
+                raise framing.ConnectionClosedError('connection closed by peer')
+            else:
+                self._read_socket()
+
+    def read_line(self, prompt=''):
+        '''
+        Shows a prompt and returns the line the player types, without the
+        newline, like input(). Messages that arrive meanwhile are read and
+        notifications shown. Raises an InputTimeoutError if the server says
+        the player ran out of time first, dropping anything typed so far, and
+        EOFError at the end of input.
+
+        prompt: str - shown before the player types
+        '''
+        self.show(prompt, end='', flush=True)
+        fd = self.stdin.fileno()
+        self.selector.register(fd, selectors.EVENT_READ)
+        try:
+            while True:
+                while self.frames:
+                    self._arrived(self.frames.popleft(), prompt)
+                if self.messages and self.messages[0] is _TIMED_OUT:
+                    self.messages.popleft()
+                    # What was typed answered the prompt that timed out, so
+                    # it must not become the answer to the next one
+                    self.typed.clear()
+                    raise InputTimeoutError('the server chose for the player')
+
+                end = self.typed.find(b'\n')
+                if end >= 0:
+                    line = bytes(self.typed[:end])
+                    del self.typed[:end + 1]
+                    return line.decode().rstrip('\r')
+
+                for key, _ in self.selector.select():
+                    if key.fileobj == fd:
+                        data = os.read(fd, framing.RECV_SIZE)
+                        if not data:
+                            raise EOFError('end of input')
+                        self.typed += data
+                    elif not self.closed:
+                        self._read_socket()
+                if self.closed:
+                    raise framing.ConnectionClosedError('connection closed by peer')
+        finally:
+            self.selector.unregister(fd)
+
+    def _read_socket(self):
+        '''
+        Reads what the server has sent and queues each whole message.
+        '''
+        data = self.sock.recv(framing.RECV_SIZE)
+        if not data:
+            self.closed = True
+            self.selector.unregister(self.sock)
+            return
+
+        self.buffer += data
+        while True:
+            message = framing.pop_frame(self.buffer)
+            if message is None:
+                break
+            self.frames.append(message)
+
+    def _arrived(self, message, prompt=None):
+        '''
+        Handles a message once it is reached: answers TIMEOUT, shows
+        notifications and queues everything else for recv.
+
+        message: bytes - the message
+        prompt: str - the prompt being shown, if any, to show again after a
+                      notification
+        '''
+        if message == self.codec.encode_text(TIMEOUT):
+            # The server drops anything sent before this answer
+            self.send(TIMEOUT)
+            if prompt is not None:
+                self.show()
+            self.show('You ran out of time, so the server chose for you.')
+            self.messages.append(_TIMED_OUT)
+            return
+
+        if message.startswith(self.codec.encode_text(NOTIFY + ' ')):
+            if prompt is not None:
+                self.show()
+            self.show(self.codec.decode_text(message)[len(NOTIFY) + 1:])
+            if prompt is not None:
+                self.show(prompt, end='', flush=True)
+            return
+
+        self.messages.append(message)
+
+    def close(self):
+        self.selector.close()
+        super().close()
+
+
+class InputTimeoutError(Exception):
+    '''
+    Raised when the server chose for the player before they answered.
+    '''
+    pass
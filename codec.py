@@ -0,0 +1,320 @@
+'''
+The `codec` module turns the messages of a game into bytes and back. Two
+codecs share one interface:
+
+TextCodec is the original protocol, where every message is a string such as
+`"10 5 True"` for a bet prompt or `"HA D10 S2 C3 C4 "` for a deal.
+
+BinaryCodec packs the same messages with struct. Each message starts with a
+one byte type; cards are one byte each (their card code) and amounts are
+fixed width unsigned ints.
+
+Amounts are never negative nor above MAX_AMOUNT, and card codes are always
+those of a card in the deck, so both codecs refuse to encode or decode any
+others. Messages that are rare or only shown to the player, such as
+notifications, are sent as a TEXT message holding the string.
+
+A client asks for a codec by adding `codec=<name>` to its start or join
+message. The server names the codec it picked as the last field of its ack;
+a server that does not know about codecs leaves it out, so both sides keep
+using text, and a client that does not ask is answered in text.
+'''
+
+import struct
+
+import cards
+
+TEXT_NAME = 'text'
+BINARY_NAME = 'binary/1'
+
+# Prefix of the word that asks for a codec in a start or join message
+CODEC_OPTION = 'codec='
+
+# Betting and ante actions
+CHECK = 0
+CALL = 1
+RAISE = 2
+FOLD = 3
+LEAVE = 4
+ANTE = 5
+
+# Text form of each action
+ACTION_NAMES = ('Check', 'Call', 'Raise', 'Fold', 'Leave', 'ante')
+_ACTIONS_BY_NAME = {name.lower(): action for action, name in enumerate(ACTION_NAMES)}
+
+# Sent instead of a bet prompt when a round of betting is over
+BETTING_OVER = 'Over'
+
+# Sent instead of discard positions to keep every card
+STAND_PAT = 'N'
+
+# Largest amount a message carries, as the binary codec packs amounts as
+# unsigned 32 bit ints
+MAX_AMOUNT = 2 ** 32 - 1
+
+# Binary message types
+TEXT = 0
+CARDS = 1
+BET_PROMPT = 2
+ACTION = 3
+DISCARD = 4
+
+_BET_PROMPT = struct.Struct('!BIIB')  # type, max bet, current bet, first
+_ACTION = struct.Struct('!BBHI')  # type, action, player id, amount
+_DISCARD = struct.Struct('!BB')  # type, mask of 1-indexed positions
+
+
+class TextCodec:
+    '''
+    The original text protocol.
+    '''
+
+    name = TEXT_NAME
+
+    def encode_text(self, message):
+        return message.encode()
+
+    def decode_text(self, data):
+        return data.decode()
+
+    def encode_cards(self, codes):
+        '''
+        Encodes dealt cards.
+
+        codes: [int] - the card codes
+        '''
+        _check_cards(codes)
+        return ''.join(repr(cards.CARDS[code]) + ' ' for code in codes).encode()
+
+    def decode_cards(self, data):
+        '''
+        Returns the card codes of an encoded deal.
+
+        data: bytes - the message
+        '''
+        try:
+            return [cards.Card(rep[0], rep[1:]).code for rep in data.decode().split()]
+        except (IndexError, ValueError):
+            raise CodecError('bad cards: {!r}'.format(data))
+
+    def encode_bet_prompt(self, max_bet, curr_bet, first):
+        '''
+        Encodes a prompt for a player to bet.
+
+        max_bet: int - the amount to call
+        curr_bet: int - the amount the player has bet so far
+        first: bool - True if the player is the first to bet
+        '''
+        _check_amounts(max_bet, curr_bet)
+        return '{} {} {}'.format(max_bet, curr_bet, first).encode()
+
+    def decode_bet_prompt(self, data):
+        '''
+        Returns a bet prompt as a tuple of (max_bet, curr_bet, first), or None
+        if the message says betting is over.
+
+        data: bytes - the message
+        '''
+        text = data.decode()
+        if text == BETTING_OVER:
+            return None
+        try:
+            max_bet, curr_bet, first = text.split()
+            max_bet = int(max_bet)
+            curr_bet = int(curr_bet)
+        except ValueError:
+            raise CodecError('bad bet prompt: {!r}'.format(data))
+        _check_amounts(max_bet, curr_bet)
+        return (max_bet, curr_bet, first == 'True')
+
+    def encode_action(self, action, player_id, amt=0):
+        '''
+        Encodes a player's action. Folding and leaving have no amount.
+
+        action: int - one of CHECK, CALL, RAISE, FOLD, LEAVE, ANTE
+        player_id: int - the player's ID
+        amt: int - the amount bet
+        '''
+        _check_amounts(amt)
+        if action in (FOLD, LEAVE):
+            return '{} {}'.format(ACTION_NAMES[action], player_id).encode()
+        return '{} {} {}'.format(ACTION_NAMES[action], player_id, amt).encode()
+
+    def decode_action(self, data):
+        '''
+        Returns an action as a tuple of (action, player_id, amt).
+
+        data: bytes - the message
+        '''
+        parts = data.decode().split()
+        try:
+            action = _ACTIONS_BY_NAME[parts[0].lower()]
+            player_id = int(parts[1])
+            amt = int(parts[2]) if len(parts) > 2 else 0
+        except (IndexError, KeyError, ValueError):
+            raise CodecError('bad action: {!r}'.format(data))
+        _check_amounts(amt)
+        return (action, player_id, amt)
+
+    def encode_discard(self, positions):
+        '''
+        Encodes the cards a player discards.
+
+        positions: [int] - 1-indexed positions in the hand, empty to keep all
+        '''
+        if not positions:
+            return STAND_PAT.encode()
+        return ' '.join(str(pos) for pos in positions).encode()
+
+    def decode_discard(self, data):
+        '''
+        Returns the 1-indexed positions of the discarded cards.
+
+        data: bytes - the message
+        '''
+        text = data.decode().strip()
+        if text == STAND_PAT:
+            return []
+        try:
+            return [int(pos) for pos in text.split()]
+        except ValueError:
+            raise CodecError('bad discard: {!r}'.format(data))
+
+
+class BinaryCodec:
+    '''
+    The struct based protocol, version 1.
+    '''
+
+    name = BINARY_NAME
+
+    def encode_text(self, message):
+        return bytes((TEXT,)) + message.encode()
+
+    def decode_text(self, data):
+        _expect(data, TEXT)
+        return data[1:].decode()
+
+    def encode_cards(self, codes):
+        _check_cards(codes)
+        return bytes((CARDS,)) + bytes(codes)
+
+    def decode_cards(self, data):
+        _expect(data, CARDS)
+        codes = list(data[1:])
+        _check_cards(codes)
+        return codes
+
+    def encode_bet_prompt(self, max_bet, curr_bet, first):
+        _check_amounts(max_bet, curr_bet)
+        return _BET_PROMPT.pack(BET_PROMPT, max_bet, curr_bet, first)
+
+    def decode_bet_prompt(self, data):
+        # The end of betting is sent to every player as text
+        if data[:1] == bytes((TEXT,)) and data[1:].decode() == BETTING_OVER:
+            return None
+        _expect(data, BET_PROMPT, _BET_PROMPT.size)
+        _, max_bet, curr_bet, first = _BET_PROMPT.unpack(data)
+        return (max_bet, curr_bet, bool(first))
+
+    def encode_action(self, action, player_id, amt=0):
+        _check_amounts(amt)
+        return _ACTION.pack(ACTION, action, player_id, amt)
+
+    def decode_action(self, data):
+        _expect(data, ACTION, _ACTION.size)
+        _, action, player_id, amt = _ACTION.unpack(data)
+        if action >= len(ACTION_NAMES):
+            raise CodecError('bad action: {}'.format(action))
+        return (action, player_id, amt)
+
+    def encode_discard(self, positions):
+        mask = 0
+        for pos in positions:
+            mask |= 1 << (pos - 1)
+        return _DISCARD.pack(DISCARD, mask)
+
+    def decode_discard(self, data):
+        _expect(data, DISCARD, _DISCARD.size)
+        _, mask = _DISCARD.unpack(data)
+        return [i + 1 for i in range(cards.NUM_CARDS_IN_HAND) if mask >> i & 1]
+
+
+def _expect(data, msg_type, size=None):
+    '''
+    Raises a CodecError unless a binary message has the given type and, if
+    given, size.
+
+    data: bytes - the message
+    msg_type: int - the expected type
+    size: int - the expected size in bytes
+    '''
+    if not data or data[0] != msg_type:
+        raise CodecError('expected message type {} but got {!r}'.format(msg_type, data[:1]))
+    if size is not None and len(data) != size:
+        raise CodecError('bad message size {} for type {}'.format(len(data), msg_type))
+
+
+def _check_amounts(*amts):
+    '''
+    Raises a CodecError if any amount is negative or above MAX_AMOUNT.
+
+    amts: int - the amounts of a message
+    '''
+    for amt in amts:
+        if amt < 0:
+            raise CodecError('negative amount: {}'.format(amt))
+        if amt > MAX_AMOUNT:
+            raise CodecError('amount too large: {}'.format(amt))
+
+
+def _check_cards(codes):
+    '''
+    Raises a CodecError if any card code is not that of a card in the deck.
+
+    codes: [int] - the card codes of a message
+    '''
+    for code in codes:
+        if not 0 <= code < cards.NUM_CARDS_IN_DECK:
+            raise CodecError('bad card code: {}'.format(code))
+
+
+TEXT_CODEC = TextCodec()
+BINARY_CODEC = BinaryCodec()
+
+CODECS = {codec.name: codec for codec in (TEXT_CODEC, BINARY_CODEC)}
+
+
+def option(codec):
+    '''
+    Returns the word a client adds to its start or join message to ask for a
+    codec.
+
+    codec: TextCodec or BinaryCodec - the codec
+    '''
+    return CODEC_OPTION + codec.name
+
+
+def split_option(parts):
+    '''
+    Removes a codec option from the words of a start or join message and
+    returns a tuple of (words, codec). The codec is None if none was asked
+    for, and TEXT_CODEC if an unknown one was.
+
+    parts: [str] - the words of the message
+    '''
+    codec = None
+    words = []
+    for part in parts:
+        if part.startswith(CODEC_OPTION):
+            codec = CODECS.get(part[len(CODEC_OPTION):], TEXT_CODEC)
+        else:
+            words.append(part)
+    return (words, codec)
+
+
+class CodecError(Exception):
+    '''
+    Raised when a message cannot be encoded or decoded.
+    '''
+    pass
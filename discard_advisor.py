@@ -0,0 +1,243 @@
+'''
+The `discard_advisor` module finds the best cards to discard from a five card
+draw hand. Every allowed discard (standing pat, or throwing up to MAX_DISCARD
+cards) is scored exactly by enumerating every possible replacement draw from
+the 47 unseen cards. The score of a final hand is its equity against a random
+five card hand: the share of all hands it beats, counting ties as half. The
+discard with the highest expected score wins.
+
+Enumerating takes a fraction of a second, so answers are memoized by suit
+class (see hand_classes). The full table of classes can be built once with
+`discard_advisor.py build` and is loaded lazily from DISCARD_TABLE_PATH the
+first time advice is asked for. Classes missing from the table are computed
+on demand and kept in a size bounded cache.
+'''
+
+import concurrent.futures
+import itertools
+import os
+import struct
+import sys
+
+import cards
+import hand_classes
+import hand_evaluator
+
+DISCARD_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discard_table.bin')
+
+# Table file layout: a header, then one record per class
+TABLE_MAGIC = b'DSC1'
+_HEADER = struct.Struct('<4sI')  # magic, number of records
+_RECORD = struct.Struct('<IBf')  # class id, discard mask, expected score
+
+# class id -> (discard mask, expected score), loaded from the table file.
+# The mask has bit i set to discard the i-th card of the class's sorted
+# canonical codes.
+_table = None
+
+# Classes missing from the table, computed on demand
+ANALYSIS_CACHE = hand_classes.LRUCache(8192)
+
+# strength -> score of a final hand, built on first use
+_scores = None
+
+
+def _hand_scores():
+    '''
+    Returns a dict mapping each strength to its equity against a random five
+    card hand.
+    '''
+    global _scores
+
+    if _scores is None:
+        counts = hand_evaluator.strength_counts()
+        total = sum(counts.values())
+        _scores = dict()
+        below = 0
+        for strength in sorted(counts):
+            _scores[strength] = (below + counts[strength] / 2) / total
+            below += counts[strength]
+
+    return _scores
+
+
+def discard_options(codes):
+    '''
+    Returns the expected final score of every allowed discard as a list of
+    (mask, score) tuples, bit i of the mask being the i-th card of `codes`.
+    The empty mask is standing pat.
+
+    codes: [int] - the five card codes of the hand
+    '''
+    scores = _hand_scores()
+    evaluate = hand_evaluator.evaluate
+    stub = [code for code in range(cards.NUM_CARDS_IN_DECK) if code not in codes]
+    positions = range(cards.NUM_CARDS_IN_HAND)
+
+    options = []
+    for num_discard in range(cards.MAX_DISCARD + 1):
+        draws = list(itertools.combinations(stub, num_discard))
+        for thrown in itertools.combinations(positions, num_discard):
+            kept = tuple(code for i, code in enumerate(codes) if i not in thrown)
+            total = 0.0
+            for draw in draws:
+                total += scores[evaluate(kept + draw)]
+
+            mask = 0
+            for i in thrown:
+                mask |= 1 << i
+            options.append((mask, total / len(draws)))
+
+    return options
+
+
+def analyze(codes):
+    '''
+    Returns the best discard for a hand as a (mask, score) tuple, bit i of
+    the mask being the i-th card of `codes`. Always enumerates; best_discard
+    is the cached entry point.
+
+    codes: [int] - the five card codes of the hand
+    '''
+    return max(discard_options(codes), key=lambda option: option[1])
+
+
+def best_discard(hand):
+    '''
+    Returns the 1-indexed positions of the cards to discard from a hand, an
+    empty list meaning stand pat, and the expected score of the result as a
+    tuple: (positions, score).
+
+    hand: Hand or [int] - a full hand, as a Hand or card codes
+    '''
+    global _table
+
+    codes = list(hand.codes) if isinstance(hand, cards.Hand) else list(hand)
+    if len(codes) != cards.NUM_CARDS_IN_HAND:
+        raise ValueError('hand must have exactly 5 cards')
+
+    if _table is None:
+        _table = load_table(DISCARD_TABLE_PATH) if os.path.exists(DISCARD_TABLE_PATH) else dict()
+
+    canon = hand_classes.canonicalize(codes)
+    ordered = sorted(canon)
+    c_id = hand_classes.pack(ordered)
+
+    if c_id in _table:
+        mask, score = _table[c_id]
+    else:
+        mask, score = ANALYSIS_CACHE.get(c_id, lambda: analyze(ordered))
+
+    # Map the mask over the sorted canonical codes back onto this hand
+    positions = []
+    for i, code in enumerate(canon):
+        if mask >> ordered.index(code) & 1:
+            positions.append(i + 1)
+
+    return (positions, score)
+
+
+def load_table(path):
+    '''
+    Reads a table written by save_table and returns it as a dict.
+
+    path: str - the table file
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    magic, num_records = _HEADER.unpack_from(data)
+    if magic != TABLE_MAGIC:
+        raise ValueError('not a discard table: ' + path)
+
+    table = dict()
+    for c_id, mask, score in _RECORD.iter_unpack(data[_HEADER.size:_HEADER.size + num_records * _RECORD.size]):
+        table[c_id] = (mask, score)
+    return table
+
+
+def save_table(table, path):
+    '''
+    Writes a table of class id -> (mask, score) to a file. The file is
+    written next to the target and renamed into place, so a reader never
+    sees a partial table.
+
+    table: dict - the table to write
+    path: str - the table file
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(TABLE_MAGIC, len(table)))
+        for c_id in sorted(table):
+            mask, score = table[c_id]
+            f.write(_RECORD.pack(c_id, mask, score))
+    os.replace(tmp_path, path)
+
+
+def _analyze_class(c_id):
+    '''
+    Worker entry point for build_table.
+
+    c_id: int - a class id
+    '''
+    return (c_id, analyze(hand_classes.unpack(c_id)))
+
+
+def build_table(path=DISCARD_TABLE_PATH, workers=None):
+    '''
+    Computes the best discard for every suit class of five card hands and
+    saves the table. This enumerates all 134,459 classes and takes hours of
+    CPU time, so it is meant to be run once, offline, with a worker process
+    per CPU.
+
+    path: str - the table file to write
+    workers: int - worker processes to use; None for one per CPU
+    '''
+    class_ids = set()
+    for hand in itertools.combinations(range(cards.NUM_CARDS_IN_DECK), cards.NUM_CARDS_IN_HAND):
+        class_ids.add(hand_classes.class_id(hand))
+
+    table = dict()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for c_id, best in executor.map(_analyze_class, sorted(class_ids), chunksize=64):
+            table[c_id] = best
+
+    save_table(table, path)
+    return table
+
+
+def main(argv):
+    if len(argv) >= 2 and argv[1] == 'build':
+        path = argv[2] if len(argv) > 2 else DISCARD_TABLE_PATH
+        table = build_table(path)
+        print('Wrote {} classes to {}'.format(len(table), path))
+        return
+
+    if len(argv) != 6:
+        help()
+        sys.exit(1)
+
+    try:
+        hand = [cards.Card(rep[0], rep[1:]).code for rep in argv[1:6]]
+    except ValueError:
+        print('invalid cards')
+        help()
+        sys.exit(1)
+
+    positions, score = best_discard(hand)
+    print('Discard:', ' '.join(str(pos) for pos in positions) or 'none')
+    print('Expected score: {:.4f}'.format(score))
+
+
+def help():
+    '''
+    Prints a usage help message.
+    '''
+    print('usage:')
+    print('discard_advisor.py <card> <card> <card> <card> <card>')
+    print('or')
+    print('discard_advisor.py build [table_path]')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
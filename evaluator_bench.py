@@ -0,0 +1,329 @@
+'''
+The `evaluator_bench` module benchmarks and verifies the hand evaluators. It
+runs all 2,598,960 five card hands through GameStateManager.score_player,
+hand_evaluator.evaluate and, when numpy is installed,
+hand_evaluator.evaluate_batch. For each it reports hands per second and the
+number of hands in each category, checked against the known totals. It then
+compares the evaluator's tie breaking with a slow reference implementation
+on random pairs of hands.
+
+The report is printed as JSON, and the exit status is 1 if any check failed,
+so the script can gate changes to the evaluators:
+
+    evaluator_bench.py [output_path] [num_pairs] [seed]
+'''
+
+import itertools
+import json
+import random
+import sys
+import time
+
+import cards
+import game_state_manager as gsm
+import hand_evaluator
+
+DEFAULT_PAIRS = 100000
+TOTAL_HANDS = 2598960
+
+# Number of hands in each score_player score, 0 (royal flush) to 9 (high card)
+EXPECTED_SCORES = {
+    'royal flush': 4,
+    'straight flush': 36,
+    'four of a kind': 624,
+    'full house': 3744,
+    'flush': 5108,
+    'straight': 10200,
+    'three of a kind': 54912,
+    'two pair': 123552,
+    'one pair': 1098240,
+    'high card': 1302540,
+}
+SCORE_NAMES = list(EXPECTED_SCORES)
+
+
+def all_hands():
+    '''
+    Returns an iterator over every five card hand as a tuple of card codes.
+    '''
+    return itertools.combinations(range(cards.NUM_CARDS_IN_DECK), cards.NUM_CARDS_IN_HAND)
+
+
+def _check_counts(counts):
+    '''
+    Returns a report of category counts, each compared with its known total.
+
+    counts: dict - category name -> number of hands found
+    '''
+    ok = all(counts.get(name, 0) == total for name, total in EXPECTED_SCORES.items())
+    return {'categories': counts, 'categories_ok': ok}
+
+
+def _timed(hands_seen, started):
+    '''
+    Returns the timing part of a report.
+
+    hands_seen: int - the number of hands evaluated
+    started: float - the perf_counter time evaluation started
+    '''
+    seconds = time.perf_counter() - started
+    return {
+        'hands': hands_seen,
+        'seconds': round(seconds, 3),
+        'hands_per_sec': round(hands_seen / seconds) if seconds else None,
+    }
+
+
+def bench_score_player():
+    '''
+    Scores every hand through GameStateManager.score_player, the path the
+    server uses at showdown.
+    '''
+    manager = gsm.GameStateManager(2, 5, 1)
+    p_id = manager.join(None, None, 'bench')
+    card_objs = cards.CARDS
+
+    counts = [0] * len(SCORE_NAMES)
+    started = time.perf_counter()
+    for codes in all_hands():
+        manager.store_hand(p_id, [card_objs[code] for code in codes])
+        counts[manager.score_player(p_id)] += 1
+
+    report = _timed(TOTAL_HANDS, started)
+    report.update(_check_counts(dict(zip(SCORE_NAMES, counts))))
+    return report
+
+
+def bench_evaluate():
+    '''
+    Scores every hand through hand_evaluator.evaluate.
+    '''
+    evaluate = hand_evaluator.evaluate
+    strength_counts = dict()
+    started = time.perf_counter()
+    for codes in all_hands():
+        strength = evaluate(codes)
+        strength_counts[strength] = strength_counts.get(strength, 0) + 1
+
+    report = _timed(TOTAL_HANDS, started)
+    report.update(_check_counts(_name_counts(strength_counts)))
+    report['distinct_strengths'] = len(strength_counts)
+    return report
+
+
+def bench_evaluate_batch():
+    '''
+    Scores every hand through hand_evaluator.evaluate_batch in one call.
+    Returns None if numpy is not installed.
+    '''
+    np = hand_evaluator.np
+    if np is None:
+        return None
+
+    hands = np.fromiter(
+        itertools.chain.from_iterable(all_hands()), dtype=np.int64).reshape(-1, 5)
+
+    started = time.perf_counter()
+    strengths = hand_evaluator.evaluate_batch(hands)
+    report = _timed(TOTAL_HANDS, started)
+
+    values, totals = np.unique(strengths, return_counts=True)
+    strength_counts = dict(zip(values.tolist(), totals.tolist()))
+    report.update(_check_counts(_name_counts(strength_counts)))
+    return report
+
+
+def _name_counts(strength_counts):
+    '''
+    Totals strength counts by score_player category name.
+
+    strength_counts: dict - strength -> number of hands
+    '''
+    counts = dict()
+    for strength, num in strength_counts.items():
+        name = hand_evaluator.describe(strength)
+        counts[name] = counts.get(name, 0) + num
+    return counts
+
+
+def reference_key(codes):
+    '''
+    Returns a tuple that orders hands the way poker does, computed the slow
+    and obvious way. Used to check the evaluator's tie breaking.
+
+    codes: [int] - the five card codes of a hand
+    '''
+    values = sorted((cards.code_value(code) for code in codes), reverse=True)
+    suits = set(cards.code_suit(code) for code in codes)
+
+    # Group equal values, bigger groups first, then higher values
+    groups = sorted(set(values), key=lambda v: (values.count(v), v), reverse=True)
+    shape = [values.count(v) for v in groups]
+
+    if values == [14, 5, 4, 3, 2]:
+        values = [5, 4, 3, 2, 1]
+    is_straight = len(groups) == 5 and values[0] - values[4] == 4
+    is_flush = len(suits) == 1
+
+    if is_straight and is_flush:
+        rank = 8
+    elif shape == [4, 1]:
+        rank = 7
+    elif shape == [3, 2]:
+        rank = 6
+    elif is_flush:
+        rank = 5
+    elif is_straight:
+        rank = 4
+    elif shape == [3, 1, 1]:
+        rank = 3
+    elif shape == [2, 2, 1]:
+        rank = 2
+    elif shape == [2, 1, 1, 1]:
+        rank = 1
+    else:
+        rank = 0
+
+    if is_straight:
+        return (rank, values)
+    return (rank, groups)
+
+
+def check_tie_breaks(num_pairs, seed):
+    '''
+    Compares random pairs of hands with the evaluator and with reference_key
+    and reports how many pairs they order differently.
+
+    num_pairs: int - the number of pairs to compare
+    seed: int - seed for choosing the pairs
+    '''
+    rng = random.Random(seed)
+    deck = list(range(cards.NUM_CARDS_IN_DECK))
+    num_mismatches = 0
+    examples = []
+    num_ties = 0
+
+    for _ in range(num_pairs):
+        a = rng.sample(deck, cards.NUM_CARDS_IN_HAND)
+        # Half of the pairs share a category, where tie breaking matters
+        if rng.random() < 0.5:
+            b = _same_category_hand(rng, deck, a)
+        else:
+            b = rng.sample(deck, cards.NUM_CARDS_IN_HAND)
+
+        fast = _sign(hand_evaluator.evaluate(a) - hand_evaluator.evaluate(b))
+        ref_a = reference_key(a)
+        ref_b = reference_key(b)
+        ref = (ref_a > ref_b) - (ref_a < ref_b)
+        if ref == 0:
+            num_ties += 1
+        if fast != ref:
+            num_mismatches += 1
+            if len(examples) < 10:
+                examples.append([a, b])
+
+    return {
+        'pairs': num_pairs,
+        'seed': seed,
+        'ties': num_ties,
+        'mismatches': num_mismatches,
+        'examples': examples,
+        'ok': num_mismatches == 0,
+    }
+
+
+def _same_category_hand(rng, deck, hand):
+    '''
+    Returns a random hand in the same category as the given one, trying a
+    bounded number of times before settling for any hand.
+
+    rng: Random - the random stream
+    deck: [int] - every card code
+    hand: [int] - the hand to match
+    '''
+    target = hand_evaluator.category(hand_evaluator.evaluate(hand))
+    for _ in range(200):
+        other = rng.sample(deck, cards.NUM_CARDS_IN_HAND)
+        if hand_evaluator.category(hand_evaluator.evaluate(other)) == target:
+            return other
+    return other
+
+
+def _sign(num):
+    return (num > 0) - (num < 0)
+
+
+def run(num_pairs=DEFAULT_PAIRS, seed=0):
+    '''
+    Runs every benchmark and check and returns the report as a dict.
+
+    num_pairs: int - the number of random pairs for the tie break check
+    seed: int - seed for the tie break check
+    '''
+    report = {
+        'python': sys.version.split()[0],
+        'evaluators': {
+            'score_player': bench_score_player(),
+            'evaluate': bench_evaluate(),
+        },
+    }
+
+    batch = bench_evaluate_batch()
+    if batch is None:
+        report['evaluators']['evaluate_batch'] = {'skipped': 'numpy not installed'}
+    else:
+        report['evaluators']['evaluate_batch'] = batch
+
+    report['tie_breaks'] = check_tie_breaks(num_pairs, seed)
+
+    evaluators = [r for r in report['evaluators'].values() if 'skipped' not in r]
+    report['ok'] = (
+        all(r['categories_ok'] for r in evaluators)
+        and report['tie_breaks']['ok'])
+    return report
+
+
+def main(argv):
+    output_path, num_pairs, seed = get_cmd_args(argv)
+    report = run(num_pairs, seed)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output_path:
+        with open(output_path, 'w') as f:
+            f.write(text + '\n')
+
+    sys.exit(0 if report['ok'] else 1)
+
+
+def get_cmd_args(argv):
+    '''
+    Validates command line arguments and returns a tuple of
+    (output_path, num_pairs, seed). All are optional.
+    '''
+    if len(argv) > 4:
+        help()
+        sys.exit(1)
+
+    output_path = argv[1] if len(argv) > 1 else None
+    try:
+        num_pairs = int(argv[2]) if len(argv) > 2 else DEFAULT_PAIRS
+        seed = int(argv[3]) if len(argv) > 3 else 0
+    except ValueError:
+        print('num_pairs and seed must be integers')
+        help()
+        sys.exit(1)
+
+    return (output_path, num_pairs, seed)
+
+
+def help():
+    '''
+    Prints a usage help message.
+    '''
+    print('usage:')
+    print('evaluator_bench.py [output_path] [num_pairs] [seed]')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,387 @@
+'''
+The `framing` module splits the TCP byte stream between the poker server and
+its clients back into the messages that were sent. TCP does not keep message
+boundaries, so two sends can arrive in one recv or one send across two. Every
+message is therefore sent with a 4 byte big-endian length in front of it, and
+the receiving side buffers bytes until a whole message is there.
+
+Connection wraps a connected socket with this framing, so messages can be
+sent back to back without any pause between them. AsyncConnection does the
+same for asyncio streams, for the server. Both encode the messages of a game
+with a codec (see the codec module), text until another is agreed on.
+'''
+
+import asyncio
+import socket
+import struct
+import time
+
+import codec
+
+# Length prefix in front of every message
+HEADER = struct.Struct('!I')
+
+# Largest message accepted, to stop a bad peer making us buffer forever
+MAX_MESSAGE_SIZE = 1 << 20
+
+# Bytes asked for per recv call
+RECV_SIZE = 4096
+
+
+class _Messages:
+    '''
+    The typed messages both kinds of connection send, each encoded with the
+    connection's codec.
+    '''
+
+    codec = codec.TEXT_CODEC
+
+    def send_cards(self, codes):
+        self.send(self.codec.encode_cards(codes), 'cards')
+
+    def send_bet_prompt(self, max_bet, curr_bet, first):
+        self.send(self.codec.encode_bet_prompt(max_bet, curr_bet, first), 'bet_prompt')
+
+    def send_action(self, action, player_id, amt=0):
+        self.send(self.codec.encode_action(action, player_id, amt), 'action')
+
+    def send_discard(self, positions):
+        self.send(self.codec.encode_discard(positions), 'discard')
+
+
+class Connection(_Messages):
+    '''
+    A socket that sends and receives whole messages.
+    '''
+
+    def __init__(self, sock):
+        '''
+        Wraps a connected socket.
+
+        sock: socket - a connected TCP socket
+        '''
+        self.sock = sock
+        self.buffer = bytearray()
+
+        # Messages are small and often answered right away, so send them
+        # without waiting to fill a packet.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, message, kind='text'):
+        '''
+        Sends one message.
+
+        message: str or bytes - the message; str is sent as text with the
+                                connection's codec, bytes as they are
+        kind: str - the kind of message, for AsyncConnection's stats
+        '''
+        if isinstance(message, str):
+            message = self.codec.encode_text(message)
+        self.sock.sendall(encode_frame(message))
+
+    def recv(self):
+        '''
+        Waits for the next message and returns it decoded as a str.
+        '''
+        return self.codec.decode_text(self.recv_bytes())
+
+    def recv_cards(self):
+        return self.codec.decode_cards(self.recv_bytes())
+
+    def recv_bet_prompt(self):
+        return self.codec.decode_bet_prompt(self.recv_bytes())
+
+    def recv_action(self):
+        return self.codec.decode_action(self.recv_bytes())
+
+    def recv_discard(self):
+        return self.codec.decode_discard(self.recv_bytes())
+
+    def recv_bytes(self):
+        '''
+        Waits for the next message and returns it as bytes. Raises a
+        ConnectionClosedError if the peer closes the connection first.
+        '''
+        while True:
+            message = pop_frame(self.buffer)
+            if message is not None:
+                return message
+
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionClosedError('connection closed by peer')
+            self.buffer += data
+
+    def close(self):
+        '''
+        Closes the socket.
+        '''
+        self.sock.close()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+
+class AsyncConnection(_Messages):
+    '''
+    The asyncio version of Connection. Each connection runs a reader task,
+    which moves whole messages from the stream into an inbox queue, and a
+    writer task, which writes queued messages out. Sending only queues the
+    message, so a client that reads slowly or not at all never holds up the
+    code sending to it, or any other connection.
+    '''
+
+    def __init__(self, reader, writer, stats=None):
+        '''
+        Wraps a connected stream pair and starts its reader and writer tasks.
+        Must be called from a running event loop.
+
+        reader: StreamReader - the stream to read messages from
+        writer: StreamWriter - the stream to write messages to
+        stats: ConnectionStats - optional, records every message sent and
+                                 received (see net_stats)
+        '''
+        self.reader = reader
+        self.writer = writer
+        self.stats = stats
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+        self.closed = False
+        # Incoming messages are dropped until one equal to this arrives, or
+        # skips_left others have been dropped
+        self.skipping_to = None
+        self.skips_left = 0
+
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.reader_task = asyncio.ensure_future(self._read_messages())
+        self.writer_task = asyncio.ensure_future(self._write_messages())
+
+    def send(self, message, kind='text'):
+        '''
+        Queues one message to be sent. Messages sent after close are dropped.
+
+        message: str or bytes - the message; str is sent as text with the
+                                connection's codec, bytes as they are
+        kind: str - the kind of message, for the stats
+        '''
+        if self.closed:
+            return
+        if isinstance(message, str):
+            message = self.codec.encode_text(message)
+        frame = encode_frame(message)
+        if self.stats is not None:
+            self.stats.sent(kind, len(frame))
+        self.outbox.put_nowait(frame)
+
+    async def recv(self):
+        '''
+        Waits for the next message and returns it decoded as a str.
+        '''
+        return self.codec.decode_text(await self.recv_bytes('text'))
+
+    async def recv_cards(self):
+        return self.codec.decode_cards(await self.recv_bytes('cards'))
+
+    async def recv_bet_prompt(self):
+        return self.codec.decode_bet_prompt(await self.recv_bytes('bet_prompt'))
+
+    async def recv_action(self):
+        return self.codec.decode_action(await self.recv_bytes('action'))
+
+    async def recv_discard(self):
+        return self.codec.decode_discard(await self.recv_bytes('discard'))
+
+    async def recv_bytes(self, kind='bytes'):
+        '''
+        Waits for the next message and returns it as bytes. Raises a
+        ConnectionClosedError if the peer closes the connection first, or a
+        ReceiveTimeoutError if expire is called while waiting.
+
+        kind: str - the kind of message expected, for the stats
+        '''
+        while True:
+            message = await self.inbox.get()
+            if message is _CLOSED:
+                # Leave the marker for any later recv
+                self.inbox.put_nowait(_CLOSED)
+                raise ConnectionClosedError('connection closed by peer')
+            if message is _EXPIRED:
+                raise ReceiveTimeoutError('no message before the deadline')
+
+            message, arrived = message
+            if self.skips_left == 0 and message != self.skipping_to:
+                # The peer never marked the end, so this one is kept
+                self.skipping_to = None
+            if self.skipping_to is not None:
+                if message == self.skipping_to:
+                    self.skipping_to = None
+                else:
+                    self.skips_left -= 1
+                if self.stats is not None:
+                    self.stats.received('skipped', HEADER.size + len(message), arrived)
+                continue
+
+            if self.stats is not None:
+                self.stats.received(kind, HEADER.size + len(message), arrived)
+            return message
+
+    def expire(self):
+        '''
+        Makes a waiting recv raise a ReceiveTimeoutError. Does nothing if a
+        message is already waiting to be received, so a reply that beat the
+        deadline is never lost.
+        '''
+        if self.inbox.empty():
+            self.inbox.put_nowait(_EXPIRED)
+
+    def skip_until(self, message, limit):
+        '''
+        Drops every message received from now on up to and including the
+        first one equal to `message`, but no more than `limit` others before
+        it, so a peer that never sends it only loses that many. Used to throw
+        away replies that arrive after their deadline, when the peer marks
+        the end of them.
+
+        message: str or bytes - the message that ends the skipped ones
+        limit: int - the most other messages to drop
+        '''
+        if isinstance(message, str):
+            message = self.codec.encode_text(message)
+        self.skipping_to = message
+        self.skips_left = limit
+
+    def close(self):
+        '''
+        Stops accepting messages to send. The writer task sends the ones
+        already queued and then closes the stream.
+        '''
+        if not self.closed:
+            self.closed = True
+            self.outbox.put_nowait(_CLOSED)
+
+    async def wait_closed(self):
+        '''
+        Closes the connection and waits until queued messages are sent.
+        '''
+        self.close()
+        await self.writer_task
+        self.reader_task.cancel()
+
+    def peername(self):
+        return self.writer.get_extra_info('peername')
+
+    async def _read_messages(self):
+        try:
+            while True:
+                header = await self.reader.readexactly(HEADER.size)
+                (length,) = HEADER.unpack(header)
+                if length > MAX_MESSAGE_SIZE:
+                    raise FramingError('message too large')
+                message = await self.reader.readexactly(length)
+
+                # Timed and counted as it comes in, not when the game gets
+                # round to it
+                arrived = time.perf_counter()
+                if self.stats is not None:
+                    self.stats.arrived(HEADER.size + length)
+                self.inbox.put_nowait((message, arrived))
+        except (asyncio.IncompleteReadError, ConnectionError, FramingError):
+            pass
+        finally:
+            self.inbox.put_nowait(_CLOSED)
+
+    async def _write_messages(self):
+        writer = self.writer
+        try:
+            while True:
+                frame = await self.outbox.get()
+                if frame is _CLOSED:
+                    break
+                writer.write(frame)
+
+                # Write everything already queued before waiting on the socket
+                while not self.outbox.empty():
+                    frame = self.outbox.get_nowait()
+                    if frame is _CLOSED:
+                        await writer.drain()
+                        return
+                    writer.write(frame)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+# Queued in place of a message when a connection closes
+_CLOSED = object()
+
+# Queued in place of a message when a deadline passes
+_EXPIRED = object()
+
+
+def connect(address):
+    '''
+    Connects to a server and returns the Connection.
+
+    address: (host, port) - the server address
+    '''
+    return Connection(socket.create_connection(address))
+
+
+def encode_frame(message):
+    '''
+    Returns the bytes sent for a message: its length, then the message.
+
+    message: bytes - the message
+    '''
+    if len(message) > MAX_MESSAGE_SIZE:
+        raise FramingError('message too large')
+    return HEADER.pack(len(message)) + message
+
+
+def pop_frame(buffer):
+    '''
+    Removes the first whole message from a receive buffer and returns it,
+    or returns None if the buffer does not hold a whole message yet.
+
+    buffer: bytearray - bytes received and not yet returned as messages
+    '''
+    if len(buffer) < HEADER.size:
+        return None
+
+    (length,) = HEADER.unpack_from(buffer)
+    if length > MAX_MESSAGE_SIZE:
+        raise FramingError('message too large')
+
+    end = HEADER.size + length
+    if len(buffer) < end:
+        return None
+
+    message = bytes(buffer[HEADER.size:end])
+    del buffer[:end]
+    return message
+
+
+class FramingError(Exception):
+    '''
+    Raised when a message is too large or the stream is corrupt.
+    '''
+    pass
+
+
+class ReceiveTimeoutError(Exception):
+    '''
+    Raised when a message is not received before its deadline.
+    '''
+    pass
+
+
+class ConnectionClosedError(Exception):
+    '''
+    Raised when the peer closes the connection while a message is awaited.
+    '''
+    pass
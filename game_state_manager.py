@@ -5,7 +5,24 @@ viewed in Google Docs here:
 https://docs.google.com/document/d/1p03ydY3g0QY7WARs0TSkFAcQ-Ut0rUP-xKc40t47tTs/edit?usp=sharing
 '''
 
+import struct
+
 import cards
+import codec
+import hand_evaluator
+
+# A snapshot is a table header, the seed, then every seat taken, each
+# followed by the player's name. The hand being played is not kept: a
+# restored hand is called off, and the next one is shuffled from the seed
+# and hand_no.
+_SNAPSHOT = struct.Struct('!BQQIBBBH')  # num players, wallet, ante, hand_no,
+                                        # next_id, turn_id, players seated,
+                                        # seed length or NO_SEED
+_SEAT = struct.Struct('!BQH')  # flags, wallet, name length
+NO_SEED = 0xFFFF
+
+# Seat flags
+LEFT = 1
 
 class GameStateManager:
     '''
@@ -14,7 +31,7 @@ class GameStateManager:
     before using these methods.
     '''
 
-    def __init__(self, num_players, wallet_amt, ante_amt):
+    def __init__(self, num_players, wallet_amt, ante_amt, seed=None, recorder=None):
         '''
         Creates the GameManager.
 
@@ -22,17 +39,17 @@ class GameStateManager:
         wallet_amt: int - Initial amount of money in each player's wallet. 
                           Basically, the buy in amount. Min: 5
         ante_amt: int - The amount each player needs to ante per round.
+        seed: int - Optional. Seeds the table's deck so every hand can be
+                    replayed from (seed, hand_no).
+        recorder: Recorder - Optional. Records every change to the game in
+                             a hand log (see the hand_log module).
         '''
-        # Simple constants
-        # Player info
-        self.p_addr_key = 'addr'
-        self.p_name_key = 'name'
-        self.p_conn_key = 'conn'
+        self.recorder = recorder
 
         # Game specific set up
-        self.start(num_players, wallet_amt, ante_amt)
+        self.start(num_players, wallet_amt, ante_amt, seed)
 
-    def start(self, num_players, wallet_amt, ante_amt):
+    def start(self, num_players, wallet_amt, ante_amt, seed=None):
         '''
         Instructs the server to set up a game of poker with the given number of
         players and to give each player the specified amount of money to start.
@@ -44,19 +61,27 @@ class GameStateManager:
         wallet_amt: int - Initial amount of money in each player's wallet. 
                           Basically, the buy in amount. Min: 5
         ante_amt: int - The amount each player needs to ante per round.
+        seed: int - Optional. Seeds the table's deck.
         '''
         self.num_players = num_players
         self.wallet_amt = wallet_amt
         self.ante_amt = ante_amt
-        self.deck = cards.Deck()
-        self.players = dict()
-        self.final_hands = dict()
+        self.hand_no = 0  # incremented by reset for every new hand
+        self.deck = cards.Deck(seed)
+        # Seat of player ID p_id at index p_id - 1, None until taken. The
+        # seats of players still in the hand are also linked in a ring, in
+        # the same order (see Seat).
+        self.seats = [None] * num_players
+        self.num_seated = 0  # seats taken by players who have not left
+        self.num_folded = 0  # of those, players who have folded this hand
         self.next_id = 1  # incremented when players join
-        self.bets = BetInfo()
-        self.turn_id = 1  # ID of the player who's turn it is
-        self.folded_ids = set()  # IDs of players who have folded during betting
-        self.left_ids = set()
-        self.card_val = {} # record the number of cards for each player
+        self.bets = BetInfo(self.seats)
+        self.turn_id = 1  # ID of the player who bets first this hand
+        # Counts changes to the game, so a snapshot is only taken when needed
+        self.version = 0
+
+        if self.recorder is not None:
+            self.recorder.table(num_players, wallet_amt, ante_amt, seed)
 
     def join(self, connection, address_tup, player_name=''):
         '''
@@ -82,18 +107,48 @@ class GameStateManager:
         p_id = self.next_id
         self.next_id += 1
 
-        # Create a player as a dict
-        player = {
-            self.p_addr_key: address_tup,
-            self.p_name_key: player_name,
-            self.p_conn_key: connection
-        }
-
-        # Add to the players group
-        self.players[p_id] = player
+        # Seat the player
+        seat = Seat(p_id, connection, address_tup, player_name, self.wallet_amt)
+        self.seats[p_id - 1] = seat
+        self.num_seated += 1
+        self._link(seat)
 
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.joined(p_id, player_name)
         return p_id
 
+    def find_seat(self, player_name):
+        '''
+        Returns the ID of a player with the given name who has no connection,
+        because the game was restored from a snapshot, or None if there is
+        none. The name is all that is checked, as players have no password.
+
+        player_name: str - The player's name.
+        '''
+        for seat in self.seated():
+            if seat.conn is None and seat.name == player_name:
+                return seat.player_id
+        return None
+
+    def rejoin(self, player_id, connection, address_tup):
+        '''
+        Gives a player of a restored game their connection back.
+
+        player_id: int - The ID of the player.
+        connection: AsyncConnection - The player's new connection.
+        address_tup: (IP, PORT) - The player's address.
+        '''
+        seat = self.get_seat(player_id)
+        seat.conn = connection
+        seat.addr = address_tup
+
+    def get_num_connected(self):
+        '''
+        Returns the number of players in the game who have a connection.
+        '''
+        return sum(1 for seat in self.seated() if seat.conn is not None)
+
     def notify_all(self, message):
         '''
         Sends the given message to all players in the game. Keywords need to 
@@ -101,9 +156,9 @@ class GameStateManager:
 
         message: str - A message to send to every player.
         '''
-        for p_id in self.players:
-            conn = self.players[p_id][self.p_conn_key]
-            conn.send(message.encode())
+        for seat in self.seats:
+            if seat is not None and not seat.left and seat.conn is not None:
+                seat.conn.send(message)
 
     def notify_one(self, player_id, message):
         '''
@@ -113,14 +168,115 @@ class GameStateManager:
         player_id: int - The ID of the player.
         message: str - A message to send to the player.
         '''
-        conn = self.players[player_id][self.p_conn_key]
-        conn.send(message.encode())
+        self.get_seat(player_id).conn.send(message)
+
+    def get_seat(self, player_id):
+        '''
+        Returns the Seat of a player in the game. Raises a KeyError if there
+        is no such player or they have left.
+
+        player_id: int - The ID of the player.
+        '''
+        seat = None
+        if 0 < player_id <= self.num_players:
+            seat = self.seats[player_id - 1]
+        if seat is None or seat.left:
+            raise KeyError('player id not found')
+        return seat
+
+    def seated(self):
+        '''
+        Returns a list of the seats of the players in the game, in the order
+        they joined.
+        '''
+        return [seat for seat in self.seats if seat is not None and not seat.left]
+
+    def first_seat(self):
+        '''
+        Returns the seat of the player who bets first this hand, or of the
+        next player round the table if they are no longer in the hand.
+        '''
+        return self.seat_in_hand_from(self.turn_id)
+
+    def seat_in_hand_from(self, player_id):
+        '''
+        Returns the seat of the given player if they are still in the hand,
+        or else of the next player round the table who is. Returns None if
+        nobody is.
+
+        player_id: int - The ID of the player.
+        '''
+        seats = self.seats
+        num = self.num_players
+        for i in range(num):
+            seat = seats[(player_id - 1 + i) % num]
+            if seat is not None and seat.next is not None:
+                return seat
+        return None
+
+    def _link(self, seat):
+        '''
+        Puts a seat in the ring of players still in the hand, after the
+        nearest seat before it that is already there.
+
+        seat: Seat - The seat, not in the ring.
+        '''
+        seats = self.seats
+        num = self.num_players
+        index = seat.player_id - 1
+        for i in range(1, num):
+            prev = seats[(index - i) % num]
+            if prev is not None and prev.next is not None:
+                seat.prev = prev
+                seat.next = prev.next
+                prev.next.prev = seat
+                prev.next = seat
+                return
+        seat.prev = seat
+        seat.next = seat
+
+    def _unlink(self, seat):
+        '''
+        Takes a seat out of the ring of players still in the hand. Does
+        nothing if it is not there.
+
+        seat: Seat - The seat.
+        '''
+        if seat.next is None:
+            return
+        seat.prev.next = seat.next
+        seat.next.prev = seat.prev
+        seat.next = None
+        seat.prev = None
+
+    def _link_all(self):
+        '''
+        Links the seats of every player still in the hand into the ring, in
+        the order they joined.
+        '''
+        first = None
+        last = None
+        for seat in self.seats:
+            if seat is None or not seat.in_hand():
+                if seat is not None:
+                    seat.next = None
+                    seat.prev = None
+                continue
+            if first is None:
+                first = seat
+            else:
+                last.next = seat
+                seat.prev = last
+            last = seat
+        if first is not None:
+            last.next = first
+            first.prev = last
 
     def get_curr_num_players(self):
         '''
         Returns the number of players in the game currently.
         '''
-        return len(self.players)
+        return self.num_seated
 
     def get_player_conn(self, player_id):
         '''
@@ -128,7 +284,32 @@ class GameStateManager:
 
         player_id: int - The ID of the player.
         '''
-        return self.players[player_id][self.p_conn_key]
+        return self.get_seat(player_id).conn
+
+    def get_wallet(self, player_id):
+        '''
+        Returns the amount the player has left to bet.
+
+        player_id: int - The ID of the player.
+        '''
+        return self.get_seat(player_id).wallet
+
+    def is_all_in(self, player_id):
+        '''
+        Returns True if the player has bet everything they have this hand, so
+        they stay in the hand without betting any more.
+
+        player_id: int - The ID of the player.
+        '''
+        return self.seats[player_id - 1].all_in
+
+    def is_folded(self, player_id):
+        '''
+        Returns True if the player has folded this hand.
+
+        player_id: int - The ID of the player.
+        '''
+        return self.seats[player_id - 1].folded
 
     def set_name(self, player_id, name):
         '''
@@ -137,12 +318,9 @@ class GameStateManager:
         player_id: int - The ID of the player.
         name: string - The player’s name.
         '''
-        # Ensure this player is in the game
-        if player_id not in self.players:
-            raise KeyError('player id not found')
-
-        # Set the name
-        self.players[player_id][self.p_name_key] = name
+        # Raises a KeyError if this player is not in the game
+        self.get_seat(player_id).name = name
+        self.version += 1
 
     def bet_info(self, player_id):
         '''
@@ -159,61 +337,85 @@ class GameStateManager:
 
         return (pool_amt, max_bet, curr_bet)
 
+    def new_round(self):
+        '''
+        Starts a round of betting. Bets made so far in the hand still count
+        towards the pool and the call amount.
+        '''
+        self.bets.new_round()
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.new_round()
+
     def increment_turn(self):
         '''
-        Moves turn to the next player. Goes by the order players joined the game.
+        Moves turn to the next player, like a dealer button. Goes by the order players joined the game.
         Ignores any players who have folded or left the game.
         '''
-        num_folded = len(self.folded_ids)
-        num_left = len(self.left_ids)
-        num_out = num_folded + num_left
-        if self.num_players - num_out < 2:
+        if self.num_seated - self.num_folded < 2:
             # Turn would never change
             return
 
-        # For readability
-        turn = self.turn_id
+        seat = None
+        if 0 < self.turn_id <= self.num_players:
+            seat = self.seats[self.turn_id - 1]
+        if seat is not None and seat.next is not None:
+            seat = seat.next
+        else:
+            # The player is out, so the next one still in has the turn
+            seat = self.seat_in_hand_from(self.turn_id)
 
-        # Increment until valid turn found
-        turn = (turn + 1) % self.num_players
-        while (turn in self.folded_ids) or (turn in self.left_ids):
-            turn = (turn + 1) % self.num_players
-        
         # Set new turn
-        self.turn_id = turn
+        self.turn_id = seat.player_id
+        self.version += 1
 
     def leave(self, player_id):
         '''
         Removes the given player from the game, if the player exists. Notify all players.
-        Returns the player value. Raises a KeyError if the player is not found.
+        Returns the player's Seat. Raises a KeyError if the player is not found.
+        The seat stays taken, as the player's bets stay in the pool.
 
         player_id: int - The ID of the player.
         '''
-        self.left_ids.add(player_id)
-        player = self.players[player_id]
-        del self.players[player_id]
-        self.remove_hand(player_id)
-        return player  # ID is already known, as it was passed in
+        seat = self.get_seat(player_id)
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.action(player_id, codec.LEAVE)
+        self.bets.fold(seat)
+        self._unlink(seat)
+        if seat.folded:
+            self.num_folded -= 1
+        seat.left = True
+        seat.hand = None
+        self.num_seated -= 1
+        return seat
 
     def remove_hand(self, player_id):
-        if self.final_hands:
-            del self.final_hands[player_id]
+        self.seats[player_id - 1].hand = None
 
     def bet_raise(self, player_id, amt):
         '''
         Indicates the given player wants to raise by the given amount. Player
         will have to check that they have the funds to raise before calling this.
+        Raises a ValueError if the amount is negative.
 
         player_id: int - The ID of the player.
         amt: int - The amount to raise.
         '''
+        if amt < 0:
+            raise ValueError('cannot raise by a negative amount: {}'.format(amt))
+
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.action(player_id, codec.RAISE, amt)
+
         # Need to make sure raise is on top of the max bet so far
         _, max_bet, curr_bet = self.bet_info(player_id)
         call_amt = max_bet - curr_bet
         total_bet = call_amt + amt
 
         # Now bet the total.
-        self.bets.add_bet(player_id, total_bet)
+        self._bet(player_id, total_bet)
 
     def bet_call(self, player_id):
         '''
@@ -223,20 +425,45 @@ class GameStateManager:
 
         player_id: int - The ID of the player.
         '''
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.action(player_id, codec.CALL)
+
         _, max_bet, curr_bet = self.bet_info(player_id)
         call_amt = max_bet - curr_bet
 
-        self.bets.add_bet(player_id, call_amt)
+        self._bet(player_id, call_amt)
 
     def bet_check(self, player_id):
         '''
-        Indicates that the given player has checked during a round of betting. 
-        Only allowed by the person to start any given round of betting.
+        Indicates that the given player has checked during a round of betting:
+        they bet nothing more and stay in the hand. Only allowed by the person
+        to start any given round of betting.
 
         player_id: int - The ID of the player.
         '''
-        cur_bet = self.bets.get_player_bet(player_id)
-        self.bets.add_bet(player_id, cur_bet)
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.action(player_id, codec.CHECK)
+
+        self._bet(player_id, 0)
+
+    def _bet(self, player_id, amt):
+        '''
+        Moves the amount from the player's wallet into their bet. A player
+        who does not have that much bets everything they have instead, and is
+        then all in.
+
+        player_id: int - The ID of the player.
+        amt: int - The amount to bet.
+        '''
+        seat = self.seats[player_id - 1]
+        wallet = seat.wallet
+        if amt >= wallet:
+            amt = wallet
+            self.bets.all_in(seat)
+        seat.wallet = wallet - amt
+        self.bets.add_bet(seat, amt)
 
     def bet_fold(self, player_id):
         '''
@@ -245,8 +472,17 @@ class GameStateManager:
 
         player_id: int - The ID of the player.
         '''
-        self.folded_ids.add(player_id)
-        self.remove_hand(player_id)
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.action(player_id, codec.FOLD)
+
+        seat = self.seats[player_id - 1]
+        self.bets.fold(seat)
+        self._unlink(seat)
+        if not seat.folded:
+            seat.folded = True
+            self.num_folded += 1
+        seat.hand = None
 
     def is_betting_over(self):
         '''
@@ -260,23 +496,18 @@ class GameStateManager:
         has been won: (betting_over, hand_won)
         '''
         # The above description is just a suggestion
-        cur_plays_num = len(self.players)
-        if cur_plays_num - len(self.folded_ids) < 1:
+        num_in = self.num_seated - self.num_folded
+        if num_in < 1:
             raise GameFullError(
                 "There is no one in the game")
 
-        if cur_plays_num - len(self.folded_ids) == 1:
+        if num_in == 1:
             return (True, True)
 
-        cur_bets = -1
-        for p_id in self.players:
-            if p_id in self.folded_ids:
-                continue
-            if cur_bets == -1:
-                cur_bets = self.bets.get_player_bet(p_id)
-            elif cur_bets != self.bets.get_player_bet(p_id):
-                return (False, False)
-        return (True, False)
+        # Players who are all in have nothing left to match with
+        num_to_act = num_in - self.bets.num_all_in
+        bets = self.bets
+        return (bets.num_acted == num_to_act and bets.all_matched(num_to_act), False)
 
     def get_cards(self, num_cards):
         '''
@@ -287,11 +518,8 @@ class GameStateManager:
             raise ValueError(
                 'invalid number of cards, must be within the range of cards in a hand')
 
-        card_list = []
-        for _ in range(num_cards):
-            card_list.append(self.deck.deal_card())
-
-        return card_list
+        self.version += 1
+        return [cards.CARDS[code] for code in self.deck.deal_n(num_cards)]
 
     def store_hand(self, player_id, card_list):
         '''
@@ -307,11 +535,20 @@ class GameStateManager:
         for card in card_list:
             hand.add_card(card)
 
-        self.final_hands[player_id] = hand
+        self.seats[player_id - 1].hand = hand
+
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.dealt(player_id, hand.codes)
 
     def add_cards(self, player_id, card_list):
+        hand = self.seats[player_id - 1].hand
         for card in card_list:
-            self.final_hands[player_id].add_card(card)
+            hand.add_card(card)
+
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.drew(player_id, [card.code for card in card_list])
 
     def delete_cards(self, player_id, card_list):
         l = len(card_list)
@@ -321,238 +558,118 @@ class GameStateManager:
             raise ValueError('cannot dicard more cards than allowed in a hand')
         card_list.sort(reverse=True)
 
+        hand = self.seats[player_id - 1].hand
         for card in card_list:
-            self.final_hands[player_id].remove_card(card)
+            hand.remove_card(card)
+
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.discarded(player_id, card_list)
 
     def evaluate_hands(self):
         '''
         Evaluates player hands at the end of a round of betting and determines
-        the winner.
+        the winner. Returns a list of the IDs of the players with the best
+        hand, which has more than one ID if the pool is split.
         '''
         # NOTE: Needs to empty the evaluated hands after, add back to deck,
         # and shuffle for next round.
-        for p_id in self.final_hands:
-            counts = self.get_counts(p_id)
-            self.card_val[p_id] = counts
-
-        win_score = [[] for _ in range(10)]
-        for p_id in self.final_hands:
-            win_score[self.score_player(p_id)].append(p_id)
-
-        # all people have royal flush would be the winner
-        if win_score[0]:
-            return win_score[0]
-
-        # people who have straight flush would be the winner. If more than one person, compare the highest rank
-        if win_score[1]:
-            if len(win_score[1]) < 2:
-                return win_score[1]
-            return self.rank_high(win_score[1])
-
-        # people who have four of a kind would be the winner. If more than one person, compare the highest rank
-        if win_score[2]:
-            if len(win_score[2]) < 2:
-                return win_score[2]
-            return self.rank_high(win_score[2])
-
-        # people who have full house would be the winner. If more than one person, compare the highest rank
-        if win_score[3]:
-            if len(win_score[3]) < 2:
-                return win_score[3]
-            return self.rank_high(win_score[3])
-
-        # people who have flush would be the winner. If more than one person, compare the highest rank
-        if win_score[4]:
-            if len(win_score[4]) < 2:
-                return win_score[4]
-            return self.rank_high(win_score[4])
-
-        # people who have straight would be the winner. If more than one person, compare the highest rank
-        if win_score[5]:
-            if len(win_score[5]) < 2:
-                return win_score[5]
-            return self.rank_high(win_score[5])
-
-        # people who have three of a kind would be the winner. If more than one person, compare the highest rank
-        if win_score[6]:
-            if len(win_score[6]) < 2:
-                return win_score[6]
-            return self.rank_high(win_score[6])
-
-        # people who have two pairs would be the winner. If more than one person, compare the highest rank
-        if win_score[7]:
-            if len(win_score[7]) < 2:
-                return win_score[7]
-            return self.rank_high(win_score[7])
-
-        # people who have pair would be the winner. If more than one person, compare the highest rank
-        if win_score[8]:
-            if len(win_score[8]) < 2:
-                return win_score[8]
-            return self.rank_high(win_score[8])
-
-        return self.high_card()
+        winners = []
+        best_key = -1
+        for seat in self.seats:
+            if seat is None or seat.hand is None:
+                continue
+            key = seat.hand.rank_key()
+            if key > best_key:
+                best_key = key
+                winners = [seat.player_id]
+            elif key == best_key:
+                winners.append(seat.player_id)
+
+        if self.recorder is not None:
+            self.recorder.showdown(winners)
+        return winners
+
+    def settle(self):
+        '''
+        Splits the betting pool between the players and adds their winnings
+        to their wallets. Returns a dict of player ID -> amount won, for the
+        players who won anything.
+
+        Players who are all in can only win as much from each other player as
+        they bet themselves, so the pool is split into a main pot and side
+        pots. Sorted by the amount bet, each new amount starts a pot that
+        everyone who bet at least that much paid into. The pot goes to the
+        best hand among those players who are still in the hand, split
+        evenly on a tie. Bets above what anyone still in the hand paid, left
+        by players who folded, go to the highest pot that has a winner.
+        '''
+        contribs = sorted(
+            (seat for seat in self.seats if seat is not None and seat.has_bet),
+            key=lambda seat: seat.bet)
+        num = len(contribs)
+
+        # From the biggest bet down, the winners among everyone who bet at
+        # least as much as each player. The winner list only grows or is
+        # replaced, so each entry keeps the list and its length at the time.
+        best_key = -1
+        winners = []
+        suffix_winners = [None] * num
+        for i in range(num - 1, -1, -1):
+            seat = contribs[i]
+            if seat.hand is not None:
+                key = seat.hand.rank_key()
+                if key > best_key:
+                    best_key = key
+                    winners = [seat.player_id]
+                elif key == best_key:
+                    winners.append(seat.player_id)
+            suffix_winners[i] = (winners, len(winners))
+
+        # From the smallest bet up, one pot per amount bet
+        pots = []  # [amount, winner IDs], main pot first
+        prev_amt = 0
+        for i, seat in enumerate(contribs):
+            amt = seat.bet
+            if amt == prev_amt:
+                continue
+            pot_amt = (amt - prev_amt) * (num - i)
+            prev_amt = amt
+            pot_winners, num_winners = suffix_winners[i]
+            if num_winners:
+                pots.append([pot_amt, pot_winners[:num_winners]])
+            elif pots:
+                pots[-1][0] += pot_amt
+
+        won = dict()
+        for pot_amt, pot_winners in pots:
+            share, remainder = divmod(pot_amt, len(pot_winners))
+            for p_id in sorted(pot_winners):
+                amt = share + (1 if remainder > 0 else 0)
+                remainder -= 1
+                won[p_id] = won.get(p_id, 0) + amt
+
+        for p_id, amt in won.items():
+            seat = self.seats[p_id - 1]
+            if not seat.left:
+                seat.wallet += amt
+
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.settled(won)
+        return won
 
     def score_player(self, player_id):
-        if self.is_royal_flush(player_id):
+        '''
+        Returns the category of the player's hand as a score from 0 (royal
+        flush) to 9 (high card). Lower is better.
+
+        player_id: int - The ID of the player.
+        '''
+        key = self.seats[player_id - 1].hand.rank_key()
+        if key == hand_evaluator.ROYAL_FLUSH:
             return 0
-        if self.is_straight_flush(player_id):
-            return 1
-        if self.has_four_of_kind(player_id):
-            return 2
-        if self.is_full_house(player_id):
-            return 3
-        if self.is_flush(player_id):
-            return 4
-        if self.is_straight(player_id):
-            return 5
-        if self.has_three_of_kind(player_id):
-            return 6
-        if self.has_two_pairs(player_id):
-            return 7
-        if self.has_one_pair(player_id):
-            return 8
-        return 9
-
-    # This method sees if all the cards have the same suit
-    def is_flush(self, player_id):
-        x = self.final_hands[player_id].hand[0].suit
-        for i in range(1, cards.NUM_CARDS_IN_HAND):
-            if self.final_hands[player_id].hand[i].suit != x:
-                return False
-        return True
-
-    # This method sees if the values are in sequence
-    def is_straight(self, player_id):
-        for i, c in enumerate(self.card_val[player_id]):
-            if c == 0:
-                continue
-            if c > 2:
-                break
-            for j in range(i + 1, i + cards.NUM_CARDS_IN_HAND):
-                if j > 14 or self.card_val[player_id][j] == 0 :
-                    break
-                elif j == i + cards.NUM_CARDS_IN_HAND - 1:
-                    return True
-        return False
-
-    # This method sees if the cards are same suit and in sequence
-    def is_straight_flush(self, player_id):
-        x = self.is_flush(player_id)
-        y = self.is_straight(player_id)
-        if x and y:
-            return True
-        return False
-
-    # This method sees if the cards in the hand have the same suit and the values 10, 11, 12, 13, 14
-    def is_royal_flush(self, player_id):
-        x = self.is_flush(player_id)
-        counts = self.card_val[player_id]
-        if x:
-            if counts[14] == 1 and counts[13] == 1 and counts[12] == 1 and counts[11] == 1 and counts[10] == 1:
-                return True
-        return False
-
-    # This method sees if the hand has four cards with the same value
-    def has_four_of_kind(self, player_id):
-        for _, c in enumerate(self.card_val[player_id]):
-            if c == 4:
-                return True
-        return False
-
-    # This method sees if the hand has three cards with the same value
-    def has_three_of_kind(self, player_id):
-        for _, c in enumerate(self.card_val[player_id]):
-            if c == 3:
-                return True
-        return False
-
-    # This method sees if the hand has exactly two pairs
-    def has_two_pairs(self, player_id):
-        x = 0
-        for _, c in enumerate(self.card_val[player_id]):
-            if c == 2:
-                x += 1
-            if c > 2:
-                x += c // 2
-        if x == 2:
-            return True
-        return False
-
-    # This method sees if the hand has exactly one pairs
-    def has_one_pair(self, player_id):
-        x = 0
-        for _, c in enumerate(self.card_val[player_id]):
-            if c == 2:
-                x += 1
-            if c > 2:
-                x += c // 2
-        if x == 1:
-            return True
-        return False
-
-    # This method sees if the hand contains three cards with the same value and two other cards with the same value
-    def is_full_house(self, player_id):
-        x = 0
-        y = 0
-        for _, c in enumerate(self.card_val[player_id]):
-            if c == 2:
-                x += 1
-            if c == 3:
-                y += 1
-        if x == 1 and y == 1:
-            return True
-        return False
-
-    # This method to compare the rank of the card, winner is who has the first highest rank
-    def high_card(self):
-        return self.rank_high(list(self.final_hands.keys()))
-
-        # high_card = [[] for _ in range(max(self.card_val.keys()) + 1)]
-        # for p_id, counts in self.card_val.items():
-        #     for i in range(len(counts) - 1, -1, -1):
-        #         if counts[i]:
-        #             high_card[p_id].append(i)
-        #
-        # winner = []
-        # cur = -1
-        # for p_id in self.card_val:
-        #     if high_card[p_id][0] > cur:
-        #         cur = high_card[p_id][0]
-        #         winner = [p_id]
-        #     elif high_card[p_id][0] == cur:
-        #         winner.append(p_id)
-        # return winner
-
-    # count the amount of each rank values in hand, range from 2 to 14
-    def get_counts(self, player_id):
-        counts = [0] * 15
-        for i in range(cards.NUM_CARDS_IN_HAND):
-            counts[self.final_hands[player_id].hand[i].value] += 1
-        return counts
-
-    # find the winner who has the NO.1 highest rank
-    def rank_high(self, candidates):
-        if len(candidates) < 1:
-            raise ValueError(
-                'no one to check')
-
-        if len(candidates) == 1:
-            return candidates
-
-        winner = []
-        cur_rank = -1
-        for i in candidates:
-            for j in range(14, -1, -1):
-                if self.card_val[i][j]:
-                    top = j
-                    if top > cur_rank:
-                        cur_rank = top
-                        winner = [i]
-                    elif top == cur_rank:
-                        winner.append(i)
-                    break
-        return winner
+        return hand_evaluator.STRAIGHT_FLUSH + 1 - hand_evaluator.category(key)
 
     def ack_ante(self, player_id):
         '''
@@ -561,38 +678,297 @@ class GameStateManager:
 
         player_id: int - The ID of the player. 
         '''
-        self.bets.add_bet(player_id, self.ante_amt)
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.ante(player_id)
+
+        self._bet(player_id, self.ante_amt)
+
+    def void_hand(self):
+        '''
+        Gives every player still in the game back what they bet in the hand
+        being played, and resets for the next hand. Used when a game restored
+        from a snapshot cannot carry on with the hand it was in.
+        '''
+        for seat in self.seated():
+            seat.wallet += seat.bet
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.voided([(seat.player_id, seat.wallet) for seat in self.seated()])
+        self.reset()
+
+    def snapshot(self):
+        '''
+        Returns the state of the game as bytes, which restore turns back into
+        a GameStateManager: seats, names, wallets, turn, hand_no and who has
+        left. The hand being played is not kept, as a restored game calls it
+        off: each wallet is kept with the player's bets in the hand given
+        back. Connections, addresses, the recorder and the deck are not kept.
+        '''
+        seed = self.deck.seed
+        seed = b'' if seed is None else str(seed).encode()
+        parts = [
+            _SNAPSHOT.pack(
+                self.num_players, self.wallet_amt, self.ante_amt, self.hand_no,
+                self.next_id, self.turn_id, self.num_seated,
+                NO_SEED if self.deck.seed is None else len(seed)),
+            seed,
+        ]
+
+        for seat in self.seats[:self.next_id - 1]:
+            # The bets of players who left stay in the pool, as in void_hand
+            if seat.left:
+                flags, wallet = LEFT, seat.wallet
+            else:
+                flags, wallet = 0, seat.wallet + seat.bet
+
+            name = seat.name.encode()
+            parts.append(_SEAT.pack(flags, wallet, len(name)))
+            parts.append(name)
+
+        return b''.join(parts)
 
     def reset(self):
         '''
-        Reset the manager deck, final_hands, bets, fold_ids
+        Reset the manager deck, hands, bets and folds. Players with no chips
+        left are taken out of the game, as if they had left. Returns their
+        Seats.
         '''
-        self.deck = cards.Deck()
-        self.final_hands = dict()
+        self.hand_no += 1
+        self.deck.reshuffle(self.hand_no)
+        for seat in self.seats:
+            if seat is not None:
+                seat.hand = None
+                seat.folded = False
+        self.num_folded = 0
         self.bets.reset()
-        self.folded_ids = set()
+
+        busted = [seat for seat in self.seated() if seat.wallet == 0]
+        for seat in busted:
+            seat.left = True
+            self.num_seated -= 1
+        self._link_all()
+
+        # Recorded once done, so the record marks the table between hands
+        self.version += 1
+        if self.recorder is not None:
+            self.recorder.reset()
+        return busted
+
+
+def restore(data, recorder=None):
+    '''
+    Returns a new GameStateManager with the state saved by
+    GameStateManager.snapshot. Players have no connections until they
+    rejoin. The hand being played is not restored, and the players have
+    their bets in it back, so void_hand must be called to record that and
+    set up the next hand before the game goes on. Raises a ValueError if the
+    data is cut short.
+
+    data: bytes - a snapshot
+    recorder: Recorder - Optional. Records the changes to the game from
+                         now on. The table is not recorded again, so its
+                         records carry on from those before the snapshot.
+    '''
+    try:
+        (num_players, wallet_amt, ante_amt, hand_no, next_id, turn_id,
+         _, seed_len) = _SNAPSHOT.unpack_from(data)
+        offset = _SNAPSHOT.size
+        seed = None
+        if seed_len != NO_SEED:
+            seed = data[offset:offset + seed_len].decode()
+            offset += seed_len
+
+        manager = GameStateManager(num_players, wallet_amt, ante_amt, seed)
+        manager.hand_no = hand_no
+        manager.next_id = next_id
+        manager.turn_id = turn_id
+
+        for p_id in range(1, next_id):
+            flags, wallet, name_len = _SEAT.unpack_from(data, offset)
+            offset += _SEAT.size
+            name = data[offset:offset + name_len].decode()
+            offset += name_len
+
+            seat = Seat(p_id, None, None, name, wallet)
+            seat.left = bool(flags & LEFT)
+            manager.seats[p_id - 1] = seat
+            if not seat.left:
+                manager.num_seated += 1
+    except (struct.error, IndexError) as e:
+        raise ValueError('snapshot cut short') from e
+    if offset > len(data):
+        raise ValueError('snapshot cut short')
+
+    manager._link_all()
+    manager.recorder = recorder
+    return manager
+
+
+def snapshot_seats(data):
+    '''
+    Returns the number of players seated and the number of seats of the game
+    in a snapshot as a tuple, read from its header without restoring it.
+    Raises a ValueError if the data is cut short.
+
+    data: bytes - a snapshot
+    '''
+    try:
+        header = _SNAPSHOT.unpack_from(data)
+    except struct.error as e:
+        raise ValueError('snapshot cut short') from e
+    return (header[6], header[0])
+
+
+class Seat:
+    '''
+    A player's seat at a table, with everything about the player the game
+    keeps: who they are, their wallet, their hand and bets, and whether they
+    have folded, gone all in or left. A seat stays taken after its player
+    leaves, as their bets stay in the pool until the hand is over.
+
+    The seats of the players still in the hand form a circular doubly linked
+    ring through `next` and `prev`, in the order the players joined, so the
+    next player to act is always one step away and a player who folds or
+    leaves is taken out in O(1). Both are None for a seat not in the ring.
+    '''
+
+    __slots__ = ('player_id', 'conn', 'addr', 'name', 'wallet', 'hand', 'bet',
+                 'round_bet', 'has_bet', 'acted', 'folded', 'all_in', 'left', 'next',
+                 'prev')
+
+    def __init__(self, player_id, connection, address_tup, player_name, wallet_amt):
+        '''
+        Seats a player.
+
+        player_id: int - The ID of the player.
+        connection: AsyncConnection - The player's connection.
+        address_tup: (IP, PORT) - The player's address.
+        player_name: str - The player's name.
+        wallet_amt: int - The amount the player has to bet.
+        '''
+        self.player_id = player_id
+        self.conn = connection
+        self.addr = address_tup
+        self.name = player_name
+        self.wallet = wallet_amt
+        self.hand = None  # Hand dealt this hand, None if not dealt or out
+        self.bet = 0  # amount bet this hand
+        self.round_bet = 0  # amount bet this round of betting
+        self.has_bet = False  # True once they bet this hand, even nothing
+        self.acted = False  # True once they bet this round, even nothing
+        self.folded = False
+        self.all_in = False
+        self.left = False
+        self.next = None  # next seat in the ring
+        self.prev = None  # previous seat in the ring
+
+    def in_hand(self):
+        '''
+        Returns True if the player has neither folded nor left.
+        '''
+        return not (self.folded or self.left)
 
 
 class BetInfo:
     '''
-    Keeps track of important data during a round of betting.
+    Keeps track of important data during a round of betting. Each player's
+    bets, for the whole hand and for the current round, are kept in their
+    Seat. Running totals, the highest bet and a count of the players still
+    betting at each amount are kept here, so that every query is answered
+    without looking at each player.
     '''
 
-    def __init__(self):
+    def __init__(self, seats):
         '''
         Creates a BetInfo object.
+
+        seats: [Seat] - The table's seats, None where not taken.
         '''
-        self.player_bets = dict()
+        self.seats = seats
+        self.reset()
 
-    def add_bet(self, player_id, amt):
+    def add_bet(self, seat, amt):
         '''
         Adds the given amount to the given player's bet total for a round.
+
+        seat: Seat - The player's seat.
+        amt: int - The amount bet.
+        '''
+        prev = seat.bet
+        total = prev + amt
+        had_bet = seat.has_bet
+        seat.bet = total
+        seat.has_bet = True
+        seat.round_bet += amt
+        self.pool_amt += amt
+        self.round_pool_amt += amt
+
+        if total > self.max_bet:
+            self.max_bet = total
+            self.max_ids = {seat.player_id}
+        elif total == self.max_bet:
+            self.max_ids.add(seat.player_id)
+
+        if seat.all_in:
+            if total > self.all_in_max:
+                self.all_in_max = total
+        elif seat.in_hand():
+            if had_bet:
+                self._uncount(prev)
+            self.live_amts[total] = self.live_amts.get(total, 0) + 1
+            if not seat.acted:
+                self.num_acted += 1
+        seat.acted = True
+
+    def fold(self, seat):
         '''
-        # If player hasn't bet yet, need to add to the dict
-        if player_id not in self.player_bets:
-            self.player_bets[player_id] = amt
+        Takes a player out of the betting, because they folded or left,
+        before their seat is marked. Their bets stay in the pool. Does nothing
+        if they are already out.
+
+        seat: Seat - The player's seat.
+        '''
+        if not seat.in_hand():
+            return
+        if seat.all_in:
+            self.num_all_in -= 1
+            return
+        if seat.has_bet:
+            self._uncount(seat.bet)
+        if seat.acted:
+            self.num_acted -= 1
+
+    def all_in(self, seat):
+        '''
+        Marks a player as all in, before their last bet is added. They stay
+        in the hand, but no longer have to match the highest bet; instead the
+        others have to match them. Does nothing if they are already out.
+
+        seat: Seat - The player's seat.
+        '''
+        if not seat.in_hand() or seat.all_in:
+            return
+        seat.all_in = True
+        self.num_all_in += 1
+        if seat.acted:
+            self.num_acted -= 1
+        if seat.has_bet:
+            self._uncount(seat.bet)
+            if seat.bet > self.all_in_max:
+                self.all_in_max = seat.bet
+
+    def _uncount(self, amt):
+        '''
+        Takes one player off the count of players still in at an amount.
+
+        amt: int - The amount they had bet.
+        '''
+        num = self.live_amts[amt] - 1
+        if num:
+            self.live_amts[amt] = num
         else:
-            self.player_bets[player_id] += amt
+            del self.live_amts[amt]
 
     def get_max_bet(self):
         '''
@@ -600,20 +976,22 @@ class BetInfo:
         the the bet amount with a list of player IDs who've bet that amount in a
         tuple. If no bets have been made a tuple of the form (0, []) is returned.
         '''
-        p_ids = []
-        max_bet = 0
-        d = self.player_bets
+        return (self.max_bet, sorted(self.max_ids))
 
-        # Need to find max bet, then add players to list
-        for key in d:
-            if d[key] > max_bet:
-                max_bet = d[key]
-
-        for key in d:
-            if d[key] == max_bet:
-                p_ids.append(key)
+    def all_matched(self, num_in):
+        '''
+        Returns True if every player still in the hand who is not all in has
+        bet the same amount, and at least as much as any player who is all
+        in. Players who have not bet count as having bet nothing.
 
-        return (max_bet, p_ids)
+        num_in: int - The number of players who have not folded, left or gone
+                      all in.
+        '''
+        if len(self.live_amts) > 1:
+            return False
+        for amt, num in self.live_amts.items():
+            return (num == num_in or amt == 0) and amt >= self.all_in_max
+        return num_in == 0 or self.all_in_max == 0
 
     def get_player_bet(self, player_id):
         '''
@@ -621,28 +999,62 @@ class BetInfo:
 
         player_id: int - The ID of a player in the game.
         '''
-        if player_id not in self.player_bets:
-            return 0
+        seat = self.seats[player_id - 1]
+        return 0 if seat is None else seat.bet
 
-        return self.player_bets[player_id]
+    def get_round_bet(self, player_id):
+        '''
+        Get the amount a specific player has bet since the current round of
+        betting started.
+
+        player_id: int - The ID of a player in the game.
+        '''
+        seat = self.seats[player_id - 1]
+        return 0 if seat is None else seat.round_bet
 
     def get_pool_amt(self):
         '''
         Returns the total amount in the betting pool.
         '''
-        d = self.player_bets
+        return self.pool_amt
 
-        total = 0
-        for key in d:
-            total += d[key]
+    def get_round_pool_amt(self):
+        '''
+        Returns the amount added to the betting pool in the current round.
+        '''
+        return self.round_pool_amt
 
-        return total
+    def new_round(self):
+        '''
+        Starts a new round of betting. Totals for the hand are kept.
+        '''
+        for seat in self.seats:
+            if seat is not None:
+                seat.round_bet = 0
+                seat.acted = False
+        self.round_pool_amt = 0
+        self.num_acted = 0
 
     def reset(self):
         '''
         Resets all betting info.
         '''
-        self.player_bets = dict()
+        for seat in self.seats:
+            if seat is not None:
+                seat.bet = 0
+                seat.round_bet = 0
+                seat.has_bet = False
+                seat.acted = False
+                seat.all_in = False
+        self.pool_amt = 0
+        self.round_pool_amt = 0
+        self.max_bet = 0
+        self.max_ids = set()  # IDs of players whose bet is max_bet
+        self.live_amts = dict()  # amount -> players still betting who bet it
+        self.num_all_in = 0  # players all in who have not folded or left
+        self.all_in_max = 0  # highest bet of a player who is all in
+        # Players still betting, not all in, who have bet this round
+        self.num_acted = 0
 
 
 class GameFullError(Exception):
@@ -0,0 +1,171 @@
+'''
+The `hand_classes` module groups five card hands that are the same up to a
+relabelling of suits. Swapping every heart for a spade in a hand, for example,
+does not change how strong it is or how it should be played, so such hands
+share one canonical form and one class id.
+
+Results that only depend on the class of a hand can be shared between all
+the hands in it. LRUCache is the size bounded cache used for that. It only
+pays where one result covers many lookups, as in the equity and discard
+paths; a single rank key is cheaper to evaluate than to canonicalize.
+'''
+
+import collections
+
+import cards
+
+# Bits used per card code when packing a class id
+CODE_BITS = 6
+
+# Default number of entries an LRUCache holds
+DEFAULT_CACHE_SIZE = 1 << 16
+
+
+def canonicalize(codes):
+    '''
+    Returns the canonical code of each card in the hand, in the same order as
+    the given codes. Suits are relabelled so that the suit with the most
+    cards becomes suit 0, and so on; suits with the same number of cards are
+    ordered by their card values, largest first. Suits holding the same
+    values are interchangeable, so every hand in a class maps to the same
+    set of canonical codes.
+
+    codes: [int] - the card codes of a hand
+    '''
+    by_suit = [[] for _ in cards.SUIT_ORDER]
+    for code in codes:
+        by_suit[cards.code_suit(code)].append(cards.code_value(code))
+
+    order = sorted(
+        range(len(by_suit)),
+        key=lambda suit: (len(by_suit[suit]), sorted(by_suit[suit], reverse=True)),
+        reverse=True)
+
+    suit_map = [0] * len(order)
+    for new_suit, suit in enumerate(order):
+        suit_map[suit] = new_suit
+
+    return [cards.card_code(cards.code_value(code), suit_map[cards.code_suit(code)])
+            for code in codes]
+
+
+def class_id(hand):
+    '''
+    Returns the class id of a hand: its sorted canonical codes packed into
+    one int, CODE_BITS bits per card. Hands have the same id exactly when
+    they are the same up to suits.
+
+    hand: Hand or [int] - a hand, as a Hand or card codes
+    '''
+    codes = hand.codes if isinstance(hand, cards.Hand) else hand
+    return pack(sorted(canonicalize(codes)))
+
+
+def class_mask(codes, positions):
+    '''
+    Returns the class id of a hand together with a mask that marks some of
+    its cards, as a tuple: (class_id, mask). Bit i of the mask is the i-th
+    of the sorted canonical codes, so the same cards of every hand in the
+    class get the same mask.
+
+    codes: [int] - the card codes of a hand
+    positions: [int] - 1-indexed positions of the cards to mark
+    '''
+    canon = canonicalize(codes)
+    ordered = sorted(canon)
+
+    mask = 0
+    for pos in positions:
+        mask |= 1 << ordered.index(canon[pos - 1])
+    return (pack(ordered), mask)
+
+
+def pack(sorted_codes):
+    '''
+    Packs sorted card codes into an int, the first code in the lowest bits.
+
+    sorted_codes: [int] - card codes in ascending order
+    '''
+    packed = 0
+    for code in reversed(sorted_codes):
+        packed = (packed << CODE_BITS) | code
+    return packed
+
+
+def unpack(packed, num_cards=cards.NUM_CARDS_IN_HAND):
+    '''
+    Returns the sorted card codes packed into an int by pack.
+
+    packed: int - a packed id such as a class id
+    num_cards: int - the number of codes packed in it
+    '''
+    mask = (1 << CODE_BITS) - 1
+    return [(packed >> (i * CODE_BITS)) & mask for i in range(num_cards)]
+
+
+class LRUCache:
+    '''
+    A dict-like cache holding at most `maxsize` entries. When full, adding an
+    entry evicts the one used longest ago. Hits, misses and evictions are
+    counted.
+    '''
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        '''
+        Creates an empty cache.
+
+        maxsize: int - the most entries to hold
+        '''
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, compute):
+        '''
+        Returns the value cached for the key. On a miss, calls compute() to
+        get the value and caches it.
+
+        key: hashable - the cache key
+        compute: function - returns the value for the key
+        '''
+        entries = self.entries
+        if key in entries:
+            self.hits += 1
+            entries.move_to_end(key)
+            return entries[key]
+
+        self.misses += 1
+        value = compute()
+        entries[key] = value
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def clear(self):
+        '''
+        Removes every entry. The counters are kept.
+        '''
+        self.entries.clear()
+
+    def stats(self):
+        '''
+        Returns the size and counters of the cache as a dict.
+        '''
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,318 @@
+'''
+The `hand_evaluator` module maps a five card poker hand to a single integer
+strength. A larger strength is a better hand and equal strengths are a split,
+so the winner of a showdown is simply the hand with the max strength.
+
+A strength packs the hand category in the bits above 20 and then the five card
+values, four bits each, ordered by how much they matter when breaking a tie:
+the ranks that make the category first and then the kickers. For example, a
+full house of kings over fives is FULL_HOUSE, K, K, K, 5, 5. An ace-low
+straight is stored as 5, 4, 3, 2, 1 so it ranks below a six-high straight.
+
+Evaluation does no counting or sorting. Each rank value has a prime, and the
+product of the five primes identifies the rank multiset of the hand. Two
+tables built at import map that product to the strength, one for flushes and
+one for everything else.
+
+For scoring many hands at once, evaluate_batch computes the same strengths
+with numpy array operations. It is the only part of the module that needs
+numpy.
+'''
+
+import itertools
+import math
+
+import cards
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is only needed by evaluate_batch
+    np = None
+
+# Hand categories, weakest to strongest. A royal flush is the ace-high
+# straight flush.
+HIGH_CARD = 0
+ONE_PAIR = 1
+TWO_PAIR = 2
+THREE_OF_A_KIND = 3
+STRAIGHT = 4
+FLUSH = 5
+FULL_HOUSE = 6
+FOUR_OF_A_KIND = 7
+STRAIGHT_FLUSH = 8
+
+CATEGORY_NAMES = (
+    'high card',
+    'one pair',
+    'two pair',
+    'three of a kind',
+    'straight',
+    'flush',
+    'full house',
+    'four of a kind',
+    'straight flush',
+)
+
+CATEGORY_SHIFT = 20
+VALUE_BITS = 4
+VALUE_MASK = (1 << VALUE_BITS) - 1
+
+# The best possible strength, the royal flush
+ROYAL_FLUSH = (STRAIGHT_FLUSH << CATEGORY_SHIFT) | 0xEDCBA
+
+# One prime per rank value, indexed by value (2 to 14)
+PRIMES = (0, 0, 2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+# The prime for each card code
+_CODE_PRIMES = tuple(
+    PRIMES[cards.code_value(code)] for code in range(cards.NUM_CARDS_IN_DECK))
+
+# Counts per rank pattern, ordered largest first, and the category they make
+_COUNT_CATEGORIES = {
+    (4, 1): FOUR_OF_A_KIND,
+    (3, 2): FULL_HOUSE,
+    (3, 1, 1): THREE_OF_A_KIND,
+    (2, 2, 1): TWO_PAIR,
+    (2, 1, 1, 1): ONE_PAIR,
+}
+
+
+def _pack(category, values):
+    '''
+    Packs a category and five ordered card values into a strength.
+
+    category: int - one of the category constants
+    values: [int] - five card values, most significant first
+    '''
+    strength = category
+    for value in values:
+        strength = (strength << VALUE_BITS) | value
+    return strength
+
+
+def _build_tables():
+    '''
+    Builds the flush and non-flush lookup tables, keyed by prime product.
+    Returns a tuple of (flush_table, rank_table).
+    '''
+    flush_table = {}
+    rank_table = {}
+
+    for values in itertools.combinations_with_replacement(range(14, 1, -1), 5):
+        counts = {}
+        for value in values:
+            counts[value] = counts.get(value, 0) + 1
+        if max(counts.values()) > 4:
+            continue  # only four cards of each rank
+
+        product = 1
+        for value in values:
+            product *= PRIMES[value]
+
+        # Values ordered by count first, then by value
+        ordered = sorted(values, key=lambda v: (counts[v], v), reverse=True)
+
+        if len(counts) == 5:
+            if ordered == [14, 5, 4, 3, 2]:
+                ordered = [5, 4, 3, 2, 1]  # the wheel, ace plays low
+            is_straight = ordered[0] - ordered[4] == 4
+
+            if is_straight:
+                flush_table[product] = _pack(STRAIGHT_FLUSH, ordered)
+                rank_table[product] = _pack(STRAIGHT, ordered)
+            else:
+                flush_table[product] = _pack(FLUSH, ordered)
+                rank_table[product] = _pack(HIGH_CARD, ordered)
+        else:
+            pattern = tuple(sorted(counts.values(), reverse=True))
+            rank_table[product] = _pack(_COUNT_CATEGORIES[pattern], ordered)
+
+    return flush_table, rank_table
+
+
+_FLUSH_TABLE, _RANK_TABLE = _build_tables()
+
+
+def strength_counts():
+    '''
+    Returns a dict mapping every possible strength to the number of distinct
+    five card hands (out of 2,598,960) that have it.
+    '''
+    counts = {}
+    for product, strength in _RANK_TABLE.items():
+        # Factor the product back into how many cards there are of each rank
+        ways = 1
+        distinct = True
+        for value in range(2, 15):
+            num = 0
+            while product % PRIMES[value] == 0:
+                product //= PRIMES[value]
+                num += 1
+            ways *= math.comb(4, num)
+            distinct = distinct and num < 2
+
+        if distinct:
+            ways -= 4  # the four flushes are in the flush table
+        counts[strength] = ways
+
+    for strength in _FLUSH_TABLE.values():
+        counts[strength] = 4  # one per suit
+
+    return counts
+
+
+def evaluate(codes):
+    '''
+    Returns the strength of a five card hand. Larger is better.
+
+    codes: [int] - the five card codes of the hand
+    '''
+    a, b, c, d, e = codes
+    p = _CODE_PRIMES
+    product = p[a] * p[b] * p[c] * p[d] * p[e]
+
+    # All five suits match when every xor with the first card has zero suit bits
+    if ((a ^ b) | (a ^ c) | (a ^ d) | (a ^ e)) & cards.SUIT_MASK == 0:
+        return _FLUSH_TABLE[product]
+    return _RANK_TABLE[product]
+
+
+def evaluate_hand(hand):
+    '''
+    Returns the strength of a full cards.Hand. Larger is better.
+
+    hand: Hand - a hand holding five cards
+    '''
+    return evaluate(hand.codes)
+
+
+def category(strength):
+    '''
+    Returns the category constant of a strength.
+
+    strength: int - a strength returned by evaluate
+    '''
+    return strength >> CATEGORY_SHIFT
+
+
+def strength_values(strength):
+    '''
+    Returns the five card values of a strength, most significant first.
+
+    strength: int - a strength returned by evaluate
+    '''
+    values = []
+    for i in range(4, -1, -1):
+        values.append((strength >> (i * VALUE_BITS)) & VALUE_MASK)
+    return values
+
+
+def describe(strength):
+    '''
+    Returns a short human readable name for a strength, such as
+    'full house' or 'royal flush'.
+
+    strength: int - a strength returned by evaluate
+    '''
+    if strength == ROYAL_FLUSH:
+        return 'royal flush'
+    return CATEGORY_NAMES[category(strength)]
+
+
+def _build_run_tables():
+    '''
+    Builds the tables evaluate_batch uses to score a row of sorted card
+    values. Which neighbours are equal in a sorted row is a 4 bit pattern,
+    and the pattern alone fixes both the category (ignoring straights and
+    flushes) and the order to read the cards in to get the strength values.
+    Returns a tuple of (categories, orders) indexed by the pattern.
+    '''
+    categories = []
+    orders = []
+    for pattern in range(1 << (cards.NUM_CARDS_IN_HAND - 1)):
+        # Give each position a run number; equal neighbours share a run
+        runs = [0]
+        for i in range(cards.NUM_CARDS_IN_HAND - 1):
+            same = pattern >> i & 1
+            runs.append(runs[-1] if same else runs[-1] + 1)
+        counts = [runs.count(run) for run in runs]
+
+        # Larger counts first, then later positions, which hold larger values
+        positions = range(cards.NUM_CARDS_IN_HAND)
+        orders.append(sorted(positions, key=lambda i: (counts[i], i), reverse=True))
+
+        shape = tuple(sorted((runs.count(run) for run in set(runs)), reverse=True))
+        categories.append(_COUNT_CATEGORIES.get(shape, HIGH_CARD))
+
+    return np.array(categories), np.array(orders)
+
+
+def evaluate_batch(codes, chunk_size=1 << 20):
+    '''
+    Returns the strengths of many five card hands as a numpy array, the same
+    values evaluate would return for each row. The hands are scored with
+    array operations over sorted rank values and flush and straight masks, a
+    chunk of rows at a time to bound memory. Cards within a row are assumed
+    to be distinct. Requires numpy.
+
+    codes: ndarray[N, 5] - card codes, one hand per row
+    chunk_size: int - the number of rows scored per chunk
+    '''
+    global _RUN_TABLES
+
+    if np is None:
+        raise ImportError('evaluate_batch requires numpy')
+
+    codes = np.asarray(codes, dtype=np.int64)
+    if codes.ndim != 2 or codes.shape[1] != cards.NUM_CARDS_IN_HAND:
+        raise ValueError('codes must have the shape (N, 5)')
+
+    if _RUN_TABLES is None:
+        _RUN_TABLES = _build_run_tables()
+
+    strengths = np.empty(codes.shape[0], dtype=np.int32)
+    for start in range(0, codes.shape[0], chunk_size):
+        stop = start + chunk_size
+        strengths[start:stop] = _evaluate_chunk(codes[start:stop])
+    return strengths
+
+
+# Built by evaluate_batch the first time it runs
+_RUN_TABLES = None
+
+
+def _evaluate_chunk(codes):
+    '''
+    Vectorized body of evaluate_batch for one chunk of rows.
+
+    codes: ndarray[N, 5] - int64 card codes, one hand per row
+    '''
+    run_categories, run_orders = _RUN_TABLES
+
+    values = np.sort((codes >> cards.SUIT_BITS) + 2, axis=1)
+    suits = codes & cards.SUIT_MASK
+
+    # Pattern of equal neighbours in the sorted values, as 4 bits
+    same = values[:, 1:] == values[:, :-1]
+    pattern = same @ (1 << np.arange(cards.NUM_CARDS_IN_HAND - 1))
+
+    category = run_categories[pattern]
+    ordered = np.take_along_axis(values, run_orders[pattern], axis=1)
+
+    distinct = pattern == 0
+    is_flush = (suits == suits[:, :1]).all(axis=1)
+
+    # The wheel is stored ace low, the same as a five-high straight
+    wheel = distinct & (ordered[:, 0] == 14) & (ordered[:, 1] == 5)
+    ordered[wheel] = np.array([5, 4, 3, 2, 1])
+    is_straight = distinct & (ordered[:, 0] - ordered[:, 4] == 4)
+
+    category[is_straight] = STRAIGHT
+    category[is_flush] = FLUSH
+    category[is_straight & is_flush] = STRAIGHT_FLUSH
+
+    strengths = category
+    for i in range(cards.NUM_CARDS_IN_HAND):
+        strengths = (strengths << VALUE_BITS) | ordered[:, i]
+    return strengths
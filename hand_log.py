@@ -0,0 +1,451 @@
+'''
+The `hand_log` module records everything that happens at a server's tables
+in an append-only binary log, and replays it.
+
+Each GameStateManager given a Recorder appends a record for every change
+of its state: the table being set up, players joining, antes, bets, folds
+and leaves, the cards dealt, discarded and drawn, the showdown, the payout
+and the start of every new hand. A hand called off when a table is
+restored from a snapshot is recorded with the wallets it left, so a table's
+records carry on across a restart of the server.
+
+A record is a header, packed as `!BBIQ` (size of the payload, event type,
+table id, time in milliseconds since the epoch), followed by its payload.
+Records of every table go into one log.
+
+Records are only added to a buffer while a game is played. HandLog.run
+writes the buffer every FLUSH_INTERVAL seconds and has it synced to disk
+every SYNC_INTERVAL seconds in another thread, so logging never waits on
+the disk. A crash loses at most the last moments, and a record cut short
+at the end of the log is ignored when it is read.
+
+replay rebuilds the GameStateManager of any table, as it was once the record
+at any offset in the log was made, by applying the records to a new one. No one is waited on, so
+a replay runs as fast as the records can be read:
+
+    hand_log.py <log_file>                         lists every record
+    hand_log.py <log_file> <table_id> [offset]     shows a table's state
+'''
+
+import asyncio
+import os
+import struct
+import sys
+import time
+
+import cards
+import codec
+import game_state_manager as gsm
+
+# Event types
+TABLE = 1
+JOIN = 2
+ANTE = 3
+ACTION = 4
+DEAL = 5
+DISCARD = 6
+DRAW = 7
+NEW_ROUND = 8
+SHOWDOWN = 9
+SETTLE = 10
+PAYOUT = 11
+RESET = 12
+CLOSE = 13
+VOID = 14
+
+EVENT_NAMES = {
+    TABLE: 'table', JOIN: 'join', ANTE: 'ante', ACTION: 'action', DEAL: 'deal',
+    DISCARD: 'discard', DRAW: 'draw', NEW_ROUND: 'new_round', SHOWDOWN: 'showdown',
+    SETTLE: 'settle', PAYOUT: 'payout', RESET: 'reset', CLOSE: 'close',
+    VOID: 'void',
+}
+
+_HEADER = struct.Struct('!BBIQ')  # payload size, event, table id, time in ms
+_TABLE = struct.Struct('!BQQ')  # num players, wallet, ante; then the seed, if any
+_PLAYER = struct.Struct('!B')  # player id; then a name or card codes
+_ACTION = struct.Struct('!BBQ')  # player id, action, amount
+_DISCARD = struct.Struct('!BB')  # player id, mask of 1-indexed positions
+_PAYOUT = struct.Struct('!BQ')  # player id, amount won
+_WALLET = struct.Struct('!BQ')  # player id, wallet
+
+# Longest payload a record can hold
+MAX_PAYLOAD = 255
+
+# Seconds between writes of the buffer
+FLUSH_INTERVAL = 0.2
+
+# Seconds between syncs to disk
+SYNC_INTERVAL = 1.0
+
+# Buffer size that is written at once, without waiting for the next flush
+FLUSH_SIZE = 1 << 16
+
+
+class HandLog:
+    '''
+    An append-only log file and the buffer of records not yet written to it.
+    '''
+
+    def __init__(self, path):
+        '''
+        Opens a log, creating it if needed. Records are added at its end.
+
+        path: str - the log file
+        '''
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.buffer = bytearray()
+        # True if bytes have been written since the last sync
+        self.unsynced = False
+
+    def append(self, event, table_id, payload=b''):
+        '''
+        Adds a record to the buffer.
+
+        event: int - the event type
+        table_id: int - the table it happened at
+        payload: bytes - the event's data, cut to MAX_PAYLOAD bytes
+        '''
+        payload = payload[:MAX_PAYLOAD]
+        self.buffer += _HEADER.pack(len(payload), event, table_id, int(time.time() * 1000))
+        self.buffer += payload
+        if len(self.buffer) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes the buffer to the log. The data may only be in the operating
+        system's cache until the next sync.
+        '''
+        view = memoryview(self.buffer)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+        view.release()
+        if self.buffer:
+            self.buffer.clear()
+            self.unsynced = True
+
+    def sync(self):
+        '''
+        Writes the buffer and waits for the log to reach the disk.
+        '''
+        self.flush()
+        if self.unsynced:
+            os.fsync(self.fd)
+            self.unsynced = False
+
+    async def run(self):
+        '''
+        Writes the buffer every FLUSH_INTERVAL seconds and syncs the log every
+        SYNC_INTERVAL seconds, in another thread, until the task is cancelled.
+        '''
+        loop = asyncio.get_running_loop()
+        last_sync = time.monotonic()
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            self.flush()
+            if self.unsynced and time.monotonic() - last_sync >= SYNC_INTERVAL:
+                self.unsynced = False
+                last_sync = time.monotonic()
+                await loop.run_in_executor(None, os.fsync, self.fd)
+
+    def recorder(self, table_id):
+        '''
+        Returns a Recorder for a table's GameStateManager.
+
+        table_id: int - the table's id
+        '''
+        return Recorder(self, table_id)
+
+    def close(self):
+        '''
+        Syncs and closes the log.
+        '''
+        self.sync()
+        os.close(self.fd)
+
+
+class Recorder:
+    '''
+    Records the changes to one table's GameStateManager in a HandLog. The
+    manager calls it as each change is made.
+    '''
+
+    __slots__ = ('log', 'table_id')
+
+    def __init__(self, log, table_id):
+        '''
+        Creates a recorder.
+
+        log: HandLog - the log to add records to
+        table_id: int - the table's id
+        '''
+        self.log = log
+        self.table_id = table_id
+
+    def table(self, num_players, wallet_amt, ante_amt, seed):
+        seed = b'' if seed is None else str(seed).encode()
+        self.log.append(TABLE, self.table_id, _TABLE.pack(num_players, wallet_amt, ante_amt) + seed)
+
+    def joined(self, player_id, name):
+        self.log.append(JOIN, self.table_id, _PLAYER.pack(player_id) + name.encode())
+
+    def ante(self, player_id):
+        self.log.append(ANTE, self.table_id, _PLAYER.pack(player_id))
+
+    def action(self, player_id, action, amt=0):
+        '''
+        Records a bet, fold or leave.
+
+        player_id: int - the player
+        action: int - one of codec.CHECK, CALL, RAISE, FOLD, LEAVE
+        amt: int - the amount raised
+        '''
+        self.log.append(ACTION, self.table_id, _ACTION.pack(player_id, action, amt))
+
+    def dealt(self, player_id, codes):
+        self.log.append(DEAL, self.table_id, _PLAYER.pack(player_id) + bytes(codes))
+
+    def discarded(self, player_id, positions):
+        mask = 0
+        for pos in positions:
+            mask |= 1 << (pos - 1)
+        self.log.append(DISCARD, self.table_id, _DISCARD.pack(player_id, mask))
+
+    def drew(self, player_id, codes):
+        self.log.append(DRAW, self.table_id, _PLAYER.pack(player_id) + bytes(codes))
+
+    def new_round(self):
+        self.log.append(NEW_ROUND, self.table_id)
+
+    def showdown(self, winners):
+        self.log.append(SHOWDOWN, self.table_id, bytes(winners))
+
+    def settled(self, won):
+        '''
+        Records the payout of a hand.
+
+        won: dict - player ID -> amount won
+        '''
+        self.log.append(SETTLE, self.table_id)
+        for player_id in sorted(won):
+            self.log.append(PAYOUT, self.table_id, _PAYOUT.pack(player_id, won[player_id]))
+
+    def voided(self, wallets):
+        '''
+        Records a hand being called off and the bets given back.
+
+        wallets: list - (player ID, wallet after the refund) of every player
+                        still in the game
+        '''
+        payload = b''.join(_WALLET.pack(player_id, wallet) for player_id, wallet in wallets)
+        self.log.append(VOID, self.table_id, payload)
+
+    def reset(self):
+        self.log.append(RESET, self.table_id)
+
+    def closed(self):
+        self.log.append(CLOSE, self.table_id)
+
+
+def worker_path(path, worker_id):
+    '''
+    Returns the file of one worker of a server, for files such as the hand
+    log that workers cannot share.
+
+    path: str - the server's file
+    worker_id: int - the worker's id
+    '''
+    return '{}.{}'.format(path, worker_id)
+
+
+def read_events(path, table_id=None, end=None):
+    '''
+    Yields the records of a log as tuples of
+    (offset, event, table_id, time_ms, payload), in order. A record cut
+    short at the end of the log is left out.
+
+    path: str - the log file
+    table_id: int - optional, only yields the records of this table
+    end: int - optional, stops after the record at this byte offset
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if end is None or end > len(data):
+        end = len(data)
+
+    offset = 0
+    header_size = _HEADER.size
+    while offset <= end and offset + header_size <= len(data):
+        size, event, record_table, time_ms = _HEADER.unpack_from(data, offset)
+        start = offset + header_size
+        if start + size > len(data):
+            break
+        if table_id is None or record_table == table_id:
+            yield (offset, event, record_table, time_ms, data[start:start + size])
+        offset = start + size
+
+
+def replay(path, table_id, end=None):
+    '''
+    Returns a table's GameStateManager as it was once a record in a log was
+    made, or None if the table was not set up by then. Players have no connections,
+    and the cards dealt are taken from the log rather than the deck.
+
+    path: str - the log file
+    table_id: int - the table's id
+    end: int - optional, the byte offset of the last record to apply; the
+               whole log if None
+    '''
+    manager = None
+    for _, event, _, _, payload in read_events(path, table_id, end):
+        if event == TABLE:
+            num_players, wallet_amt, ante_amt = _TABLE.unpack_from(payload)
+            seed = payload[_TABLE.size:].decode() or None
+            manager = gsm.GameStateManager(num_players, wallet_amt, ante_amt, seed)
+        elif manager is not None:
+            apply(manager, event, payload)
+    return manager
+
+
+def apply(manager, event, payload):
+    '''
+    Applies one record to a GameStateManager.
+
+    manager: GameStateManager - the table's state
+    event: int - the event type
+    payload: bytes - the record's payload
+    '''
+    if event == JOIN:
+        manager.join(None, None, payload[_PLAYER.size:].decode())
+    elif event == ANTE:
+        manager.ack_ante(payload[0])
+    elif event == ACTION:
+        player_id, action, amt = _ACTION.unpack(payload)
+        if action == codec.CHECK:
+            manager.bet_check(player_id)
+        elif action == codec.CALL:
+            manager.bet_call(player_id)
+        elif action == codec.RAISE:
+            manager.bet_raise(player_id, amt)
+        elif action == codec.FOLD:
+            manager.bet_fold(player_id)
+        elif action == codec.LEAVE:
+            manager.leave(player_id)
+    elif event == DEAL:
+        manager.store_hand(payload[0], [cards.CARDS[code] for code in payload[1:]])
+    elif event == DISCARD:
+        player_id, mask = _DISCARD.unpack(payload)
+        positions = [i + 1 for i in range(cards.NUM_CARDS_IN_HAND) if mask >> i & 1]
+        manager.delete_cards(player_id, positions)
+    elif event == DRAW:
+        manager.add_cards(payload[0], [cards.CARDS[code] for code in payload[1:]])
+    elif event == NEW_ROUND:
+        manager.new_round()
+    elif event == SETTLE:
+        manager.settle()
+    elif event == VOID:
+        # The wallets are set rather than refunded, as the records of the
+        # hand may not all have reached the log before the server stopped
+        for player_id, wallet in _WALLET.iter_unpack(payload):
+            seat = manager.seats[player_id - 1]
+            if seat is not None:
+                seat.wallet = wallet
+    elif event == RESET:
+        manager.reset()
+    # SHOWDOWN, PAYOUT and CLOSE only describe what happened
+
+
+def describe(event, payload):
+    '''
+    Returns a record's event and payload as text.
+
+    event: int - the event type
+    payload: bytes - the record's payload
+    '''
+    name = EVENT_NAMES.get(event, str(event))
+    if event == TABLE:
+        num_players, wallet_amt, ante_amt = _TABLE.unpack_from(payload)
+        seed = payload[_TABLE.size:].decode() or None
+        return '{} players={} wallet={} ante={} seed={}'.format(
+            name, num_players, wallet_amt, ante_amt, seed)
+    if event == JOIN:
+        return '{} player={} name={}'.format(name, payload[0], payload[1:].decode())
+    if event == ANTE:
+        return '{} player={}'.format(name, payload[0])
+    if event == ACTION:
+        player_id, action, amt = _ACTION.unpack(payload)
+        return '{} player={} {} {}'.format(name, player_id, codec.ACTION_NAMES[action], amt)
+    if event in (DEAL, DRAW):
+        shown = ' '.join(repr(cards.CARDS[code]) for code in payload[1:])
+        return '{} player={} {}'.format(name, payload[0], shown)
+    if event == DISCARD:
+        player_id, mask = _DISCARD.unpack(payload)
+        return '{} player={} mask={:05b}'.format(name, player_id, mask)
+    if event == SHOWDOWN:
+        return '{} winners={}'.format(name, list(payload))
+    if event == PAYOUT:
+        return '{} player={} amount={}'.format(name, *_PAYOUT.unpack(payload))
+    if event == VOID:
+        wallets = ' '.join('{}={}'.format(*pair) for pair in _WALLET.iter_unpack(payload))
+        return '{} wallets {}'.format(name, wallets)
+    return name
+
+
+def main(argv):
+    path, table_id, end = get_cmd_args(argv)
+    if table_id is None:
+        for offset, event, record_table, time_ms, payload in read_events(path):
+            print('{} {} table={} {}'.format(offset, time_ms, record_table, describe(event, payload)))
+        return
+
+    started = time.perf_counter()
+    manager = replay(path, table_id, end)
+    elapsed = time.perf_counter() - started
+    if manager is None:
+        print('table {} not found'.format(table_id))
+        sys.exit(1)
+
+    print('Table {} after hand {}, replayed in {:.3f}s'.format(table_id, manager.hand_no, elapsed))
+    print('pool={} max_bet={}'.format(manager.bets.get_pool_amt(), manager.bets.get_max_bet()[0]))
+    for seat in manager.seated():
+        hand = seat.hand
+        print('player {} {}: wallet={} bet={}{}{} hand={}'.format(
+            seat.player_id,
+            seat.name,
+            seat.wallet,
+            seat.bet,
+            ' folded' if seat.folded else '',
+            ' all-in' if seat.all_in else '',
+            None if hand is None else ' '.join(repr(cards.CARDS[code]) for code in hand.codes)))
+
+
+def get_cmd_args(argv):
+    '''
+    Validates command line arguments and returns a tuple of
+    (path, table_id, offset), table_id and offset being None if not given.
+    '''
+    if not 2 <= len(argv) <= 4:
+        help()
+        sys.exit(1)
+    try:
+        table_id = int(argv[2]) if len(argv) > 2 else None
+        end = int(argv[3]) if len(argv) > 3 else None
+    except ValueError:
+        print('table_id and offset must be integers')
+        help()
+        sys.exit(1)
+    return (argv[1], table_id, end)
+
+
+def help():
+    '''
+    Prints a usage help message.
+    '''
+    print('usage:')
+    print('hand_log.py <log_file> [table_id] [offset]')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,424 @@
+'''
+The `load_generator` module load tests a running poker server with scripted
+players. Each bot speaks the same protocol as poker_client: the first bot
+at a table sends `start`, the others `join` it by table id (following any
+redirect), and then they ante, take their cards, bet, draw and answer the
+play again question with no pause, for a set number of hands.
+
+Bots run as asyncio tasks in several processes. When every table is done
+the run is reported as JSON: hands per second over all tables, the latency
+of the server's answers (from a bot sending an action to it receiving the
+next message), bytes and messages, and failures by type. The exit status is
+1 if any bot failed:
+
+    load_generator.py <host> <port> [processes] [tables] [players] [hands] [codec]
+
+`tables` is the number of tables per process. Every bot keeps a connection
+open, so the open file limit (ulimit -n) must allow processes * tables *
+players of them, on both the server and this side.
+'''
+
+import asyncio
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+import codec
+import framing
+import net_stats
+
+DEFAULT_PROCESSES = 2
+DEFAULT_TABLES = 50
+DEFAULT_PLAYERS = 3
+DEFAULT_HANDS = 10
+
+WALLET_AMT = 1000
+ANTE_AMT = 5
+
+# Odds of each betting choice when a bot is not the first to bet. Bots only
+# fold in the second round, as poker_client does not follow a table where
+# a player folded before the draw.
+RAISE_RATE = 0.1
+FOLD_RATE = 0.1
+MAX_RAISE = 5
+
+# Seconds a bot waits for any message before it counts as a failure; longer
+# than the server's turn timeout
+RECV_TIMEOUT = 60.0
+
+# Connections a process opens at the same time, to stay inside the server's
+# listen backlog
+CONNECT_CONCURRENCY = 50
+
+BEGIN = 'begin'
+NOTIFY = 'notify'
+REDIRECT = 'redirect'
+TIMEOUT = 'Timeout'
+
+
+class BotConnection(framing.AsyncConnection):
+    '''
+    A bot's connection to the server. Like poker_client.ServerConnection it
+    answers TIMEOUT and reads on, and every receive has a deadline.
+    '''
+
+    async def recv_bytes(self, kind='bytes'):
+        while True:
+            receive = super().recv_bytes(kind)
+            data = await asyncio.wait_for(receive, RECV_TIMEOUT)
+            if data != self.codec.encode_text(TIMEOUT):
+                return data
+            self.send(TIMEOUT)
+
+
+async def connect(addr, msg, connecting):
+    '''
+    Connects to the server, sends a start or join message and returns a
+    tuple of the connection and the words of the ack. Follows redirects.
+
+    addr: (host, port) - the server address
+    msg: str - the start or join message
+    connecting: Semaphore - limits connections being opened at once
+    '''
+    async with connecting:
+        while True:
+            reader, writer = await asyncio.open_connection(addr[0], addr[1])
+            conn = BotConnection(reader, writer, net_stats.ConnectionStats(msg))
+            conn.send(msg)
+            ack = (await conn.recv()).split()
+
+            if len(ack) == 2 and ack[0] == REDIRECT:
+                await conn.wait_closed()
+                addr = (addr[0], int(ack[1]))
+                continue
+
+            if len(ack) < 4 or ack[:2] != ['ack', 'join']:
+                await conn.wait_closed()
+                raise BotError('not seated: ' + ' '.join(ack))
+            if len(ack) == 6:
+                conn.codec = codec.CODECS.get(ack[5], codec.TEXT_CODEC)
+            return (conn, ack)
+
+
+async def play(conn, p_id, num_hands, rng):
+    '''
+    Plays hands the way poker_client does until `num_hands` are done or the
+    table is over, then leaves. Returns the number of hands played.
+
+    conn: BotConnection - the bot's seated connection
+    p_id: int - the bot's player ID
+    num_hands: int - the number of hands to play
+    rng: Random - the bot's random choices
+    '''
+    # Wait for the other players
+    while True:
+        msg = await conn.recv()
+        if msg == BEGIN:
+            break
+        if not msg.startswith(NOTIFY):
+            raise BotError('unexpected message before begin: ' + msg)
+
+    hands = 0
+    while True:
+        # Ante and deal
+        await conn.recv()
+        conn.send_action(codec.ANTE, p_id, ANTE_AMT)
+        await conn.recv_cards()
+        conn.send('Received')
+
+        # First round of betting
+        await conn.recv()
+        await bet_round(conn, p_id, rng, False)
+
+        msg = await conn.recv()
+        if msg == 'Winner':
+            await conn.recv()
+        elif msg == 'Betting':
+            await trade(conn, rng)
+
+            # Second round of betting
+            await conn.recv()
+            await bet_round(conn, p_id, rng, True)
+            await conn.recv()
+        else:
+            raise BotError('unexpected message after betting: ' + msg)
+
+        # Win or Lose
+        await conn.recv()
+        hands += 1
+
+        # Play again?
+        await conn.recv()
+        if hands >= num_hands:
+            conn.send('N')
+            break
+        conn.send('Start')
+        if await conn.recv() == 'Over':
+            break
+
+    await conn.wait_closed()
+    return hands
+
+
+async def bet_round(conn, p_id, rng, can_fold):
+    '''
+    Answers bet prompts until the round of betting is over.
+
+    conn: BotConnection - the bot's connection
+    p_id: int - the bot's player ID
+    rng: Random - the bot's random choices
+    can_fold: bool - True if the bot may fold
+    '''
+    while True:
+        prompt = await conn.recv_bet_prompt()
+        if prompt is None:
+            return
+
+        max_bet, cur_bet, first = prompt
+        choice = rng.random()
+        if first:
+            conn.send_action(codec.CHECK, p_id, cur_bet)
+        elif can_fold and choice < FOLD_RATE:
+            # No more prompts follow, only the end of betting
+            conn.send_action(codec.FOLD, p_id)
+        elif choice < FOLD_RATE + RAISE_RATE:
+            conn.send_action(codec.RAISE, p_id, rng.randint(1, MAX_RAISE))
+        else:
+            conn.send_action(codec.CALL, p_id, max_bet - cur_bet)
+
+
+async def trade(conn, rng):
+    '''
+    Answers the draw: stands pat half the time, otherwise discards one to
+    three random cards and takes the new ones.
+
+    conn: BotConnection - the bot's connection
+    rng: Random - the bot's random choices
+    '''
+    await conn.recv()
+    if rng.random() < 0.5:
+        conn.send_discard([])
+        return
+
+    positions = sorted(rng.sample(range(1, 6), rng.randint(1, 3)))
+    conn.send_discard(positions)
+    await conn.recv()
+    conn.send(str(len(positions)))
+    await conn.recv_cards()
+    conn.send('Received')
+
+
+async def run_table(addr, table_no, num_players, num_hands, wire_codec, connecting, results):
+    '''
+    Starts a table, seats the other bots at it and plays it out, adding the
+    outcome to `results`.
+
+    addr: (host, port) - the server address
+    table_no: int - the table's number in this process, for names and seeds
+    num_players: int - the number of bots at the table
+    num_hands: int - the number of hands to play
+    wire_codec: TextCodec or BinaryCodec - the codec the bots ask for
+    connecting: Semaphore - limits connections being opened at once
+    results: Results - where the outcome is added
+    '''
+    option = codec.option(wire_codec)
+    rng = random.Random(table_no)
+    conns = []
+    try:
+        conn, ack = await connect(
+            addr,
+            'start {} {} {} bot{}_0 {}'.format(num_players, WALLET_AMT, ANTE_AMT, table_no, option),
+            connecting)
+        conns.append((conn, int(ack[2])))
+        table_id = int(ack[4])
+
+        for seat in range(1, num_players):
+            conn, ack = await connect(
+                addr, 'join bot{}_{} {} {}'.format(table_no, seat, table_id, option), connecting)
+            conns.append((conn, int(ack[2])))
+    except Exception as e:
+        results.fail(e)
+        for conn, _ in conns:
+            conn.close()
+        return
+
+    bots = [play(conn, p_id, num_hands, random.Random(rng.random())) for conn, p_id in conns]
+    outcomes = await asyncio.gather(*bots, return_exceptions=True)
+
+    for (conn, _), outcome in zip(conns, outcomes):
+        results.add_connection(conn.stats)
+        if isinstance(outcome, BaseException):
+            results.fail(outcome)
+            conn.close()
+
+    # The starting bot plays every hand of the table
+    if not isinstance(outcomes[0], BaseException):
+        results.hands += outcomes[0]
+
+
+class Results:
+    '''
+    The outcome of the tables of one or more processes.
+    '''
+
+    def __init__(self):
+        self.hands = 0
+        self.bots = 0
+        self.failures = dict()
+        self.messages = dict()
+
+    def fail(self, error):
+        '''
+        Counts a failed bot by the type of its error.
+
+        error: Exception - the error
+        '''
+        name = type(error).__name__
+        self.failures[name] = self.failures.get(name, 0) + 1
+
+    def add_connection(self, stats):
+        '''
+        Adds a bot's message stats.
+
+        stats: ConnectionStats - the stats of the bot's connection
+        '''
+        self.bots += 1
+        for kind, kind_stats in stats.kinds.items():
+            if kind not in self.messages:
+                self.messages[kind] = net_stats.MessageStats()
+            self.messages[kind].merge(kind_stats)
+
+    def merge(self, other):
+        '''
+        Adds the results of another process.
+
+        other: Results - the results to add
+        '''
+        self.hands += other.hands
+        self.bots += other.bots
+        for name, num in other.failures.items():
+            self.failures[name] = self.failures.get(name, 0) + num
+        for kind, kind_stats in other.messages.items():
+            if kind not in self.messages:
+                self.messages[kind] = net_stats.MessageStats()
+            self.messages[kind].merge(kind_stats)
+
+
+async def run_tables(addr, first_table, num_tables, num_players, num_hands, codec_name):
+    '''
+    Plays a number of tables at once and returns the Results.
+    '''
+    connecting = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    results = Results()
+    wire_codec = codec.CODECS[codec_name]
+    await asyncio.gather(*[
+        run_table(addr, first_table + i, num_players, num_hands, wire_codec, connecting, results)
+        for i in range(num_tables)])
+    return results
+
+
+def run_process(args):
+    '''
+    Entry point of a load generating process.
+
+    args: tuple - the arguments of run_tables
+    '''
+    return asyncio.run(run_tables(*args))
+
+
+def run(addr, num_processes, num_tables, num_players, num_hands, codec_name=codec.BINARY_NAME):
+    '''
+    Runs the load test and returns the report as a dict.
+
+    addr: (host, port) - the server address
+    num_processes: int - the number of processes
+    num_tables: int - the number of tables per process
+    num_players: int - the number of bots per table
+    num_hands: int - the number of hands per table
+    codec_name: str - the codec the bots ask for
+    '''
+    jobs = [(addr, p * num_tables, num_tables, num_players, num_hands, codec_name)
+            for p in range(num_processes)]
+
+    started = time.perf_counter()
+    with multiprocessing.Pool(num_processes) as pool:
+        outcomes = pool.map(run_process, jobs)
+    seconds = time.perf_counter() - started
+
+    results = Results()
+    for outcome in outcomes:
+        results.merge(outcome)
+
+    actions = results.messages.get('action', net_stats.MessageStats())
+    return {
+        'processes': num_processes,
+        'tables': num_processes * num_tables,
+        'bots': results.bots,
+        'codec': codec_name,
+        'hands': results.hands,
+        'seconds': round(seconds, 3),
+        'hands_per_sec': round(results.hands / seconds, 1) if seconds else None,
+        'action_latency_us': actions.rtt_us.snapshot(),
+        'messages': {kind: stats.snapshot() for kind, stats in sorted(results.messages.items())},
+        'failures': results.failures,
+        'ok': not results.failures,
+    }
+
+
+class BotError(Exception):
+    '''
+    Raised when the server sends a bot something it does not expect.
+    '''
+    pass
+
+
+def main(argv):
+    addr, args = get_cmd_args(argv)
+    report = run(addr, *args)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['ok'] else 1)
+
+
+def get_cmd_args(argv):
+    '''
+    Validates command line arguments and returns a tuple of
+    ((host, port), (processes, tables, players, hands, codec_name)).
+    '''
+    if not 3 <= len(argv) <= 8:
+        help()
+        sys.exit(1)
+
+    try:
+        addr = (argv[1], int(argv[2]))
+        counts = [DEFAULT_PROCESSES, DEFAULT_TABLES, DEFAULT_PLAYERS, DEFAULT_HANDS]
+        for i, arg in enumerate(argv[3:7]):
+            counts[i] = int(arg)
+        if min(counts) < 1 or not 2 <= counts[2] <= 5:
+            raise ValueError()
+    except ValueError:
+        print('port and counts must be positive integers, with 2 to 5 players')
+        help()
+        sys.exit(1)
+
+    codec_name = argv[7] if len(argv) > 7 else codec.BINARY_NAME
+    if codec_name not in codec.CODECS:
+        print('unknown codec', codec_name)
+        help()
+        sys.exit(1)
+
+    return (addr, tuple(counts) + (codec_name,))
+
+
+def help():
+    '''
+    Prints a usage help message.
+    '''
+    print('usage:')
+    print('load_generator.py <host> <port> [processes] [tables] [players] [hands] [codec]')
+    print('codec is one of: ' + ', '.join(sorted(codec.CODECS)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
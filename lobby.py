@@ -0,0 +1,231 @@
+'''
+The `lobby` module keeps track of the tables hosted by one server process.
+Each table has its own GameStateManager, so the state of one game never
+touches another. The lobby creates tables on `start`, finds them for `join`
+and `list`, and forgets them once their game is over.
+
+A server can run as several worker processes, each with its own lobby. The
+tables are then split between the workers by table id: a table belongs to
+worker `table_id % num_workers`, and each worker also listens on a private
+port, `port + 1 + worker_id`, so players can be sent to the worker that
+owns their table.
+'''
+
+import asyncio
+
+import cards
+import game_state_manager as gsm
+
+WAITING = 'waiting'
+PLAYING = 'playing'
+
+
+class Table:
+    '''
+    A game being set up or played, and the connections of its players.
+    '''
+
+    def __init__(self, table_id, manager=None, snapshot=None, recorder=None):
+        '''
+        Creates a table for a game that is waiting for players.
+
+        table_id: int - the table's id in the lobby
+        manager: GameStateManager - the table's game
+        snapshot: bytes - the table's game as a snapshot, if it is restored
+                          from one instead
+        recorder: Recorder - optional, records the game restored from the
+                             snapshot
+        '''
+        self.table_id = table_id
+        self._manager = manager
+        # Only restored when the game is first used, so a server with many
+        # tables starts at once
+        self.snapshot = snapshot
+        self.recorder = recorder
+        self.connections = []
+        # Set once every seat is taken
+        self.full = asyncio.Event()
+        # The task playing the game, once it has begun
+        self.task = None
+
+    @property
+    def manager(self):
+        '''
+        The table's GameStateManager. A game restored from a snapshot cannot
+        carry on with the hand it was in, so that hand is called off and the
+        bets given back.
+        '''
+        if self._manager is None:
+            self._manager = gsm.restore(self.snapshot, self.recorder)
+            self._manager.void_hand()
+            self.snapshot = None
+        return self._manager
+
+    def status(self):
+        '''
+        Returns WAITING while seats are free, PLAYING after that.
+        '''
+        return PLAYING if self.full.is_set() else WAITING
+
+    def describe(self):
+        '''
+        Returns the table as it is shown by `list`: id, players seated out of
+        the number of seats, and status, separated by colons. A table not yet
+        restored from its snapshot is described from the snapshot, so listing
+        tables does not restore them.
+        '''
+        if self.snapshot is not None:
+            num_seated, num_players = gsm.snapshot_seats(self.snapshot)
+        else:
+            num_seated = self.manager.get_curr_num_players()
+            num_players = self.manager.num_players
+        return '{}:{}/{}:{}'.format(self.table_id, num_seated, num_players, self.status())
+
+
+class Lobby:
+    '''
+    The tables of a server, by table id.
+    '''
+
+    def __init__(self, seed=None, worker_id=0, num_workers=1, port=None, log=None):
+        '''
+        Creates an empty lobby.
+
+        seed: int - optional, seeds every table's deck so hands can be
+                    replayed from (seed, table_id, hand_no)
+        worker_id: int - the worker the lobby belongs to, 0 if only one
+        num_workers: int - the number of workers of the server
+        port: int - the server's public port, which the workers' private
+                    ports follow
+        log: HandLog - optional, the hand log every table's game is
+                       recorded in
+        '''
+        self.seed = seed
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self.port = port
+        self.log = log
+        self.tables = dict()
+        self.next_id = 1
+
+    def create_table(self, num_players, wallet_amt, ante_amt):
+        '''
+        Creates a table with a new game and returns it.
+
+        num_players: int - the number of players the game waits for
+        wallet_amt: int - the amount every player starts with
+        ante_amt: int - the ante of every hand
+        '''
+        table_id = self.next_id * self.num_workers + self.worker_id
+        self.next_id += 1
+
+        seed = None
+        if self.seed is not None:
+            seed = cards.stream_seed(self.seed, table_id)
+
+        recorder = None
+        if self.log is not None:
+            recorder = self.log.recorder(table_id)
+
+        manager = gsm.GameStateManager(num_players, wallet_amt, ante_amt, seed, recorder)
+        table = Table(table_id, manager)
+        self.tables[table_id] = table
+        return table
+
+    def restore(self, snapshots):
+        '''
+        Adds tables restored from snapshots. They wait for their players to
+        join them again by table id, and new tables are given ids after
+        theirs.
+
+        snapshots: dict - table id -> the snapshot of the table's game
+        '''
+        for table_id, data in snapshots.items():
+            recorder = None
+            if self.log is not None:
+                recorder = self.log.recorder(table_id)
+            self.tables[table_id] = Table(table_id, snapshot=data, recorder=recorder)
+            self.next_id = max(self.next_id, table_id // self.num_workers + 1)
+
+    def get_table(self, table_id):
+        '''
+        Returns the table with the given id. Raises a TableNotFoundError if
+        there is none.
+
+        table_id: int - the table's id
+        '''
+        try:
+            return self.tables[table_id]
+        except KeyError:
+            raise TableNotFoundError('no table ' + str(table_id))
+
+    def owner(self, table_id):
+        '''
+        Returns the id of the worker that owns a table id.
+
+        table_id: int - the table's id
+        '''
+        return table_id % self.num_workers
+
+    def owner_port(self, table_id):
+        '''
+        Returns the private port of the worker that owns a table id.
+
+        table_id: int - the table's id
+        '''
+        return worker_port(self.port, self.owner(table_id))
+
+    def open_table(self):
+        '''
+        Returns the longest waiting table that has a free seat, or None.
+        '''
+        for table in self.tables.values():
+            if table.status() != WAITING or table.snapshot is not None:
+                continue
+            manager = table.manager
+            if manager.next_id <= manager.num_players:
+                return table
+        return None
+
+    def remove_table(self, table_id):
+        '''
+        Forgets a table. Does nothing if it was already removed.
+
+        table_id: int - the table's id
+        '''
+        table = self.tables.pop(table_id, None)
+        if table is None:
+            return
+        # A table never restored from its snapshot is not restored to close it
+        if table.snapshot is not None:
+            recorder = table.recorder
+        else:
+            recorder = table.manager.recorder
+        if recorder is not None:
+            recorder.closed()
+
+    def list_tables(self):
+        '''
+        Returns every table, oldest first.
+        '''
+        return list(self.tables.values())
+
+    def __len__(self):
+        return len(self.tables)
+
+
+def worker_port(port, worker_id):
+    '''
+    Returns the private port of a worker.
+
+    port: int - the server's public port
+    worker_id: int - the worker's id
+    '''
+    return port + 1 + worker_id
+
+
+class TableNotFoundError(Exception):
+    '''
+    Raised when a table id does not match any table.
+    '''
+    pass
@@ -0,0 +1,359 @@
+'''
+The `net_stats` module measures the server's connections. For every
+connection and every kind of message it counts messages and bytes in each
+direction, and it times round trips: from a message sent to the player to
+the next message received from them. A round trip to a betting prompt
+includes the time the player took to decide, so the kernel's own estimate
+of the network round trip is recorded next to it, and the lag of the event
+loop shows time lost to the server being busy.
+
+Times are kept in Histograms, which work like HdrHistogram: values are
+bucketed with a fixed relative precision, so percentiles stay accurate over
+a wide range at a small, fixed cost per value. NetStats.snapshot returns
+everything as a dict ready for json.dumps.
+'''
+
+import asyncio
+import socket
+import struct
+import time
+
+# Each power of two range of values is split into 2 ** SUB_BUCKET_BITS
+# buckets, so values are kept to within 1 part in 128
+SUB_BUCKET_BITS = 7
+
+# Percentiles included in a histogram's snapshot
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Seconds between event loop lag samples
+LOOP_SAMPLE_INTERVAL = 0.1
+
+# Kind under which messages are counted from when they arrive until the
+# game receives them and their kind is known
+UNREAD = 'unread'
+
+# Offset and layout of tcpi_rtt (microseconds) in Linux's struct tcp_info
+_TCP_INFO_RTT = struct.Struct('=I')
+_TCP_INFO_RTT_OFFSET = 68
+_TCP_INFO_SIZE = 104
+
+
+class Histogram:
+    '''
+    A histogram of non-negative ints, such as latencies in microseconds.
+    '''
+
+    def __init__(self, sub_bucket_bits=SUB_BUCKET_BITS):
+        '''
+        Creates an empty histogram.
+
+        sub_bucket_bits: int - log2 of the buckets per power of two
+        '''
+        self.sub_bits = sub_bucket_bits
+        self.sub_count = 1 << sub_bucket_bits
+        # Bucket index -> number of values, only for buckets in use
+        self.counts = dict()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        '''
+        Returns the bucket index of a value. Values below sub_count get a
+        bucket each; above that, each power of two range is split into
+        sub_count buckets.
+
+        value: int - the value
+        '''
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bits - 1
+        return ((shift + 1) << self.sub_bits) + (value >> shift) - self.sub_count
+
+    def _highest(self, index):
+        '''
+        Returns the largest value that falls in a bucket.
+
+        index: int - the bucket index
+        '''
+        if index < self.sub_count:
+            return index
+        shift = (index >> self.sub_bits) - 1
+        lowest = ((index & (self.sub_count - 1)) + self.sub_count) << shift
+        return lowest + (1 << shift) - 1
+
+    def record(self, value):
+        '''
+        Records a value. Negative values are recorded as 0.
+
+        value: int - the value
+        '''
+        value = max(0, int(value))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        '''
+        Adds the values of another histogram with the same precision.
+
+        other: Histogram - the histogram to add
+        '''
+        for index, num in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + num
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, pct):
+        '''
+        Returns the value below which `pct` percent of the values fall, as
+        the top of the bucket it is in, or 0 if the histogram is empty.
+
+        pct: float - the percentile, 0 to 100
+        '''
+        if not self.count:
+            return 0
+        target = max(1, -int(-pct * self.count // 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._highest(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        '''
+        Returns the count, min, mean, max and PERCENTILES as a dict.
+        '''
+        snap = {
+            'count': self.count,
+            'min': self.min or 0,
+            'mean': round(self.total / self.count, 1) if self.count else 0,
+            'max': self.max,
+        }
+        for pct in PERCENTILES:
+            snap['p{:g}'.format(pct)] = self.percentile(pct)
+        return snap
+
+
+class MessageStats:
+    '''
+    Counters for one kind of message on one connection.
+    '''
+
+    __slots__ = ('msgs_out', 'bytes_out', 'msgs_in', 'bytes_in', 'rtt_us')
+
+    def __init__(self):
+        self.msgs_out = 0
+        self.bytes_out = 0
+        self.msgs_in = 0
+        self.bytes_in = 0
+        # Time from sending this kind of message to the next message received
+        self.rtt_us = Histogram()
+
+    def merge(self, other):
+        self.msgs_out += other.msgs_out
+        self.bytes_out += other.bytes_out
+        self.msgs_in += other.msgs_in
+        self.bytes_in += other.bytes_in
+        self.rtt_us.merge(other.rtt_us)
+
+    def snapshot(self):
+        snap = {
+            'msgs_out': self.msgs_out,
+            'bytes_out': self.bytes_out,
+            'msgs_in': self.msgs_in,
+            'bytes_in': self.bytes_in,
+        }
+        if self.rtt_us.count:
+            snap['rtt_us'] = self.rtt_us.snapshot()
+        return snap
+
+
+class ConnectionStats:
+    '''
+    The stats of one connection, by kind of message.
+    '''
+
+    def __init__(self, label, sock=None):
+        '''
+        Creates empty stats.
+
+        label: str - names the connection in snapshots
+        sock: socket - optional, the connection's socket, to read the
+                       kernel's round trip estimate from
+        '''
+        self.label = label
+        self.sock = sock
+        self.kinds = dict()
+        self.opened = time.monotonic()
+        # Kind and time of the last message sent and not yet answered
+        self.waiting_kind = None
+        self.waiting_since = 0.0
+
+    def _kind(self, kind):
+        stats = self.kinds.get(kind)
+        if stats is None:
+            stats = self.kinds[kind] = MessageStats()
+        return stats
+
+    def sent(self, kind, num_bytes):
+        '''
+        Records a message sent. It starts a round trip, replacing any
+        unanswered one, since only the last message before a reply is the
+        one being answered.
+
+        kind: str - the kind of message
+        num_bytes: int - its size on the wire
+        '''
+        stats = self._kind(kind)
+        stats.msgs_out += 1
+        stats.bytes_out += num_bytes
+        self.waiting_kind = kind
+        self.waiting_since = time.perf_counter()
+
+    def arrived(self, num_bytes):
+        '''
+        Records a message as it arrives. It is counted as UNREAD until the
+        game receives it.
+
+        num_bytes: int - its size on the wire
+        '''
+        stats = self._kind(UNREAD)
+        stats.msgs_in += 1
+        stats.bytes_in += num_bytes
+
+    def received(self, kind, num_bytes, arrived):
+        '''
+        Records a message received by the game, moving it from UNREAD to its
+        kind. It ends the round trip in progress at the time it arrived,
+        unless it arrived before that round trip started.
+
+        kind: str - the kind of message
+        num_bytes: int - its size on the wire
+        arrived: float - the time.perf_counter() it arrived at
+        '''
+        unread = self._kind(UNREAD)
+        unread.msgs_in -= 1
+        unread.bytes_in -= num_bytes
+        stats = self._kind(kind)
+        stats.msgs_in += 1
+        stats.bytes_in += num_bytes
+        if self.waiting_kind is not None and arrived >= self.waiting_since:
+            elapsed = arrived - self.waiting_since
+            self._kind(self.waiting_kind).rtt_us.record(elapsed * 1e6)
+            self.waiting_kind = None
+
+    def tcp_rtt_us(self):
+        '''
+        Returns the kernel's smoothed round trip time of the connection in
+        microseconds, or None where TCP_INFO is not available.
+        '''
+        if self.sock is None or not hasattr(socket, 'TCP_INFO'):
+            return None
+        try:
+            info = self.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, _TCP_INFO_SIZE)
+        except OSError:
+            return None
+        if len(info) < _TCP_INFO_RTT_OFFSET + _TCP_INFO_RTT.size:
+            return None
+        return _TCP_INFO_RTT.unpack_from(info, _TCP_INFO_RTT_OFFSET)[0]
+
+    def snapshot(self):
+        return {
+            'label': self.label,
+            'age_s': round(time.monotonic() - self.opened, 1),
+            'tcp_rtt_us': self.tcp_rtt_us(),
+            'messages': {kind: stats.snapshot() for kind, stats in sorted(self.kinds.items())},
+        }
+
+
+class NetStats:
+    '''
+    The stats of every connection of a server. Connections are tracked
+    while open; when one closes its counters are added to the totals of
+    closed connections, so memory does not grow with the number served.
+    '''
+
+    def __init__(self):
+        self.connections = dict()
+        self.closed = dict()
+        self.num_closed = 0
+        # How late the event loop runs a task that asked to sleep
+        self.loop_lag_us = Histogram()
+        self.started = time.monotonic()
+
+    def open(self, label, sock=None):
+        '''
+        Returns new ConnectionStats for a connection and tracks them.
+
+        label: str - names the connection in snapshots
+        sock: socket - optional, the connection's socket
+        '''
+        stats = ConnectionStats(label, sock)
+        self.connections[id(stats)] = stats
+        return stats
+
+    def close(self, stats):
+        '''
+        Stops tracking a connection and adds it to the closed totals. Does
+        nothing if it was already closed.
+
+        stats: ConnectionStats - the connection's stats
+        '''
+        if self.connections.pop(id(stats), None) is None:
+            return
+        self.num_closed += 1
+        _merge_kinds(self.closed, stats.kinds)
+
+    async def sample_loop_lag(self):
+        '''
+        Records the event loop's lag every LOOP_SAMPLE_INTERVAL seconds
+        until the task is cancelled.
+        '''
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(LOOP_SAMPLE_INTERVAL)
+            late = time.perf_counter() - before - LOOP_SAMPLE_INTERVAL
+            self.loop_lag_us.record(late * 1e6)
+
+    def snapshot(self):
+        '''
+        Returns every stat as a dict: the open connections, the totals by
+        kind of message over all connections, and the loop lag.
+        '''
+        totals = dict()
+        _merge_kinds(totals, self.closed)
+        for stats in self.connections.values():
+            _merge_kinds(totals, stats.kinds)
+
+        return {
+            'uptime_s': round(time.monotonic() - self.started, 1),
+            'open_connections': len(self.connections),
+            'closed_connections': self.num_closed,
+            'loop_lag_us': self.loop_lag_us.snapshot(),
+            'totals': {kind: stats.snapshot() for kind, stats in sorted(totals.items())},
+            'connections': [stats.snapshot() for stats in self.connections.values()],
+        }
+
+
+def _merge_kinds(into, kinds):
+    '''
+    Adds MessageStats by kind into another dict of them.
+
+    into: dict - kind -> MessageStats, added to
+    kinds: dict - kind -> MessageStats to add
+    '''
+    for kind, stats in kinds.items():
+        if kind not in into:
+            into[kind] = MessageStats()
+        into[kind].merge(stats)
@@ -33,11 +33,14 @@ class Player:
         self.id = player_id
         self.prompt = '> '
 
-    def get_action(self):
+    def get_action(self, read_line=input):
         '''
         Provides the player with options of what to do doing their turn. Only
         called when the server notifies the client it is this player's turn.
         Returns a string in the form of a TCP API call to the server.
+
+        read_line: function - shows a prompt and returns the line typed, such
+                              as input or ServerConnection.read_line
         '''
         # Can add extra options to each command, but keep the first one
         # the same as it is because that is the TCP API command name.
@@ -59,7 +62,7 @@ class Player:
         # Print menu and get response
         self.print_menu()
         while True:
-            choice = input(self.prompt).strip()
+            choice = read_line(self.prompt).strip()
             choice_lst = choice.split()
             len_args = len(choice_lst)
             cmd = choice_lst[0]
@@ -95,10 +98,11 @@ class Player:
 
             if cmd in bet_info:
                 # IMPORTANT: If this option is chosen, the method needs to be
-                # called again once the player receives the info. Without some
-                # extra multi-threading, the prompt will block the info from
-                # getting printed. So, for now this returns the API string,
-                # BUT WE STILL NEED TO CALL THIS METHOD AGAIN IN THE CLIENT.
+                # called again once the player receives the info. With
+                # ServerConnection.read_line as `read_line`, messages are shown
+                # as they arrive, so the prompt does not block the info. This
+                # returns the API string, BUT WE STILL NEED TO CALL THIS METHOD
+                # AGAIN IN THE CLIENT.
                 return bet_info[0] + _id
 
             # TODO: Add a way to check that if this is called, it is only
@@ -118,10 +122,13 @@ class Player:
                     continue
 
                 try:
-                    int(choice_lst[1])
+                    raise_amt = int(choice_lst[1])
                 except ValueError:
                     print("invalid command: argument is not an integer")
                     continue
+                if raise_amt < 0:
+                    print("invalid command: cannot raise by a negative amount")
+                    continue
 
                 return rse[0] + _id + ' ' + choice_lst[1]
 
@@ -217,6 +224,17 @@ class Player:
         '''
         return self._debit_wallet(amt)
 
+    def all_in(self):
+        '''
+        Bets everything left in this player's wallet, for when they do not
+        have enough to ante, check, call or raise. The player stays in the
+        hand, but can only win as much from each other player as they bet.
+        Returns the amount bet.
+        '''
+        amt = self.wallet
+        self.wallet = 0
+        return amt
+
     def _debit_wallet(self, amt):
         '''
         Removes money from the player's wallet if able to do so. True if 
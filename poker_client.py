@@ -3,21 +3,29 @@ The `poker_client` provides business logic to allow a client (player) to
 communicate with the poker server (game manager) and play a game of poker with
 others.
 '''
-import sys
+import json
 import socket
+import sys
 
 import player
 import cards
+import client_io
+import codec
+import discard_advisor
+import framing
 
 # Possible command options
 START = 'start'
 JOIN = 'join'
+LIST = 'list'
+STATS = 'stats'
+REDIRECT = 'redirect'
 BEGIN = 'begin'
 NOTIFY = 'notify'
 DISCARD = 'discard'
 
-# Message buffer size (somewhat arbitrary, should be fine for all messages)
-BUFF_SIZE = 512
+# The codec asked for at start or join; the server may answer in text
+WIRE_CODEC = codec.BINARY_CODEC
 
 
 def main(argv):
@@ -25,26 +33,35 @@ def main(argv):
     args = get_cmd_args(argv)
     cmd = args[0]
     server_addr = args[1]
-    if cmd == START:
+    if cmd == LIST:
+        list_tables(server_addr)
+        return
+    elif cmd == STATS:
+        print_stats(server_addr)
+        return
+    elif cmd == START:
         num_players, wallet_amt, ante, name = args[2:]
-        msg = '{} {} {} {} {}'.format(
-            START, num_players, wallet_amt, ante, name)
+        msg = '{} {} {} {} {} {}'.format(
+            START, num_players, wallet_amt, ante, name, codec.option(WIRE_CODEC))
     else:
-        name = args[2]
+        name, table_id = args[2:]
         msg = '{} {}'.format(JOIN, name)
+        if table_id is not None:
+            msg += ' {}'.format(table_id)
+        msg += ' ' + codec.option(WIRE_CODEC)
 
-    # Connect to server
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect(server_addr)
-
-    # Send message and wait for response
-    sock.send(msg.encode())
-    response = sock.recv(BUFF_SIZE).decode()
+    # Connect to server, send message and wait for response
+    sock, response = send_first_message(server_addr, msg)
     print(response);
 
     # If successful, set name and wait for other players to join until game starts
     player = handle_start_and_join_response(response, name)
 
+    # Switch to the codec the server picked, if it named one
+    ack = response.split()
+    if len(ack) == 6:
+        sock.codec = codec.CODECS.get(ack[5], codec.TEXT_CODEC)
+
     print('Waiting for other players.')
     wait_for_start(sock)
 
@@ -56,7 +73,7 @@ def game_play(sock, player):
     '''
     Primary gameplay functionality for the client.
 
-    sock: socket - client socket object
+    sock: Connection - framed connection to the server
     player: Player - the player object
     '''
     # Most of these should be in other functions:
@@ -87,7 +104,7 @@ def game_play(sock, player):
 
         handle_deal(sock, player)
         # Get first player id
-        first_player_id = sock.recv(BUFF_SIZE).decode()
+        first_player_id = sock.recv()
         first_player_id = first_player_id.strip().split()
         print('The first player is {}'.format(first_player_id[0]))
 
@@ -102,9 +119,9 @@ def game_play(sock, player):
         # if not is_leave:
 
         # Check if has winner, start new game or continue a second round of betting 
-        msg = sock.recv(BUFF_SIZE).decode()
+        msg = sock.recv()
         if msg == "Winner":
-            winner_info = sock.recv(BUFF_SIZE).decode()
+            winner_info = sock.recv()
             print(winner_info)
         elif msg == "Betting":
             # Handle swap the cards in hand
@@ -112,7 +129,7 @@ def game_play(sock, player):
             handle_card_trade(sock, player)
 
             # Get first player id
-            first_player_id = sock.recv(BUFF_SIZE).decode()
+            first_player_id = sock.recv()
             first_player_id = first_player_id.strip().split()
             print('The first player is {}'.format(first_player_id[0]))
 
@@ -124,11 +141,11 @@ def game_play(sock, player):
                 return
 
             # Get the winner information
-            winner_info = sock.recv(BUFF_SIZE).decode()
+            winner_info = sock.recv()
             print(winner_info)
 
         # Add the bets to wallet if the player win the game
-        msg = sock.recv(BUFF_SIZE).decode()
+        msg = sock.recv()
         print(msg)
         msg = msg.strip().split()
 
@@ -138,25 +155,36 @@ def game_play(sock, player):
         # Reset player
         player.reset()
 
-        # Check with player if start new game
-        resp = sock.recv(BUFF_SIZE).decode()
+        # Check with player if start new game, unless they have no chips
+        # left to play with
+        resp = sock.recv()
         print(resp)
-        new_game = input()
+        if resp == 'Over':
+            print("You have no chips left. Game Over... ")
+            sock.close()
+            return
+        try:
+            new_game = sock.read_line()
+        except client_io.InputTimeoutError:
+            # The server has taken this as leaving
+            print('player {} leave game'.format(player.id))
+            sock.close()
+            return
 
         if new_game == 'N':
             #msg = 'Leave {}'.format(player.id)
-            sock.send(new_game.encode())
+            sock.send(new_game)
             print('player {} leave game'.format(player.id))
             sock.close()
             is_leave = True
         else:
             msg = 'Start'
-            sock.send(msg.encode())
+            sock.send(msg)
 
         if is_leave:
             return 
 
-        msg = sock.recv(BUFF_SIZE).decode()
+        msg = sock.recv()
         if msg == 'Over':
             print("Game Over... ")
             sock.close()
@@ -168,34 +196,91 @@ def game_play(sock, player):
 
     
 
+def send_first_message(server_addr, msg):
+    '''
+    Connects to the server, sends the first message and returns a tuple of
+    the connection and the response. A server running several workers may
+    answer `redirect <port>` when another worker owns the table; the message
+    is then sent again to that port on the same host.
+
+    server_addr: (host, port) - the server address
+    msg: str - the start or join message
+    '''
+    while True:
+        sock = client_io.ServerConnection(socket.create_connection(server_addr))
+        sock.send(msg)
+        response = sock.recv()
+
+        parts = response.split()
+        if len(parts) != 2 or parts[0] != REDIRECT:
+            return (sock, response)
+
+        sock.close()
+        server_addr = (server_addr[0], int(parts[1]))
+
+
 def handle_start_and_join_response(response, player_name):
     '''
     Handles the server response from a start or join call. If join successfull,
     gets the player ID, asks for a name, and returns a new player object.
+    The response is `ack join <id> <wallet_amt> [table_id] [codec]`.
     '''
     response = response.strip().split()
 
     # Ensure success
-    if len(response) != 4 or response[0] != 'ack' or response[1] != 'join':
+    if len(response) not in (4, 5, 6) or response[0] != 'ack' or response[1] != 'join':
         print('fatal error:', ' '.join(response))
         sys.exit(1)
 
     # Get assigned ID and wallet amount (provided by server for join)
     p_id = int(response[2])
     wallet_amt = int(response[3])
+    if len(response) == 5:
+        print('Seated at table', response[4])
 
     return player.Player(wallet_amt, p_id, player_name)
 
 
+def list_tables(server_addr):
+    '''
+    Asks the server for its tables and prints them.
+
+    server_addr: (host, port) - the server address
+    '''
+    sock = framing.connect(server_addr)
+    sock.send(LIST)
+    response = sock.recv().split()
+    sock.close()
+
+    tables = response[1:]
+    if not tables:
+        print('No tables.')
+    for table in tables:
+        table_id, seats, status = table.split(':')
+        print('Table {}: {} players, {}'.format(table_id, seats, status))
+
+
+def print_stats(server_addr):
+    '''
+    Asks the server for its connection stats and prints them.
+
+    server_addr: (host, port) - the server address
+    '''
+    sock = framing.connect(server_addr)
+    sock.send(STATS)
+    print(json.dumps(json.loads(sock.recv()), indent=2))
+    sock.close()
+
+
 def wait_for_start(sock):
     '''
     Waits for the server to start a game. Prints any messages received while
     waiting.
 
-    sock: socket - client socket object
+    sock: Connection - framed connection to the server
     '''
     while True:
-        msg = sock.recv(BUFF_SIZE).decode()
+        msg = sock.recv()
         print(msg)
 
         if msg == BEGIN:
@@ -226,7 +311,7 @@ def handle_antes(sock, player):
     return a bool ante result 
     '''
     # get the response from server and parse ante_amt and get_response 
-    response = sock.recv(BUFF_SIZE).decode()
+    response = sock.recv()
     response = response.strip().split()
     print(response)
     ante_amt = int(response[0])
@@ -235,10 +320,9 @@ def handle_antes(sock, player):
     # get_response = 1, means give player the right to choose leave or ante the game
     if get_response == 1:
         while True:
-            resp = input('Do you want to ante or leave the game？ \n')
+            resp = sock.read_line('Do you want to ante or leave the game？ \n')
             if resp == 'leave':
-                msg = 'leave {}'.format(player.id)
-                sock.send(msg.encode())
+                sock.send_action(codec.LEAVE, player.id)
                 print('player {} leave game'.format(player.id))
                 sock.close()
                 return False
@@ -251,8 +335,8 @@ def handle_antes(sock, player):
 
 def ante_helper(sock, player, ante_amt):
     '''
-    Helper function for handle_ante(). If player ante successfully, send ante info to server side, 
-    else, send leave info to server side
+    Helper function for handle_ante(). Sends the ante to the server side. A player who
+    cannot cover the ante goes all in with what they have and stays in the game.
 
     sock: the socket
     player: the player
@@ -262,17 +346,15 @@ def ante_helper(sock, player, ante_amt):
     ante_result = player.ante(ante_amt)
     print(ante_result)
     if ante_result:
-        msg = 'ante {} {}'.format(
-        player.id, ante_amt)
-        sock.send(msg.encode())
+        sock.send_action(codec.ANTE, player.id, ante_amt)
         print('player {} ante {}'.format(player.id, ante_amt))
     else:
-        msg = 'leave {}'.format(player.id)
-        sock.send(msg.encode())
-        print('player {} ante failed and leave game'.format(player.id))
-        sock.close()
+        # The server takes no more than the player has
+        amt = player.all_in()
+        sock.send_action(codec.ANTE, player.id, ante_amt)
+        print('player {} is all in with {}'.format(player.id, amt))
 
-    return ante_result
+    return True
 
 def handle_deal(sock, player):
     '''
@@ -283,14 +365,12 @@ def handle_deal(sock, player):
     player: the player
     '''
     # receive deal from deck
-    deal = sock.recv(BUFF_SIZE).decode()
-    print(deal)
-    deal = deal.strip().split()
+    deal = sock.recv_cards()
     card_list = []
 
     # creat card from deal and add to card list
-    for repr in deal:
-        card = cards.Card(repr[0], repr[1:])
+    for code in deal:
+        card = cards.CARDS[code]
         print(card)
         card_list.append(card)
 
@@ -300,7 +380,7 @@ def handle_deal(sock, player):
 
     # info server the player received cards
     msg = 'Received'
-    sock.send(msg.encode())
+    sock.send(msg)
 
 
 def handle_betting(sock, player, first_player_id):
@@ -315,22 +395,23 @@ def handle_betting(sock, player, first_player_id):
     is_leave = False
     while not is_leave:
         # Get the bet info from server
-        bet_info = sock.recv(BUFF_SIZE).decode()
-        if bet_info == "Over":
+        bet_info = sock.recv_bet_prompt()
+        if bet_info is None:
             break; 
 
-        bet_info = bet_info.strip().split()   
         print(bet_info)
 
         # Get the call amount to deduct from player's wallet
-        max_bet = int(bet_info[0])
-        cur_bet = int(bet_info[1])
+        max_bet, cur_bet, first_player = bet_info
         call_amt = max_bet - cur_bet 
-        first_player = True if bet_info[2] == "True" else False
 
         while True: 
-            # Get player's action from command line       
-            action = player.get_action()
+            # Get player's action from command line, unless the server runs
+            # out of time first and checks or folds for the player
+            try:
+                action = player.get_action(sock.read_line)
+            except client_io.InputTimeoutError:
+                break
             print(action)
             action = action.strip().split()
             if action[0] != 'check' and first_player:
@@ -339,18 +420,17 @@ def handle_betting(sock, player, first_player_id):
 
             # handle the action 
             if action[0] == 'check' and first_player:
-                if handle_check(sock, player, cur_bet):
+                if handle_check(sock, player):
                     break
             elif action[0] == 'call':
                 if handle_call(sock, player, call_amt):
                     break
             elif action[0] == 'raise':
                 raise_amt = int(action[2])
-                if handle_raise(sock, player, raise_amt):
+                if handle_raise(sock, player, call_amt, raise_amt):
                     break
             elif action[0] == 'fold':
-                msg = "Fold {}".format(player.id)
-                sock.send(msg.encode())
+                sock.send_action(codec.FOLD, player.id)
                 break
             elif action[0] == 'leave':
                 if handle_leave(player, sock):
@@ -360,23 +440,16 @@ def handle_betting(sock, player, first_player_id):
                 continue
     return is_leave
 
-def handle_check(sock, player, cur_bet):
+def handle_check(sock, player):
     '''
-    Handle the check action. Check is basically a call action, which is allowed only for the first player 
-    when the player own nothing to the pot, the check amount is default to the ante amount. 
+    Handle the check action. Check is allowed only for the first player, who
+    bets nothing more and stays in the hand.
 
     sock: the socket
     player: the first player
-    cur_bet: the ante amount
     '''
-    checked = player.ack_call(cur_bet)
-    if checked:
-        msg = "Check {} {}".format(player.id, cur_bet)
-        sock.send(msg.encode())
-        return True
-    
-    print("Checked failed, please choose another action!")
-    return False
+    sock.send_action(codec.CHECK, player.id, 0)
+    return True
 
 
 def handle_call(sock, player, call_amt):
@@ -389,16 +462,13 @@ def handle_call(sock, player, call_amt):
     call_amt: the call amount to deduct from wallet
     '''
     called = player.ack_call(call_amt)
-    if called:
-        msg = "Call {} {}".format(player.id, call_amt)
-        sock.send(msg.encode())
-        return True
-    
-    print("Call failed, please choose another action!")
-    return False
+    if not called:
+        print('You are all in with {}'.format(player.all_in()))
+    sock.send_action(codec.CALL, player.id, call_amt)
+    return True
 
 
-def handle_raise(sock, player, raise_amt):
+def handle_raise(sock, player, call_amt, raise_amt):
     '''
     Handle the raise action. When you raise, you first bet enough to match what has been bet since the last time 
     you bet (as in calling), then you 'raise' the bet another amount (up to you, but there is typically a limit.) 
@@ -406,24 +476,22 @@ def handle_raise(sock, player, raise_amt):
     you might raise a quarter (up to fifty cents). Since you owed the pot 15 cents for calling and 25 for your raise, 
     you would put 40 cents into the pot.
 
+    A player who does not have enough goes all in instead.
+
     sock: the socket
     player: the player
+    call_amt: the call amount
     raise_amt: the raise amount
     '''
-    raised = player.ack_call(raise_amt)
-    if raised:
-        msg = "Raise {} {}".format(player.id, raise_amt)
-        sock.send(msg.encode())
-        return True
-    
-    valid_amt = player.wallet - call_amt
-    print("Raise failed, please raise valid amount between 1 to {}".format(valid_amt))
-    return False
+    raised = player.ack_call(call_amt + raise_amt)
+    if not raised:
+        print('You are all in with {}'.format(player.all_in()))
+    sock.send_action(codec.RAISE, player.id, raise_amt)
+    return True
 
 def handle_leave(player, sock):
     player.ack_player_left(player.name)
-    msg = "Leave {}".format(player.id)
-    sock.send(msg.encode())
+    sock.send_action(codec.LEAVE, player.id)
     sock.close()
     return True
 
@@ -433,38 +501,54 @@ def handle_betting_info():
 
 
 def handle_card_trade(sock, player):
-    resp = sock.recv(BUFF_SIZE).decode()
+    resp = sock.recv()
     if resp.startswith(DISCARD):
         print("Your current card is \n")
         player.hand.print_hand()
+        print_discard_hint(player)
         start = len(DISCARD) + 1  # +1 to get past space in message
-        discard = input("Are you going to swap cards? Y/N: \n")
-        while discard != 'Y' :
-            if discard == 'N':
-                sock.send("N".encode())
-                return
-            discard = input("Are you going to swap cards? Y/N: \n")
-        print(resp[start:])
-        print("Please choose which card index to discard. The card index is 1-indexed. You can discard at most 3 cards. \n" + 
-               "Example: If you want to discard card 1 and 3, type in '1 3'")
-        discard_cards = input()
+        try:
+            discard = sock.read_line("Are you going to swap cards? Y/N: \n")
+            while discard != 'Y' :
+                if discard == 'N':
+                    sock.send_discard([])
+                    return
+                discard = sock.read_line("Are you going to swap cards? Y/N: \n")
+            print(resp[start:])
+            print("Please choose which card index to discard. The card index is 1-indexed. You can discard at most 3 cards. \n" + 
+                   "Example: If you want to discard card 1 and 3, type in '1 3'")
+            discard_cards = sock.read_line()
+        except client_io.InputTimeoutError:
+            # The server kept all the cards
+            return
         if len(discard_cards) == 0:
             return
-        sock.send(discard_cards.encode()) # Discard card step is also required in manager
         discard_list = discard_cards.strip().split()
         card_list = []
         for card in discard_list:
             card_list.append(int(card))
+        sock.send_discard(card_list) # Discard card step is also required in manager
         player.delete_cards(card_list)
-        resp = sock.recv(BUFF_SIZE).decode()
+        resp = sock.recv()
         print(resp)
         msg = "{}".format(len(card_list))
-        sock.send(msg.encode())
+        sock.send(msg)
         handle_deal(sock, player)
 
 
 
-        
+def print_discard_hint(player):
+    '''
+    Prints the discard that gives the best expected hand, as a hint.
+
+    player: the player
+    '''
+    positions, _ = discard_advisor.best_discard(player.hand)
+    if positions:
+        hint = 'discard ' + ' '.join(str(pos) for pos in positions)
+    else:
+        hint = 'keep all your cards'
+    print('Hint: the best expected hand comes from choosing to {}.'.format(hint))
 
 
 def get_cmd_args(argv):
@@ -472,9 +556,14 @@ def get_cmd_args(argv):
     Validates and returns command line arguments.
 
     For `start` returns ('start', (host, port), num_players, wallet_amt, ante, name)
-    For `join` returns ('join', (host, port), name)
+    For `join` returns ('join', (host, port), name, table_id), table_id being
+    None if not given
+    For `list` and `stats` returns (cmd, (host, port))
     '''
-    possible_cmds = set([START, JOIN])
+    possible_cmds = set([START, JOIN, LIST, STATS])
+    if len(argv) < 2:
+        help()
+        sys.exit(1)
     cmd = argv[1]
 
     # Ensure valid command
@@ -519,8 +608,21 @@ def get_cmd_args(argv):
 
     # Get `join` args
     if cmd == JOIN:
-        name = argv[4]
-        return (cmd, server_addr, name)
+        try:
+            name = argv[4]
+            table_id = int(argv[5]) if len(argv) > 5 else None
+            return (cmd, server_addr, name, table_id)
+        except IndexError:
+            print("required arguments missing")
+            help()
+            sys.exit(1)
+        except ValueError:
+            print("table_id must be an integer")
+            help()
+            sys.exit(1)
+
+    if cmd in (LIST, STATS):
+        return (cmd, server_addr)
 
     # Unexpected error if this is reached
     print("something unexpected happened, please try again")
@@ -535,7 +637,11 @@ def help():
     print('usage:')
     print('poker_client.py start <host> <port> <num_players> <wallet_amt> <ante> <player_name>')
     print('or')
-    print('poker_client.py join <host> <port> <palyer_name>')
+    print('poker_client.py join <host> <port> <palyer_name> [table_id]')
+    print('or')
+    print('poker_client.py list <host> <port>')
+    print('or')
+    print('poker_client.py stats <host> <port>')
 
 
 if __name__ == '__main__':
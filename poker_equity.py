@@ -0,0 +1,331 @@
+'''
+The `poker_equity` module estimates the equity of a five card draw hand: how
+often it wins, ties or loses against a number of opponents once the chosen
+cards are discarded and replaced. The estimate comes from simulating the rest
+of the hand many times. Batches of simulations run in a process pool, each
+batch with its own seeded random stream, and the run can stop early once the
+win probability is known to a target precision. Seeded estimates are run on
+the hand with its suits relabelled canonically and cached, so hands that
+differ only in suits are simulated once per seed and get the same estimate.
+
+Opponents draw with a simple fixed policy (see opponent_keep), so the numbers
+are the equity against typical play rather than against a perfect opponent.
+'''
+
+import concurrent.futures
+import math
+import os
+import random
+import sys
+
+import cards
+import hand_classes
+import hand_evaluator
+
+# Simulations per batch handed to a worker
+DEFAULT_BATCH_SIZE = 2000
+
+# Upper bound on simulations for one estimate
+DEFAULT_SAMPLES = 100000
+
+# z value for a 95% confidence interval
+Z_95 = 1.96
+
+# Simulations needed before an early stop is considered
+MIN_SAMPLES = 1000
+
+MAX_OPPONENTS = 4
+
+# Estimates by canonical hand, discard and settings
+EQUITY_CACHE = hand_classes.LRUCache(4096)
+
+
+class Equity:
+    '''
+    The counts from an equity estimate and the probabilities they give.
+    '''
+
+    def __init__(self, wins=0, ties=0, losses=0):
+        '''
+        Creates an Equity from outcome counts.
+
+        wins: int - simulations the hand won outright
+        ties: int - simulations the hand tied for the best hand
+        losses: int - simulations the hand lost
+        '''
+        self.wins = wins
+        self.ties = ties
+        self.losses = losses
+
+    @property
+    def samples(self):
+        return self.wins + self.ties + self.losses
+
+    @property
+    def win(self):
+        return self.wins / self.samples if self.samples else 0.0
+
+    @property
+    def tie(self):
+        return self.ties / self.samples if self.samples else 0.0
+
+    @property
+    def loss(self):
+        return self.losses / self.samples if self.samples else 0.0
+
+    def add(self, counts):
+        '''
+        Adds a (wins, ties, losses) tuple from a batch to the totals.
+
+        counts: (int, int, int) - the outcome counts of a batch
+        '''
+        self.wins += counts[0]
+        self.ties += counts[1]
+        self.losses += counts[2]
+
+    def copy(self):
+        '''
+        Returns a new Equity with the same counts.
+        '''
+        return Equity(self.wins, self.ties, self.losses)
+
+    def half_width(self, z=Z_95):
+        '''
+        Returns the half width of the normal approximation confidence
+        interval on the win probability.
+
+        z: float - the z value of the interval, 95% by default
+        '''
+        if not self.samples:
+            return 1.0
+        p = self.win
+        return z * math.sqrt(p * (1 - p) / self.samples)
+
+    def __repr__(self):
+        return 'Equity(win={:.4f}, tie={:.4f}, loss={:.4f}, samples={})'.format(
+            self.win, self.tie, self.loss, self.samples)
+
+
+def opponent_keep(codes):
+    '''
+    Returns the cards an opponent keeps from a dealt hand. Straights and
+    better are kept whole. Otherwise every card that pairs another is kept,
+    and with no pair the two highest cards are kept, so at most MAX_DISCARD
+    cards are thrown.
+
+    codes: [int] - the five card codes of the opponent's hand
+    '''
+    if hand_evaluator.category(hand_evaluator.evaluate(codes)) >= hand_evaluator.STRAIGHT:
+        return list(codes)
+
+    values = [cards.code_value(code) for code in codes]
+    kept = [code for code, value in zip(codes, values) if values.count(value) > 1]
+    if len(kept) < cards.NUM_CARDS_IN_HAND - cards.MAX_DISCARD:
+        kept = sorted(codes, reverse=True)[:cards.NUM_CARDS_IN_HAND - cards.MAX_DISCARD]
+    return kept
+
+
+def simulate(kept, dead, num_opponents, trials, seed):
+    '''
+    Simulates the draw and showdown `trials` times and returns the outcome
+    counts as a (wins, ties, losses) tuple. This is the unit of work run in
+    a worker process.
+
+    kept: [int] - the codes of the cards the hand keeps
+    dead: [int] - codes of every card out of the deck, the discards included
+    num_opponents: int - the number of opponents
+    trials: int - the number of simulations to run
+    seed: str - the seed of this batch's random stream
+    '''
+    rng = random.Random(seed)
+    evaluate = hand_evaluator.evaluate
+    stub = [code for code in range(cards.NUM_CARDS_IN_DECK) if code not in dead]
+
+    num_draw = cards.NUM_CARDS_IN_HAND - len(kept)
+    dealt = cards.NUM_CARDS_IN_HAND * num_opponents
+    needed = num_draw + dealt + cards.MAX_DISCARD * num_opponents
+
+    wins = ties = losses = 0
+    for _ in range(trials):
+        drawn = rng.sample(stub, needed)
+        hero = evaluate(kept + drawn[:num_draw])
+
+        best = -1
+        next_card = num_draw + dealt
+        for i in range(num_opponents):
+            start = num_draw + i * cards.NUM_CARDS_IN_HAND
+            opp = opponent_keep(drawn[start:start + cards.NUM_CARDS_IN_HAND])
+            refill = cards.NUM_CARDS_IN_HAND - len(opp)
+            opp_key = evaluate(opp + drawn[next_card:next_card + refill])
+            next_card += refill
+            if opp_key > best:
+                best = opp_key
+
+        if hero > best:
+            wins += 1
+        elif hero == best:
+            ties += 1
+        else:
+            losses += 1
+
+    return (wins, ties, losses)
+
+
+def estimate_equity(hand, discard, num_opponents, samples=DEFAULT_SAMPLES,
+                    target_ci=None, workers=None, seed=None,
+                    batch_size=DEFAULT_BATCH_SIZE, executor=None):
+    '''
+    Estimates the equity of a hand after a discard and returns an Equity.
+
+    hand: Hand or [int] - the five card hand, as a Hand or card codes
+    discard: [int] - 1-indexed positions of the cards to discard
+    num_opponents: int - the number of opponents, 1 to 4
+    samples: int - the most simulations to run
+    target_ci: float - optional, stop once the 95% confidence half width of
+                       the win probability is at most this
+    workers: int - worker processes to use; None for one per CPU and 0 to run
+                   in this process
+    seed: int - optional, seed for reproducible results
+    batch_size: int - simulations per batch
+    executor: Executor - optional, an existing pool to reuse across calls
+    '''
+    codes = list(hand.codes) if isinstance(hand, cards.Hand) else list(hand)
+    if len(codes) != cards.NUM_CARDS_IN_HAND:
+        raise ValueError('hand must have exactly 5 cards')
+    if len(set(discard)) > cards.MAX_DISCARD:
+        raise ValueError('cannot dicard more cards than allowed in a hand')
+    if not all(0 < pos <= cards.NUM_CARDS_IN_HAND for pos in discard):
+        raise ValueError('discard positions must be within 1 to 5')
+    if not 1 <= num_opponents <= MAX_OPPONENTS:
+        raise ValueError('num_opponents must be within 1 to 4')
+
+    # Without a seed every call is a fresh sample, and caching it would hand
+    # back the same estimate each time
+    if seed is None:
+        return _run_estimate(codes, discard, num_opponents, samples, target_ci,
+                             workers, seed, batch_size, executor)
+
+    # Relabelling the suits does not change a hand's equity, so a seeded
+    # estimate is run on the canonical hand, in the same card order, and
+    # shared through EQUITY_CACHE by every hand with the same canonical codes.
+    # Each caller gets its own copy of the cached Equity.
+    canonical = hand_classes.canonicalize(codes)
+    key = (tuple(canonical), frozenset(discard), num_opponents, samples, target_ci,
+           seed, batch_size)
+    equity = EQUITY_CACHE.get(key, lambda: _run_estimate(
+        canonical, discard, num_opponents, samples, target_ci, workers, seed,
+        batch_size, executor))
+    return equity.copy()
+
+
+def _run_estimate(codes, discard, num_opponents, samples, target_ci, workers,
+                  seed, batch_size, executor):
+    '''
+    Runs the simulations for estimate_equity, which validates the arguments
+    and checks EQUITY_CACHE first for seeded estimates. Takes the same
+    arguments, with the hand as card codes.
+    '''
+    kept = [code for i, code in enumerate(codes) if i + 1 not in discard]
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+
+    # Every batch has its own stream, so results do not depend on which
+    # worker ran which batch.
+    num_batches = max(1, math.ceil(samples / batch_size))
+    batches = []
+    for i in range(num_batches):
+        trials = min(batch_size, samples - i * batch_size)
+        batches.append((kept, codes, num_opponents, trials, '{}:{}'.format(seed, i)))
+
+    equity = Equity()
+    if workers == 0 and executor is None:
+        for batch in batches:
+            equity.add(simulate(*batch))
+            if _precise_enough(equity, target_ci):
+                break
+        return equity
+
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+
+    try:
+        # Keep a couple of batches queued per worker, no more, so an early
+        # stop does not leave much work to throw away.
+        in_flight = set()
+        pending = iter(batches)
+        max_in_flight = 2 * (workers or os.cpu_count() or 1)
+        while True:
+            for batch in pending:
+                in_flight.add(executor.submit(simulate, *batch))
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+
+            done, in_flight = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                equity.add(future.result())
+
+            if _precise_enough(equity, target_ci):
+                for future in in_flight:
+                    future.cancel()
+                break
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+    return equity
+
+
+def _precise_enough(equity, target_ci):
+    '''
+    Returns True if the estimate has reached the target confidence interval.
+
+    equity: Equity - the running estimate
+    target_ci: float - the target half width, or None to never stop early
+    '''
+    if target_ci is None or equity.samples < MIN_SAMPLES:
+        return False
+    return equity.half_width() <= target_ci
+
+
+def main(argv):
+    hand, discard, num_opponents = get_cmd_args(argv)
+    equity = estimate_equity(hand, discard, num_opponents, target_ci=0.005)
+    print(equity)
+
+
+def get_cmd_args(argv):
+    '''
+    Validates command line arguments and returns a tuple of
+    (hand_codes, discard_positions, num_opponents).
+    '''
+    if len(argv) < 7:
+        help()
+        sys.exit(1)
+
+    try:
+        hand = [cards.Card(rep[0], rep[1:]).code for rep in argv[1:6]]
+        num_opponents = int(argv[6])
+        discard = [int(pos) for pos in argv[7:]]
+    except ValueError:
+        print('invalid cards or numbers')
+        help()
+        sys.exit(1)
+
+    return (hand, discard, num_opponents)
+
+
+def help():
+    '''
+    Prints a usage help message.
+    '''
+    print('usage:')
+    print('poker_equity.py <card> <card> <card> <card> <card> <num_opponents> [discard_id ...]')
+    print('cards are written as in the server messages, such as HA or D10')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,49 +1,280 @@
 '''
 The `poker_server` module contains the business logic that allows the server
 to communicate with poker clients and allow gameplay.
+
+The server runs on asyncio. Each connection has its own reader and writer
+tasks (see framing.AsyncConnection) and the game runs as coroutines, so
+waiting on one player never stops messages to or from any other socket.
+One server hosts any number of tables at once, kept in a lobby.Lobby.
+Every message is counted and timed in NET_STATS, which a `stats` command
+returns as JSON.
+
+With `--workers N` the server runs as a supervisor of N forked worker
+processes, so games are spread over N cores. Every worker accepts on the
+public port (SO_REUSEPORT lets the kernel spread connections between them)
+and on a private port of its own. Each worker owns the tables it creates; a
+join for a table owned by another worker is answered with `redirect <port>`,
+the owner's private port. Workers send heartbeats to the supervisor, which
+restarts any worker that dies or stops sending them.
+
+With `--hand-log <path>` every change to every table's game is recorded in
+an append-only binary log (see hand_log), which can be replayed to rebuild
+any table's state. Each worker records in its own log, `<path>.<worker_id>`.
+
+With `--snapshot <path>` the state of every table is written to a snapshot
+file every second (see snapshot), and read back when the server starts, so
+tables and wallets outlive a crash. A restored table waits for its players
+to join it again by name and table id; the hand it was in is called off and
+the bets given back. Each worker keeps its own file, as with the hand log.
 '''
 
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import queue
 import sys
-import socket
 import time
 
-import game_state_manager as gsm
-
-BUFF_SIZE = 512
-
+import cards
+import codec
+import framing
+import hand_log
+import lobby
+import net_stats
+import snapshot
+import timer_wheel
+
+START = 'start'
+JOIN = 'join'
+LIST = 'list'
+STATS = 'stats'
+TABLES = 'tables'
+REDIRECT = 'redirect'
 BEGIN = 'begin'
 NOTIFY = 'notify'
 CARD_AMOUNT = 5
 DISCARD = 'discard'
+TIMEOUT = 'Timeout'
+
+# Seconds a player has to answer a prompt that needs them to choose
+TURN_TIMEOUT = 30.0
+
+# A player answers a prompt once, so at most this many late replies come
+# before the TIMEOUT they send back
+LATE_REPLIES = 1
+
+# Turn deadlines of every table
+TIMERS = timer_wheel.TimerWheel()
+
+# Message counters and latencies of every connection
+NET_STATS = net_stats.NetStats()
+
+# Seconds between heartbeats from a worker to the supervisor
+HEARTBEAT_INTERVAL = 1.0
+
+# Seconds without a heartbeat after which a worker is restarted
+HEARTBEAT_TIMEOUT = 5.0
 
 def main(argv):
     # Parse command line arguments
-    addr = get_cmd_args(argv)
+    addr, seed, num_workers, log_path, snapshot_path = get_cmd_args(argv)
+    if num_workers:
+        supervise(addr, seed, num_workers, log_path, snapshot_path)
+    else:
+        asyncio.run(serve(addr, seed, log_path=log_path, snapshot_path=snapshot_path))
 
-    # Setup server
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.bind(addr)
-    sock.listen()
 
-    print('Server started, waiting for first player.')
+async def serve(addr, seed=None, worker_id=0, num_workers=1, heartbeats=None, log_path=None,
+                snapshot_path=None):
+    '''
+    Runs the server, or one worker of it, until it is stopped. Every
+    connection is served by its own tasks and every table plays in its own
+    task, so a slow client only ever delays the game it is in.
+
+    addr: (host, port) - the address to listen on
+    seed: int - optional, seeds every table's deck so hands can be replayed
+    worker_id: int - the worker's id, when run by a supervisor
+    num_workers: int - the number of workers, when run by a supervisor
+    heartbeats: Queue - the supervisor's heartbeat queue, when run by one
+    log_path: str - optional, the hand log to record every game in
+    snapshot_path: str - optional, the snapshot file to restore the tables
+                         from and keep them in
+    '''
+    host, port = addr
+    log = None
+    if log_path is not None:
+        log = hand_log.HandLog(log_path)
+    tables = lobby.Lobby(seed, worker_id, num_workers, port, log)
+
+    store = None
+    if snapshot_path is not None:
+        store = snapshot.SnapshotStore(snapshot_path)
+        started = time.perf_counter()
+        snapshots = store.load()
+        tables.restore(snapshots)
+        if snapshots:
+            print('Restored {} tables in {:.1f}ms.'.format(
+                len(snapshots), (time.perf_counter() - started) * 1000))
+    handler = functools.partial(handle_connection, tables)
+
+    if heartbeats is None:
+        servers = [await asyncio.start_server(handler, host, port)]
+        print('Server started, waiting for players.')
+    else:
+        servers = [
+            await asyncio.start_server(handler, host, port, reuse_port=True),
+            await asyncio.start_server(handler, host, lobby.worker_port(port, worker_id)),
+        ]
+        print('Worker {} started, waiting for players.'.format(worker_id))
+
+    tasks = [
+        asyncio.ensure_future(TIMERS.run()),
+        asyncio.ensure_future(NET_STATS.sample_loop_lag()),
+    ]
+    if heartbeats is not None:
+        tasks.append(asyncio.ensure_future(send_heartbeats(heartbeats, tables)))
+    if log is not None:
+        tasks.append(asyncio.ensure_future(log.run()))
+    if store is not None:
+        tasks.append(asyncio.ensure_future(store.run(tables)))
+    try:
+        await asyncio.gather(*[server.serve_forever() for server in servers])
+    finally:
+        for task in tasks:
+            task.cancel()
+        if log is not None:
+            log.close()
+        if store is not None:
+            store.save(tables)
+
+
+async def send_heartbeats(heartbeats, tables):
+    '''
+    Tells the supervisor every HEARTBEAT_INTERVAL seconds that the worker is
+    alive, as a tuple of (worker_id, pid, number of tables).
 
-    # Wait for `start` from a player and set-up game
-    manager = wait_for_start(sock)
+    heartbeats: Queue - the supervisor's heartbeat queue
+    tables: Lobby - the worker's lobby
+    '''
+    pid = os.getpid()
+    while True:
+        heartbeats.put((tables.worker_id, pid, len(tables)))
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
 
-    print("First player found. Waiting for other players to join.")
 
-    # Wait for players to join and start game
-    wait_for_players(sock, manager)
+def run_worker(addr, seed, worker_id, num_workers, heartbeats, log_path=None,
+               snapshot_path=None):
+    '''
+    Entry point of a worker process.
+
+    addr: (host, port) - the public address of the server
+    seed: int - optional, seeds every table's deck
+    worker_id: int - the worker's id
+    num_workers: int - the number of workers
+    heartbeats: Queue - the supervisor's heartbeat queue
+    log_path: str - optional, the worker's hand log
+    snapshot_path: str - optional, the worker's snapshot file
+    '''
+    try:
+        asyncio.run(serve(
+            addr, seed, worker_id, num_workers, heartbeats, log_path, snapshot_path))
+    except KeyboardInterrupt:
+        pass
 
-    print("Players joined. Starting game.")
-    game_play(sock, manager)
 
+def supervise(addr, seed, num_workers, log_path=None, snapshot_path=None):
+    '''
+    Forks the worker processes and restarts any that die or stop sending
+    heartbeats. Runs until interrupted, then stops the workers.
+
+    addr: (host, port) - the public address of the server
+    seed: int - optional, seeds every table's deck
+    num_workers: int - the number of workers to run
+    log_path: str - optional, the hand log; each worker records in its own
+                    log next to it
+    snapshot_path: str - optional, the snapshot file; each worker keeps its
+                         own file next to it
+    '''
+    context = multiprocessing.get_context('fork')
+    heartbeats = context.Queue()
+    workers = dict()
+    last_seen = dict()
+
+    def start_worker(worker_id):
+        worker_log = None
+        if log_path is not None:
+            worker_log = hand_log.worker_path(log_path, worker_id)
+        worker_snapshot = None
+        if snapshot_path is not None:
+            worker_snapshot = hand_log.worker_path(snapshot_path, worker_id)
+        worker = context.Process(
+            target=run_worker,
+            args=(addr, seed, worker_id, num_workers, heartbeats, worker_log, worker_snapshot),
+            daemon=True)
+        worker.start()
+        workers[worker_id] = worker
+        last_seen[worker_id] = time.monotonic()
+
+    for worker_id in range(num_workers):
+        start_worker(worker_id)
+    print('Supervisor started {} workers.'.format(num_workers))
+
+    try:
+        while True:
+            try:
+                worker_id, pid, num_tables = heartbeats.get(timeout=HEARTBEAT_INTERVAL)
+                # Ignore heartbeats sent by a worker that has been replaced
+                if workers[worker_id].pid == pid:
+                    last_seen[worker_id] = time.monotonic()
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            for worker_id, worker in list(workers.items()):
+                if worker.is_alive() and now - last_seen[worker_id] <= HEARTBEAT_TIMEOUT:
+                    continue
+                print('Worker {} (pid {}) stopped responding, restarting it.'.format(
+                    worker_id, worker.pid))
+                worker.kill()
+                worker.join()
+                start_worker(worker_id)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers.values():
+            worker.terminate()
+        for worker in workers.values():
+            worker.join()
+
+
+async def run_table(tables, table):
+    '''
+    Plays a table's game once every seat is taken, then tears the table
+    down: it is removed from the lobby and its connections are closed. An
+    error in one game only ends that table.
 
-def game_play(sock, manager):
+    tables: Lobby - the lobby holding the table
+    table: Table - the table to play
+    '''
+    print("Table {} players joined. Starting game.".format(table.table_id))
+    try:
+        await game_play(table.manager)
+    except Exception as e:
+        print("Table {} stopped by error: {!r}".format(table.table_id, e))
+    finally:
+        tables.remove_table(table.table_id)
+        for conn in table.connections:
+            await conn.wait_closed()
+            NET_STATS.close(conn.stats)
+        print("Table {} closed.".format(table.table_id))
+
+
+async def game_play(manager):
     '''
     Primary gameplay functionality for the client.
 
-    sock: socket - server socket
     manager: GameStateManager - the game manager object
     '''
     # Get antes 
@@ -64,11 +295,17 @@ def game_play(sock, manager):
     # pass
     while manager.get_curr_num_players() > 1: 
         print("New game start")
-        handle_antes(sock, manager)
-        handle_deal(manager)
+        await handle_antes(manager)
+        await handle_deal(manager)
          
-         # Get first player
-        init_player = manager.turn_id
+         # Get first player, and pass the turn on for the next hand
+        first = manager.first_seat()
+        if first is None:
+            # Everyone sat out, so there is no hand to play
+            print("Nobody anted")
+            handle_reset(manager)
+            await handle_new_game(manager)
+            continue
         manager.increment_turn()
         '''
         while True :
@@ -83,222 +320,337 @@ def game_play(sock, manager):
         init_player += 1
         '''
 
-        msg = str(init_player)
+        msg = str(first.player_id)
         manager.notify_all(msg)
-        time.sleep(0.1)
 
-        p_sequence = [] # The betting sequence 
-        for player_id in manager.players :
-            if player_id >= init_player :
-                p_sequence.append(player_id)
-        for player_id in manager.players :
-            if player_id < init_player :
-                p_sequence.append(player_id)
-
-        print(p_sequence)
         print("Start first roung of betting")
         # Handle first round of betting 
-        p_sequence = handle_betting(manager, p_sequence)
-        print(p_sequence)
+        await handle_betting(manager, first)
 
         # Check if has winner 
         is_over, has_won = manager.is_betting_over()
         manager.notify_all("Over")
-        time.sleep(0.1)
 
         winner = []
 
         if has_won:
-            for p_id in manager.players:
-                if p_id not in manager.folded_ids:
-                    winner.append(p_id)
+            for seat in manager.seated():
+                if not seat.folded:
+                    winner.append(seat.player_id)
 
             manager.notify_all("Winner")
-            time.sleep(0.1)
 
             manager.notify_all("Player {} has won the game!".format(winner))
-            time.sleep(0.1)
 
         else:
             manager.notify_all("Betting")
-            time.sleep(0.1)
+
+            # The first player still in the hand goes first from now on
+            first = manager.seat_in_hand_from(first.player_id)
 
             print("Swap cards in hand")
-            handle_card_trade(manager, p_sequence)
+            await handle_card_trade(manager, first)
 
             # Send the first player for 2nd round of betting 
-            manager.notify_all(str(p_sequence[0]))
-            time.sleep(0.1)
+            manager.notify_all(str(first.player_id))
 
             # Handle second round of betting 
             print("Start second round of betting ")
-            handle_betting(manager, p_sequence)
+            await handle_betting(manager, first)
 
             # Check if has winner or evaluate the winner
             is_over, has_won = manager.is_betting_over()
             manager.notify_all("Over")
-            time.sleep(0.1)
         
             if has_won:
-                for p_id in manager.players:
-                    if p_id not in manager.folded_ids:
-                        winner.append(p_id)
+                for seat in manager.seated():
+                    if not seat.folded:
+                        winner.append(seat.player_id)
             else:
                 winner = handle_evaluate_winner(manager)
 
             # Notify all the winner information
             manager.notify_all("Player {} has won the game!".format(winner))
-            time.sleep(0.1)
-
-        # give bet to the winner
-        total_bets = manager.bets.get_pool_amt()
-        count = len(winner)
-        win_amt = int(total_bets / count)
-        win_remainder = int(total_bets % count)
-
-        for p_id in manager.players:
-            p_info = manager.players[p_id]
-            conn = p_info['conn']
-
-            if p_id in winner:
-                amt = win_amt + (1 if win_remainder > 0 else 0)
-                win_remainder -= 1; 
-                msg = "Win {}".format(amt)
+
+        # Pay out the main pot and any side pots
+        won = manager.settle()
+
+        for seat in manager.seated():
+            conn = seat.conn
+
+            if seat.player_id in won:
+                msg = "Win {}".format(won[seat.player_id])
                 print(msg)
-                conn.send(msg.encode())
-                time.sleep(0.1)
+                conn.send(msg)
             else:
                 msg = "Lose"
                 print(msg)
-                conn.send(msg.encode())
+                conn.send(msg)
 
         # Reset manager
-        manager.reset()
-
-        # Check if player want to play new game
-        print("Check if players want to start new game")
-        next_round_players = list(manager.players.keys())
-        for p_id in next_round_players:
-            p_info = manager.players[p_id]
-            conn = p_info['conn']
-            msg = "Do you want to start new game? Y/N:"
-            conn.send(msg.encode())
-            msg = conn.recv(BUFF_SIZE).decode()
-
-            if msg == 'N':
-                if p_id in p_sequence:
-                    p_sequence.remove(p_id)
-                handle_leave(manager, [], p_id)
-
-        # Notify players to start new game or wait for other players to join
-        for p_id in manager.players:
-            p_info = manager.players[p_id]
-            conn = p_info['conn']
-            if len(manager.players) == 1:
-                msg = 'Over'
-                conn.send(msg.encode())
-                print("Game is over.")
-            elif len(manager.players) > 1:
-                msg = 'Start'
-                conn.send(msg.encode())
-                print("New game to start {}".format(p_id))
-
-def wait_for_start(sock):
-    '''
-    Makes the server wait until it gets a successful start command from a 
-    client, then creates a GameStateManager and returns it.
-
-    sock: socket - server socket
+        handle_reset(manager)
+
+        await handle_new_game(manager)
+
+
+def handle_reset(manager):
     '''
-    while True:
-        # Get connection
-        start = 'start'
-        conn, addr = sock.accept()
-        msg = conn.recv(BUFF_SIZE).decode()
-        parts = msg.split()
-
-        # Ensure start message
-        if parts[0] != start:
-            err = 'err start waiting for start but received: ' + msg
-            conn.send(err.encode())
-            continue
+    Sets up the next hand, and tells the players who have no chips left that
+    the game is over for them.
+    '''
+    for seat in manager.reset():
+        print("Player {} is out of chips".format(seat.player_id))
+        if seat.conn is not None:
+            seat.conn.send('Over')
 
-        # Extract provided args
-        try:
-            # Extract
-            num_players, wallet_amt, ante_amt, name = parts[1:]
-            num_players = int(num_players)
-            wallet_amt = int(wallet_amt)
-            ante_amt = int(ante_amt)
-
-            # Validate
-            if (not (2 <= num_players <= 5)) or (wallet_amt < 5):
-                raise ValueError()
-        except:
-            err = 'err start invalid arguments'
-            conn.send(err.encode())
-            continue
 
-        # Create game manager and add the first player
-        manager = gsm.GameStateManager(num_players, wallet_amt, ante_amt)
-        p_id = manager.join(conn, addr, name)
+async def handle_new_game(manager):
+    '''
+    Asks every player whether they want to play another hand, lets those who
+    do not leave, and tells the rest whether the game goes on.
+    '''
+    # Check if player want to play new game
+    print("Check if players want to start new game")
+    for seat in manager.seated():
+        p_id = seat.player_id
+        conn = seat.conn
+        msg = "Do you want to start new game? Y/N:"
+        conn.send(msg, 'new_game_prompt')
+        msg = await recv_in_time(conn, conn.recv, 'N')
+
+        if msg == 'N':
+            handle_leave(manager, p_id)
+
+    # Notify players to start new game or wait for other players to join
+    for seat in manager.seated():
+        conn = seat.conn
+        if manager.get_curr_num_players() == 1:
+            msg = 'Over'
+            conn.send(msg)
+            print("Game is over.")
+        elif manager.get_curr_num_players() > 1:
+            msg = 'Start'
+            conn.send(msg)
+            print("New game to start {}".format(seat.player_id))
+
+async def handle_connection(tables, reader, writer):
+    '''
+    Serves a new connection until its player has a seat: answers list
+    commands and waits for a start or join. Once seated, the table's game
+    reads from the connection itself.
 
-        # Send ack to player
-        ack = 'ack join ' + str(p_id) + ' ' + str(wallet_amt)
-        manager.get_player_conn(p_id).send(ack.encode())
+    tables: Lobby - the lobby to find or create tables in
+    reader: StreamReader - the connection's read side
+    writer: StreamWriter - the connection's write side
+    '''
+    addr = writer.get_extra_info('peername')
+    stats = NET_STATS.open(str(addr), writer.get_extra_info('socket'))
+    conn = framing.AsyncConnection(reader, writer, stats)
+
+    table = None
+    try:
+        while table is None:
+            msg = await conn.recv()
+            parts, wire_codec = codec.split_option(msg.split())
+            cmd = parts[0] if parts else ''
+            if cmd == LIST:
+                handle_list(tables, conn)
+            elif cmd == STATS:
+                conn.send(json.dumps(NET_STATS.snapshot()))
+            elif cmd == START:
+                table = handle_start(tables, conn, addr, parts, wire_codec)
+            elif cmd == JOIN:
+                table = handle_join(tables, conn, addr, parts, wire_codec)
+            else:
+                conn.send('err unknown command: ' + msg)
+    except framing.ConnectionClosedError:
+        pass
+    except Exception as e:
+        print("Connection {} stopped by error: {!r}".format(addr, e))
+    if table is None:
+        # The player was never seated, so no table will close the connection
+        conn.close()
+        NET_STATS.close(stats)
+        return
+
+    table.connections.append(conn)
+    if table.full.is_set():
+        table.task = asyncio.ensure_future(run_table(tables, table))
+
+
+async def recv_in_time(conn, receive, default):
+    '''
+    Waits at most TURN_TIMEOUT seconds for a player to answer a prompt and
+    returns the answer. If the deadline passes, the player disconnects, or
+    the answer cannot be decoded, returns the default answer instead. A
+    player who timed out is sent TIMEOUT, and answers it with TIMEOUT once
+    its late reply, if any, has been sent, so everything up to that is
+    dropped. A client that never answers TIMEOUT loses no more than
+    LATE_REPLIES messages.
+
+    conn: AsyncConnection - the player's connection
+    receive: coroutine function - the conn method that receives the answer
+    default: object - the answer to use if the player does not answer in time
+    '''
+    timer = TIMERS.schedule(TURN_TIMEOUT, conn.expire)
+    try:
+        return await receive()
+    except framing.ReceiveTimeoutError:
+        print("Player timed out, answering {}".format(default))
+        conn.send(TIMEOUT)
+        conn.skip_until(TIMEOUT, LATE_REPLIES)
+        return default
+    except framing.ConnectionClosedError:
+        return default
+    except codec.CodecError as e:
+        print("Bad answer ({}), answering {}".format(e, default))
+        return default
+    finally:
+        timer.cancel()
+
+
+def send_ack(conn, ack, wire_codec):
+    '''
+    Sends the ack of a start or join. If the player asked for a codec, the
+    ack names the one picked and the connection switches to it.
 
-        return manager  # breaks loop
+    conn: AsyncConnection - the player's connection
+    ack: str - the ack
+    wire_codec: TextCodec or BinaryCodec - the codec picked, or None
+    '''
+    if wire_codec is None:
+        conn.send(ack)
+    else:
+        conn.send(ack + ' ' + wire_codec.name)
+        conn.codec = wire_codec
 
 
-def wait_for_players(sock, manager):
+def handle_list(tables, conn):
     '''
-    Makes server wait for players to join until the number of players is the 
-    same as that specified during the start.
+    Sends the tables of the lobby, each as described by Table.describe.
 
-    sock: socket - server socket
-    manager: GameStateManager - a game state manager
+    tables: Lobby - the lobby
+    conn: AsyncConnection - the connection that asked
     '''
-    max_players = manager.num_players
-    while manager.get_curr_num_players() < max_players:
-        # Get connection
-        join = 'join'
-        conn, addr = sock.accept()
-        msg = conn.recv(BUFF_SIZE).decode()
-        parts = msg.split()
+    msg = ' '.join([TABLES] + [table.describe() for table in tables.list_tables()])
+    conn.send(msg)
 
-        # Ensure join message
-        if parts[0] != join:
-            err = 'err join waiting for join but got ' + msg
-            conn.send(err.encode())
-            continue
 
+def handle_start(tables, conn, addr, parts, wire_codec=None):
+    '''
+    Handles a start command: creates a table with a new game and seats the
+    player. Returns the table, or None if the command was invalid.
+
+    tables: Lobby - the lobby to create the table in
+    conn: AsyncConnection - the player's connection
+    addr: (host, port) - the player's address
+    parts: [str] - the words of the message received
+    wire_codec: TextCodec or BinaryCodec - the codec asked for, or None
+    '''
+    # Extract provided args
+    try:
+        # Extract
+        num_players, wallet_amt, ante_amt, name = parts[1:]
+        num_players = int(num_players)
+        wallet_amt = int(wallet_amt)
+        ante_amt = int(ante_amt)
+
+        # Validate. Every chip at the table must fit in a message, as a
+        # player may win them all.
+        if (not (2 <= num_players <= 5)) or (wallet_amt < 5) or (ante_amt < 0):
+            raise ValueError()
+        if num_players * wallet_amt > codec.MAX_AMOUNT:
+            raise ValueError()
+    except:
+        err = 'err start invalid arguments'
+        conn.send(err)
+        return None
+
+    # Create the table and add the first player
+    table = tables.create_table(num_players, wallet_amt, ante_amt)
+    manager = table.manager
+    p_id = manager.join(conn, addr, name)
+    conn.stats.label = 'table {} player {} {}'.format(table.table_id, p_id, name)
+
+    # Send ack to player
+    ack = 'ack join {} {} {}'.format(p_id, wallet_amt, table.table_id)
+    send_ack(manager.get_player_conn(p_id), ack, wire_codec)
+
+    print("Table {} created. Waiting for other players to join.".format(table.table_id))
+    return table
+
+
+def handle_join(tables, conn, addr, parts, wire_codec=None):
+    '''
+    Handles a join command, `join <name> [table_id]`: seats the player at
+    the table, or at the longest waiting table if no id is given. Once the
+    number of players is the same as that specified during the start, the
+    game is told to begin. Returns the table, or None if the player could
+    not be seated.
+
+    tables: Lobby - the lobby to find the table in
+    conn: AsyncConnection - the player's connection
+    addr: (host, port) - the player's address
+    parts: [str] - the words of the message received
+    wire_codec: TextCodec or BinaryCodec - the codec asked for, or None
+    '''
+    if len(parts) not in (2, 3):
+        conn.send('err join invalid arguments')
+        return None
+
+    # Find the table, sending the player on if another worker owns it
+    name = parts[1]
+    try:
+        if len(parts) == 3:
+            table_id = int(parts[2])
+            if tables.owner(table_id) != tables.worker_id:
+                conn.send('{} {}'.format(REDIRECT, tables.owner_port(table_id)))
+                return None
+            table = tables.get_table(table_id)
+        else:
+            table = tables.open_table()
+            if table is None:
+                raise lobby.TableNotFoundError('no table waiting for players')
+    except ValueError:
+        conn.send('err join invalid table id')
+        return None
+    except lobby.TableNotFoundError as e:
+        conn.send('err join ' + str(e))
+        return None
+
+    # Players of a table restored from a snapshot take back their seats
+    manager = table.manager
+    p_id = None
+    if table.status() == lobby.WAITING:
+        p_id = manager.find_seat(name)
+    if p_id is not None:
+        manager.rejoin(p_id, conn, addr)
+    elif table.status() != lobby.WAITING or manager.next_id > manager.num_players:
+        conn.send('err join table {} is full'.format(table.table_id))
+        return None
+    else:
         # Add player
-        name = parts[1]
         p_id = manager.join(conn, addr, name)
+    conn.stats.label = 'table {} player {} {}'.format(table.table_id, p_id, name)
 
-        # Send ack to player
-        ack = 'ack join ' + str(p_id) + ' ' + str(manager.wallet_amt)
-        manager.get_player_conn(p_id).send(ack.encode())
-
-        # Sleeping here to ensure the ack message does not get concatenated
-        # with the notify message below. Since TCP is a stream, need to build
-        # in some seperation or else they will become a single message and
-        # cause errors.
-        time.sleep(0.1)
-
-        # Notify other players
-        num = manager.get_curr_num_players()
-        num_left = max_players - num
-        msg = NOTIFY + ' Player {} has joined the game. Waiting for {} more players.'.format(
-            name, num_left)
-        manager.notify_all(msg)
-        time.sleep(0.1)
+    # Send ack to player
+    ack = 'ack join {} {} {}'.format(p_id, manager.get_wallet(p_id), table.table_id)
+    send_ack(manager.get_player_conn(p_id), ack, wire_codec)
 
-    manager.notify_all(BEGIN)
-    time.sleep(0.1)
+    # Notify other players, counting free seats and seats not yet taken back
+    num_free = manager.num_players - manager.next_id + 1
+    num_left = num_free + manager.get_curr_num_players() - manager.get_num_connected()
+    msg = NOTIFY + ' Player {} has joined the game. Waiting for {} more players.'.format(
+        name, num_left)
+    manager.notify_all(msg)
+
+    if num_left == 0:
+        manager.notify_all(BEGIN)
+        table.full.set()
+    return table
 
 
-def handle_antes(sock, manager):
+async def handle_antes(manager):
     '''
     Call manager
     '''
@@ -307,162 +659,200 @@ def handle_antes(sock, manager):
     get_response = 0 # could be 1 
     msg = str(ante_amt) + " " + str(get_response)
     manager.notify_all(msg)
-    time.sleep(0.1)
     
     count = manager.num_players
     # for id in range(1, count + 1):
-    for p_id in list(manager.players.keys()):
-        print(p_id)
-        p_info = manager.players[p_id]
-        conn = p_info['conn']
-        msg = conn.recv(BUFF_SIZE).decode()
-        parts = msg.split()
-
-        if parts[0] == 'leave':
-            p_id = int(parts[1])
+    for seat in manager.seated():
+        print(seat.player_id)
+        conn = seat.conn
+        # A player who does not ante in time sits out the hand
+        default = (codec.FOLD, seat.player_id, 0)
+        # The player acts for their own seat, whatever ID they send
+        action, _, ante = await recv_in_time(conn, conn.recv_action, default)
+        p_id = seat.player_id
+
+        if action == codec.LEAVE:
             player = manager.leave(p_id)
-        elif parts[0] == 'ante':
-            p_id = int(parts[1])
-            ante = int(parts[2])
+        elif action == codec.ANTE:
             manager.ack_ante(p_id)
             print('Acknowledge player {} ante'.format(p_id))
+        elif action == codec.FOLD:
+            manager.bet_fold(p_id)
+            print('Player {} sits out the hand'.format(p_id))
 
 
-def handle_deal(manager):
+async def handle_deal(manager):
     '''
     Each player will get 5 cards. Since all cards are shuffled, the card will be distributed by current sequence
-    Note: no fold is considered as no player can call fold at this time
+    Note: no fold is considered as no player can call fold at this time.
+    Players who sat out the hand are still sent cards, so their client keeps
+    up with the game, but do not play with them.
     '''
     print("Start deal")
-    for p_id, value in manager.players.items() :
+    for seat in manager.seated() :
+        p_id = seat.player_id
         print(p_id)
         cards = manager.get_cards(CARD_AMOUNT)
         print(cards)
-        conn = value['conn']
-        msg = ""
+        conn = seat.conn
         for card in cards:
-            msg += card.__repr__() + " "
             print(card.__str__())
-        conn.send(msg.encode())
-        response = conn.recv(BUFF_SIZE).decode()
-        if response == 'Received' :
+        conn.send_cards([card.code for card in cards])
+        # A player who does not answer in time is taken to have the cards
+        response = await recv_in_time(conn, conn.recv, 'Received')
+        if response == 'Received' and not seat.folded:
             manager.store_hand(p_id, cards)
-            print("cards received to {}".format(value['name']))
+            print("cards received to {}".format(seat.name))
 
     print("Card sent complete")
     
 
-def handle_betting(manager, p_sequence):
+async def handle_betting(manager, first):
     '''
     may call check call raise
+
+    Goes round the ring of players still in the hand from the seat `first`
+    until betting is over. Players who fold or leave drop out of the ring.
     '''
-    bet_over = False
+    manager.new_round()
     first_player = True
-    while not bet_over:
-        p_remove = []
-        for player_id in p_sequence :
-            p_info = manager.players[player_id]
-            conn = p_info['conn']
-            #get bet info for this player
-            pool_amt, max_amt, curr_amt = manager.bet_info(player_id)
-            print(str(player_id) + " " + str(pool_amt) + " " + str(max_amt) + " " + str(curr_amt))
-            message = str(max_amt) + " " + str(curr_amt) + " " + str(first_player)
-            # print(message)
-            conn.send(message.encode())
-            first_player = False
-            
-            response = conn.recv(BUFF_SIZE).decode()
-            print(response)
-            parts = response.strip().split()
-           
-            if parts[0] == 'Check' :
-                handle_check(manager, player_id)
-            elif parts[0] == 'Call' :
-                handle_call(manager, player_id)
-            elif parts[0] == 'Raise' :
-                raise_amt = int(parts[2])
-                handle_raise(manager, player_id, raise_amt)
-            elif parts[0] == 'Fold' : # should remove the hands from the final hand
-                handle_fold(manager, player_id, p_remove)
-            elif  parts[0] == 'Leave' :
-                handle_leave(manager, p_remove, player_id)
-
-            bet_over, win = manager.is_betting_over()
-            print("Betting over is {}".format(bet_over))
-            if bet_over:
-                break;
-
-        for p_id in p_remove:
-            p_sequence.remove(p_id)
-
-    return p_sequence
+    seat = first
+    skipped = 0  # all in players passed since someone last bet
+    while True:
+        # Players who are all in stay in the hand but bet no more
+        if seat.all_in:
+            skipped += 1
+            # Nobody is left who can bet
+            if skipped >= manager.num_seated - manager.num_folded:
+                break
+            seat = seat.next
+            continue
+        skipped = 0
+        player_id = seat.player_id
+        # Taken now, as a player who folds or leaves is out of the ring
+        next_seat = seat.next
+        conn = seat.conn
+        #get bet info for this player
+        pool_amt, max_amt, curr_amt = manager.bet_info(player_id)
+        print(str(player_id) + " " + str(pool_amt) + " " + str(max_amt) + " " + str(curr_amt))
+        conn.send_bet_prompt(max_amt, curr_amt, first_player)
+
+        # Only the first player may check; anyone else who runs out of
+        # time folds
+        if first_player:
+            default = (codec.CHECK, player_id, 0)
+        else:
+            default = (codec.FOLD, player_id, 0)
+        first_player = False
+
+        action, _, amt = await recv_in_time(conn, conn.recv_action, default)
+        print(codec.ACTION_NAMES[action], player_id, amt)
+       
+        if action == codec.CHECK :
+            handle_check(manager, player_id)
+        elif action == codec.CALL :
+            handle_call(manager, player_id)
+        elif action == codec.RAISE :
+            handle_raise(manager, player_id, amt)
+        elif action == codec.FOLD : # should remove the hands from the final hand
+            handle_fold(manager, player_id)
+        elif action == codec.LEAVE :
+            handle_leave(manager, player_id)
+
+        bet_over, win = manager.is_betting_over()
+        print("Betting over is {}".format(bet_over))
+        if bet_over:
+            break;
+        seat = next_seat
 
 
 def handle_check(manager, player_id):
     manager.bet_check(player_id)
-    # conn.send("OK".encode())
+    # conn.send("OK")
 
 
 def handle_call(manager, player_id):
     manager.bet_call(player_id)
-    # conn.send("OK".encode())
+    # conn.send("OK")
 
 
 def handle_raise(manager, player_id, raise_amt):
     manager.bet_raise(player_id, raise_amt)
-    # conn.send("OK".encode())
+    # conn.send("OK")
 
-def handle_fold(manager, player_id, p_remove):
-    p_remove.append(player_id)
+def handle_fold(manager, player_id):
     manager.bet_fold(player_id)
-    # conn.send("OK".encode())
+    # conn.send("OK")
 
-def handle_leave(manager, p_remove, player_id):
-    p_remove.append(player_id)
+def handle_leave(manager, player_id):
     manager.leave(player_id)
-    # conn.send("OK".encode())
+    # conn.send("OK")
 
 def handle_betting_info():
     pass
 
 
-def handle_card_trade(manager, p_sequence):
+async def handle_card_trade(manager, first):
     '''
-    The players will take turns to discard cards and draw new cards.
+    The players will take turns to discard cards and draw new cards, once
+    round the ring of players still in the hand from the seat `first`.
     1. Send the player request to discard cards.
     2. Player send discard card successful info
     3. Manager gives new card to player
     '''
-    for p_id in p_sequence:
-        conn = manager.players[p_id]['conn']
+    seat = first
+    while True:
+        p_id = seat.player_id
+        conn = seat.conn
         message = DISCARD + " Please discard cards"
-        conn.send(message.encode())
-        resp = conn.recv(BUFF_SIZE).decode()
-        if resp == "N":
-            continue
-        #
-        print(resp)
-        discard_list = resp.strip().split()
-        card_list = []
-        for card in discard_list:
-            card_list.append(int(card))
-        manager.delete_cards(p_id, card_list)
-        conn.send("OK".encode())
-        resp = conn.recv(BUFF_SIZE).decode()
-        num_change = int(resp)
-        cards = manager.get_cards(num_change)
-        print(cards)
-        msg = ""
-        for card in cards:
-            msg += card.__repr__() + " "
-        print(msg)
-        conn.send(msg.encode())
-        response = conn.recv(BUFF_SIZE).decode()
-        if response == 'Received' :
-            manager.add_cards(p_id, cards)
-            print("cards received to {}".format(manager.players[p_id]['name']))
+        conn.send(message, 'discard_prompt')
+        card_list = await recv_in_time(conn, conn.recv_discard, [])
+        if card_list:
+            print(card_list)
+            conn.send("OK")
+            # A player who does not say how many cards to draw in time
+            # draws none and keeps the hand
+            resp = await recv_in_time(conn, conn.recv, '0')
+            num_change = int(resp) if resp.isdigit() else 0
+            if not valid_discard(seat.hand, card_list, num_change):
+                print("Bad discard {} of {} cards, keeping the hand".format(card_list, num_change))
+                card_list = []
+
+            # The player waits for the cards drawn, so is sent none if the
+            # hand is kept
+            drawn = []
+            if card_list:
+                manager.delete_cards(p_id, card_list)
+                drawn = manager.get_cards(len(card_list))
+                print(drawn)
+            conn.send_cards([card.code for card in drawn])
+            # A player who does not answer in time is taken to have the cards
+            response = await recv_in_time(conn, conn.recv, 'Received')
+            if drawn and response == 'Received' :
+                manager.add_cards(p_id, drawn)
+                print("cards received to {}".format(seat.name))
+        seat = seat.next
+        if seat is first:
+            break
     print("Card sent complete")
 
+def valid_discard(hand, positions, num_change):
+    '''
+    Returns True if a player can discard the cards at the given positions
+    and draw num_change new ones: the positions are distinct, in the hand,
+    no more than MAX_DISCARD of them, and num_change is how many there are.
+
+    hand: Hand - the player's hand, or None if they have none
+    positions: [int] - 1-indexed positions of the cards to discard
+    num_change: int - the number of cards the player asked to draw
+    '''
+    if hand is None or num_change != len(positions):
+        return False
+    if len(set(positions)) != len(positions) or len(positions) > cards.MAX_DISCARD:
+        return False
+    return all(0 < pos <= len(hand.codes) for pos in positions)
+
+
 def handle_evaluate_winner(manager):
     winner = manager.evaluate_hands() #  Return a list of player_id who wins
     return winner
@@ -471,17 +861,58 @@ def handle_evaluate_winner(manager):
 
 def get_cmd_args(argv):
     '''
-    Validates command line arguments and returns a tuple of (host, port) to
-    start the server on.
+    Validates command line arguments and returns a tuple of
+    ((host, port), seed, num_workers, log_path, snapshot_path) with the
+    address to start the server on, the optional deck seed, the number of
+    worker processes, 0 to run in this process, and the optional hand log
+    and snapshot file.
     '''
-    if len(argv) != 3:
+    argv = list(argv)
+    log_path = pop_file_option(argv, '--hand-log')
+    snapshot_path = pop_file_option(argv, '--snapshot')
+
+    num_workers = 0
+    if '--workers' in argv:
+        i = argv.index('--workers')
+        try:
+            num_workers = int(argv[i + 1])
+            if num_workers < 1:
+                raise ValueError()
+        except (IndexError, ValueError):
+            print('--workers needs a positive number of workers')
+            help()
+            sys.exit(1)
+        del argv[i:i + 2]
+
+    if len(argv) not in (3, 4):
         print('missing required arguments')
         help()
         sys.exit(1)
 
     host = argv[1]
     port = int(argv[2])
-    return (host, port)
+    seed = int(argv[3]) if len(argv) == 4 else None
+    return ((host, port), seed, num_workers, log_path, snapshot_path)
+
+
+def pop_file_option(argv, option):
+    '''
+    Removes an option that names a file, and the file, from the command line
+    arguments and returns the file, or None if the option is not given.
+
+    argv: [str] - the command line arguments
+    option: str - the option, e.g. '--hand-log'
+    '''
+    if option not in argv:
+        return None
+    i = argv.index(option)
+    if i + 1 >= len(argv):
+        print('{} needs a file'.format(option))
+        help()
+        sys.exit(1)
+    path = argv[i + 1]
+    del argv[i:i + 2]
+    return path
 
 
 def help():
@@ -489,7 +920,8 @@ def help():
     Prints a usage help message.
     '''
     print('usage:')
-    print('poker_server.py <host> <port>')
+    print('poker_server.py <host> <port> [seed] [--workers <num_workers>] [--hand-log <log_file>]')
+    print('                [--snapshot <snapshot_file>]')
 
 
 if __name__ == '__main__':
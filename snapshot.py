@@ -0,0 +1,176 @@
+'''
+The `snapshot` module keeps the tables of a server on disk, so a server
+that dies can carry on where it was when it starts again.
+
+A SnapshotStore writes every table's GameStateManager.snapshot to one file,
+every SNAPSHOT_INTERVAL seconds. Only the tables that changed since the last
+time are snapshot again; the others are written from the bytes kept from
+then. The file is built in memory in the event loop, where no game can
+change while it is done, and written in another thread to a temporary file
+that then replaces the old one, so the file on disk is always whole.
+
+Loading the file only splits it into the snapshots of each table. A game
+is restored from its snapshot when its table is first used (see
+lobby.Table), so a server starts in milliseconds with thousands of tables.
+
+The file is a header, packed as `!4sBI` (MAGIC, FORMAT, number of tables),
+then for each table its id and the length of its snapshot, packed as `!IH`,
+followed by the snapshot.
+'''
+
+import asyncio
+import os
+import struct
+import threading
+
+MAGIC = b'PKSN'
+FORMAT = 6
+
+_HEADER = struct.Struct('!4sBI')  # magic, format, number of tables
+_TABLE = struct.Struct('!IH')  # table id, length of the snapshot
+
+# Seconds between snapshots
+SNAPSHOT_INTERVAL = 1.0
+
+
+class SnapshotStore:
+    '''
+    The snapshot file of a server, and the snapshots last written to it.
+    '''
+
+    def __init__(self, path):
+        '''
+        Creates a store. Nothing is read or written until asked.
+
+        path: str - the snapshot file
+        '''
+        self.path = path
+        # table id -> (version of the game, its snapshot)
+        self.snapshots = dict()
+        # Held while the file is written, as run and save may both write
+        self.lock = threading.Lock()
+
+    def load(self):
+        '''
+        Reads the snapshot file and returns a dict of table id -> the
+        snapshot of the table's game, for gsm.restore. Returns an empty dict
+        if there is no file. Raises a SnapshotError if the file is not a
+        snapshot file or is cut short.
+        '''
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return dict()
+
+        try:
+            magic, version, num_tables = _HEADER.unpack_from(data)
+            if magic != MAGIC or version != FORMAT:
+                raise SnapshotError('{} is not a snapshot file'.format(self.path))
+
+            snapshots = dict()
+            offset = _HEADER.size
+            for _ in range(num_tables):
+                table_id, size = _TABLE.unpack_from(data, offset)
+                offset += _TABLE.size
+                snapshots[table_id] = data[offset:offset + size]
+                offset += size
+        except struct.error as e:
+            raise SnapshotError('{} is cut short'.format(self.path)) from e
+        if offset > len(data):
+            raise SnapshotError('{} is cut short'.format(self.path))
+
+        # Kept until the tables' games are restored, with no version
+        self.snapshots = {table_id: (None, data) for table_id, data in snapshots.items()}
+        return snapshots
+
+    def capture(self, tables):
+        '''
+        Returns the contents of the snapshot file for the tables as bytes,
+        or None if no table changed since the last capture. Only the tables
+        that changed are snapshot again.
+
+        tables: Lobby - the server's tables
+        '''
+        changed = False
+        snapshots = dict()
+        for table in tables.list_tables():
+            kept = self.snapshots.get(table.table_id)
+            if table.snapshot is not None:
+                # Not restored yet, so not changed
+                kept = (None, table.snapshot)
+            elif kept is None or kept[0] != table.manager.version:
+                manager = table.manager
+                try:
+                    kept = (manager.version, manager.snapshot())
+                    changed = True
+                except (struct.error, ValueError) as e:
+                    # One table that cannot be packed must not stop the
+                    # others being kept; its last snapshot, if any, stays
+                    print('Table {} not snapshotted: {!r}'.format(table.table_id, e))
+                    if kept is None:
+                        continue
+            snapshots[table.table_id] = kept
+        if not changed and len(snapshots) == len(self.snapshots):
+            return None
+        self.snapshots = snapshots
+
+        parts = [_HEADER.pack(MAGIC, FORMAT, len(snapshots))]
+        for table_id, (_, data) in snapshots.items():
+            parts.append(_TABLE.pack(table_id, len(data)))
+            parts.append(data)
+        return b''.join(parts)
+
+    def write(self, data):
+        '''
+        Replaces the snapshot file with the given contents, waiting for them
+        to reach the disk.
+
+        data: bytes - the contents, as returned by capture
+        '''
+        tmp_path = self.path + '.tmp'
+        with self.lock:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def save(self, tables):
+        '''
+        Writes a snapshot of the tables now, if any changed.
+
+        tables: Lobby - the server's tables
+        '''
+        data = self.capture(tables)
+        if data is not None:
+            self.write(data)
+
+    async def run(self, tables):
+        '''
+        Writes a snapshot of the tables every SNAPSHOT_INTERVAL seconds, if
+        any changed, until the task is cancelled. Files are written in
+        another thread.
+
+        tables: Lobby - the server's tables
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            data = self.capture(tables)
+            if data is None:
+                continue
+            try:
+                await loop.run_in_executor(None, self.write, data)
+            except OSError as e:
+                # Tried again at the next interval, as capture still sees
+                # the tables as changed
+                self.snapshots = dict()
+                print('Snapshot not written: {!r}'.format(e))
+
+
+class SnapshotError(Exception):
+    '''
+    Raised when a snapshot file cannot be read.
+    '''
+    pass
@@ -0,0 +1,217 @@
+'''
+Tests for the `codec` module.
+
+Run with `python -m pytest` or `python -m unittest` from the repository root.
+'''
+
+import unittest
+
+import cards
+import codec
+import poker_server
+
+CODECS = (codec.TEXT_CODEC, codec.BINARY_CODEC)
+
+# Largest player id, an unsigned 16 bit int in the binary codec
+MAX_PLAYER_ID = 2 ** 16 - 1
+
+
+class RoundTripTest(unittest.TestCase):
+    '''
+    Every message encoded by a codec decodes back to what was encoded.
+    '''
+
+    def test_text(self):
+        for wire_codec in CODECS:
+            for message in ('', 'Over', 'Player [1, 2] has won the game!', 'ack join 1 100 3'):
+                data = wire_codec.encode_text(message)
+                self.assertEqual(wire_codec.decode_text(data), message)
+
+    def test_cards(self):
+        for wire_codec in CODECS:
+            for codes in ([], [0], [51], [0, 13, 26, 39, 51], list(range(5, 10))):
+                data = wire_codec.encode_cards(codes)
+                self.assertEqual(wire_codec.decode_cards(data), codes)
+
+    def test_every_card(self):
+        for wire_codec in CODECS:
+            codes = [card.code for card in cards.CARDS if card is not None]
+            for i in range(0, len(codes), 5):
+                data = wire_codec.encode_cards(codes[i:i + 5])
+                self.assertEqual(wire_codec.decode_cards(data), codes[i:i + 5])
+
+    def test_bet_prompt(self):
+        top = codec.MAX_AMOUNT
+        for wire_codec in CODECS:
+            for max_bet, curr_bet in ((0, 0), (5, 0), (10, 5), (top, 0), (top, top)):
+                for first in (True, False):
+                    data = wire_codec.encode_bet_prompt(max_bet, curr_bet, first)
+                    self.assertEqual(wire_codec.decode_bet_prompt(data), (max_bet, curr_bet, first))
+
+    def test_betting_over(self):
+        # The end of betting is sent as text, whichever codec is used
+        for wire_codec in CODECS:
+            data = wire_codec.encode_text(codec.BETTING_OVER)
+            self.assertIsNone(wire_codec.decode_bet_prompt(data))
+
+    def test_action(self):
+        top = codec.MAX_AMOUNT
+        for wire_codec in CODECS:
+            for action in (codec.CHECK, codec.CALL, codec.RAISE, codec.ANTE):
+                for player_id in (1, 5, MAX_PLAYER_ID):
+                    for amt in (0, 1, top):
+                        data = wire_codec.encode_action(action, player_id, amt)
+                        self.assertEqual(wire_codec.decode_action(data), (action, player_id, amt))
+
+    def test_fold_and_leave(self):
+        # Folding and leaving carry no amount
+        for wire_codec in CODECS:
+            for action in (codec.FOLD, codec.LEAVE):
+                data = wire_codec.encode_action(action, 3)
+                self.assertEqual(wire_codec.decode_action(data), (action, 3, 0))
+
+    def test_text_action_names(self):
+        self.assertEqual(codec.TEXT_CODEC.decode_action(b'raise 2 10'), (codec.RAISE, 2, 10))
+        self.assertEqual(codec.TEXT_CODEC.decode_action(b'Fold 4'), (codec.FOLD, 4, 0))
+
+    def test_discard(self):
+        for wire_codec in CODECS:
+            for positions in ([], [1], [5], [1, 3], [2, 4, 5], [1, 2, 3, 4, 5]):
+                data = wire_codec.encode_discard(positions)
+                self.assertEqual(wire_codec.decode_discard(data), positions)
+
+
+class RejectTest(unittest.TestCase):
+    '''
+    Messages that must not be encoded or decoded.
+    '''
+
+    def test_negative_amounts(self):
+        for wire_codec in CODECS:
+            with self.assertRaises(codec.CodecError):
+                wire_codec.encode_action(codec.RAISE, 1, -1)
+            with self.assertRaises(codec.CodecError):
+                wire_codec.encode_action(codec.CALL, 1, -(2 ** 31))
+            with self.assertRaises(codec.CodecError):
+                wire_codec.encode_bet_prompt(-1, 0, False)
+            with self.assertRaises(codec.CodecError):
+                wire_codec.encode_bet_prompt(10, -5, True)
+
+    def test_negative_amounts_decoded(self):
+        with self.assertRaises(codec.CodecError):
+            codec.TEXT_CODEC.decode_action(b'Raise 1 -5')
+        with self.assertRaises(codec.CodecError):
+            codec.TEXT_CODEC.decode_bet_prompt(b'-1 0 True')
+
+    def test_amount_too_big(self):
+        # Does not fit the binary codec's unsigned 32 bit field, so neither
+        # codec carries it
+        too_big = codec.MAX_AMOUNT + 1
+        for wire_codec in CODECS:
+            with self.assertRaises(codec.CodecError):
+                wire_codec.encode_action(codec.RAISE, 1, too_big)
+            with self.assertRaises(codec.CodecError):
+                wire_codec.encode_bet_prompt(too_big, 0, False)
+        with self.assertRaises(codec.CodecError):
+            codec.TEXT_CODEC.decode_action('Raise 1 {}'.format(too_big).encode())
+        with self.assertRaises(codec.CodecError):
+            codec.TEXT_CODEC.decode_bet_prompt('{} 0 True'.format(too_big).encode())
+
+    def test_bad_card_codes(self):
+        for wire_codec in CODECS:
+            for codes in ([52], [0, 255], [-1]):
+                with self.assertRaises(codec.CodecError):
+                    wire_codec.encode_cards(codes)
+        # A byte that is not a card
+        for code in (52, 255):
+            with self.assertRaises(codec.CodecError):
+                codec.BINARY_CODEC.decode_cards(bytes((codec.CARDS, 0, code)))
+
+    def test_bad_text(self):
+        for data in (b'', b'Bet 1 5', b'Raise x 5', b'Raise 1 five'):
+            with self.assertRaises(codec.CodecError):
+                codec.TEXT_CODEC.decode_action(data)
+        with self.assertRaises(codec.CodecError):
+            codec.TEXT_CODEC.decode_bet_prompt(b'10 True')
+        with self.assertRaises(codec.CodecError):
+            codec.TEXT_CODEC.decode_cards(b'X9')
+        with self.assertRaises(codec.CodecError):
+            codec.TEXT_CODEC.decode_discard(b'1 two')
+
+    def test_bad_binary(self):
+        binary = codec.BINARY_CODEC
+        action = binary.encode_action(codec.RAISE, 1, 5)
+        # Wrong type, cut short, too long, unknown action
+        for data in (b'', binary.encode_text('Raise 1 5'), action[:-1], action + b'\0',
+                     bytes((codec.ACTION, len(codec.ACTION_NAMES))) + action[2:]):
+            with self.assertRaises(codec.CodecError):
+                binary.decode_action(data)
+        with self.assertRaises(codec.CodecError):
+            binary.decode_cards(binary.encode_text('HA'))
+        with self.assertRaises(codec.CodecError):
+            binary.decode_bet_prompt(binary.encode_bet_prompt(1, 0, True)[:-1])
+
+
+class FakeConnection:
+    '''
+    Stands in for a connection, keeping what is sent.
+    '''
+
+    def __init__(self):
+        self.codec = codec.TEXT_CODEC
+        self.sent = []
+
+    def send(self, message, kind='text'):
+        # Encoded when sent, as a real connection does
+        self.sent.append(self.codec.encode_text(message))
+
+
+class NegotiationTest(unittest.TestCase):
+    '''
+    The `codec=` option of start and join, and the server's ack.
+    '''
+
+    def test_option(self):
+        self.assertEqual(codec.option(codec.BINARY_CODEC), 'codec=binary/1')
+        self.assertEqual(codec.option(codec.TEXT_CODEC), 'codec=text')
+
+    def test_split_option(self):
+        parts = ['join', 'bob', '3', codec.option(codec.BINARY_CODEC)]
+        self.assertEqual(codec.split_option(parts), (['join', 'bob', '3'], codec.BINARY_CODEC))
+
+        # The option may be anywhere
+        parts = ['start', codec.option(codec.TEXT_CODEC), '2', '100', '5', 'alice']
+        self.assertEqual(codec.split_option(parts),
+                         (['start', '2', '100', '5', 'alice'], codec.TEXT_CODEC))
+
+    def test_no_option(self):
+        # A client that does not ask is answered in text, with no codec named
+        self.assertEqual(codec.split_option(['join', 'bob']), (['join', 'bob'], None))
+
+    def test_unknown_codec(self):
+        parts = ['join', 'bob', 'codec=binary/9']
+        self.assertEqual(codec.split_option(parts), (['join', 'bob'], codec.TEXT_CODEC))
+
+    def test_ack_names_codec(self):
+        conn = FakeConnection()
+        poker_server.send_ack(conn, 'ack join 2 100 1', codec.BINARY_CODEC)
+        # The ack itself is still text, and names the codec used from then on
+        self.assertEqual(conn.sent, [b'ack join 2 100 1 binary/1'])
+        self.assertIs(conn.codec, codec.BINARY_CODEC)
+
+        # The client picks the codec from the last field of the ack
+        ack = codec.TEXT_CODEC.decode_text(conn.sent[0]).split()
+        self.assertIs(codec.CODECS.get(ack[5], codec.TEXT_CODEC), codec.BINARY_CODEC)
+
+        conn.send('Start')
+        self.assertEqual(conn.sent[-1], codec.BINARY_CODEC.encode_text('Start'))
+
+    def test_ack_without_codec(self):
+        conn = FakeConnection()
+        poker_server.send_ack(conn, 'ack join 2 100 1', None)
+        self.assertEqual(conn.sent, [b'ack join 2 100 1'])
+        self.assertIs(conn.codec, codec.TEXT_CODEC)
+
+
+if __name__ == '__main__':
+    unittest.main()
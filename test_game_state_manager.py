@@ -0,0 +1,492 @@
+'''
+Tests for the `game_state_manager` module.
+
+Run with `python -m pytest` or `python -m unittest` from the repository root.
+'''
+
+import collections
+import random
+import unittest
+
+import cards
+import game_state_manager as gsm
+
+
+def make_cards(text):
+    '''
+    Returns the Cards written as in the text protocol, such as 'HA D10 S2'.
+
+    text: str - the cards, separated by spaces
+    '''
+    return [cards.Card(rep[0], rep[1:]) for rep in text.split()]
+
+
+def make_game(wallets, ante_amt=5):
+    '''
+    Returns a GameStateManager with a player seated for every wallet, the
+    players' wallets set to the given amounts.
+
+    wallets: [int] - the wallet of each player, by player ID
+    ante_amt: int - the ante of every hand
+    '''
+    manager = gsm.GameStateManager(len(wallets), max(wallets), ante_amt)
+    for i, wallet in enumerate(wallets):
+        manager.join(None, None, 'p{}'.format(i + 1))
+        manager.seats[i].wallet = wallet
+    return manager
+
+
+def total_chips(manager):
+    '''
+    Returns every chip at the table: the wallets of all seats, left or not,
+    and the bets in the pool.
+    '''
+    return (sum(seat.wallet for seat in manager.seats if seat is not None)
+            + manager.bets.get_pool_amt())
+
+
+def scan_betting_over(manager):
+    '''
+    Returns (betting_over, hand_won) by looking at every seat, as
+    is_betting_over did before BetInfo kept running totals: betting is over
+    once everyone still in the hand has bet this round, and all have bet the
+    same amount.
+    '''
+    in_hand = [seat for seat in manager.seated() if not seat.folded]
+    if len(in_hand) == 1:
+        return (True, True)
+    acted = all(seat.acted for seat in in_hand)
+    return (acted and len({seat.bet for seat in in_hand}) == 1, False)
+
+
+def scan_all_matched(manager):
+    '''
+    Returns True if every player still in the hand who is not all in has bet
+    the same amount, and at least as much as every player who is all in, by
+    looking at every seat.
+    '''
+    in_hand = [seat for seat in manager.seated() if not seat.folded]
+    live = {seat.bet for seat in in_hand if not seat.all_in}
+    all_in = [seat.bet for seat in in_hand if seat.all_in]
+    if len(live) > 1:
+        return False
+    return all(amt >= max(all_in, default=0) for amt in live)
+
+
+def play_random(manager, rng, steps):
+    '''
+    Makes random antes, bets, folds and leaves, yielding after each one.
+    Players who are all in are not made to act, as the server skips them,
+    and at least two players are always kept in the hand.
+
+    manager: GameStateManager - the game
+    rng: Random - the random choices
+    steps: int - the number of actions
+    '''
+    for _ in range(steps):
+        in_hand = [seat for seat in manager.seated() if not seat.folded]
+        can_act = [seat.player_id for seat in in_hand if not seat.all_in]
+        choice = rng.random()
+        if choice < 0.05:
+            manager.new_round()
+        elif choice < 0.08:
+            for seat in manager.seats:
+                if seat is not None and not seat.left:
+                    seat.wallet += 50
+            manager.reset()
+        elif not can_act:
+            continue
+        else:
+            p_id = rng.choice(can_act)
+            if choice < 0.15:
+                manager.ack_ante(p_id)
+            elif choice < 0.3:
+                manager.bet_check(p_id)
+            elif choice < 0.6:
+                manager.bet_call(p_id)
+            elif choice < 0.85:
+                manager.bet_raise(p_id, rng.randint(0, 30))
+            elif len(in_hand) > 2:
+                if choice < 0.95:
+                    manager.bet_fold(p_id)
+                else:
+                    manager.leave(p_id)
+        yield
+
+
+class BetInfoTest(unittest.TestCase):
+    '''
+    The running totals of BetInfo against a look at every seat.
+    '''
+
+    def check_totals(self, manager):
+        bets = manager.bets
+        seats = [seat for seat in manager.seats if seat is not None]
+        self.assertEqual(bets.get_pool_amt(), sum(seat.bet for seat in seats))
+        self.assertEqual(bets.get_round_pool_amt(), sum(seat.round_bet for seat in seats))
+        max_bet = max((seat.bet for seat in seats if seat.has_bet), default=0)
+        max_ids = [seat.player_id for seat in seats if seat.has_bet and seat.bet == max_bet]
+        self.assertEqual(bets.get_max_bet(), (max_bet, max_ids if max_bet or max_ids else []))
+
+        # The counts kept for all_matched, against a look at every seat
+        in_hand = [seat for seat in seats if seat.in_hand()]
+        live_amts = collections.Counter(
+            seat.bet for seat in in_hand if seat.has_bet and not seat.all_in)
+        all_in_max = max((seat.bet for seat in seats if seat.all_in and seat.has_bet), default=0)
+        self.assertEqual(bets.live_amts, dict(live_amts))
+        self.assertEqual(bets.num_all_in, sum(1 for seat in in_hand if seat.all_in))
+        self.assertEqual(bets.all_in_max, all_in_max)
+        self.assertEqual(bets.num_acted,
+                         sum(1 for seat in in_hand if seat.acted and not seat.all_in))
+
+    def test_matches_scan_without_all_in(self):
+        # Nobody runs out of chips, so the old scan and the totals must agree
+        rng = random.Random(20)
+        for _ in range(200):
+            manager = make_game([10000] * rng.randint(2, 5))
+            for _ in play_random(manager, rng, 60):
+                self.assertEqual(manager.bets.num_all_in, 0)
+                self.assertEqual(manager.is_betting_over(), scan_betting_over(manager))
+                self.check_totals(manager)
+
+    def test_matches_scan_with_all_in(self):
+        rng = random.Random(21)
+        for _ in range(300):
+            wallets = [rng.choice([5, 12, 30, 60, 200]) for _ in range(rng.randint(2, 5))]
+            manager = make_game(wallets)
+            for _ in play_random(manager, rng, 60):
+                num_in = manager.num_seated - manager.num_folded
+                num_to_act = num_in - manager.bets.num_all_in
+                self.assertEqual(manager.bets.all_matched(num_to_act), scan_all_matched(manager))
+                self.assertEqual(manager.bets.num_all_in,
+                                 sum(1 for seat in manager.seated() if seat.all_in and not seat.folded))
+                self.check_totals(manager)
+
+
+class CheckTest(unittest.TestCase):
+    '''
+    A check bets nothing, and ends no round by itself.
+    '''
+
+    def test_check_bets_nothing(self):
+        manager = make_game([100, 100, 100])
+        for p_id in (1, 2, 3):
+            manager.ack_ante(p_id)
+        manager.new_round()
+
+        manager.bet_check(1)
+        self.assertEqual(manager.seats[0].wallet, 95)
+        self.assertEqual(manager.bets.get_player_bet(1), 5)
+        self.assertEqual(manager.bets.get_round_pool_amt(), 0)
+        self.assertEqual(manager.bets.get_pool_amt(), 15)
+
+    def test_others_act_after_check(self):
+        # Every bet is matched after the antes, but the round is not over
+        # until each player has had a turn
+        manager = make_game([100, 100, 100])
+        for p_id in (1, 2, 3):
+            manager.ack_ante(p_id)
+        manager.new_round()
+        self.assertEqual(manager.is_betting_over(), (False, False))
+
+        manager.bet_check(1)
+        self.assertEqual(manager.is_betting_over(), (False, False))
+        manager.bet_call(2)
+        self.assertEqual(manager.is_betting_over(), (False, False))
+        manager.bet_call(3)
+        self.assertEqual(manager.is_betting_over(), (True, False))
+
+        # A raise after a check goes round to the player who checked
+        manager.new_round()
+        manager.bet_check(1)
+        manager.bet_raise(2, 10)
+        manager.bet_call(3)
+        self.assertEqual(manager.is_betting_over(), (False, False))
+        manager.bet_call(1)
+        self.assertEqual(manager.is_betting_over(), (True, False))
+        self.assertEqual(manager.bets.get_pool_amt(), 45)
+        self.assertEqual([seat.wallet for seat in manager.seated()], [85, 85, 85])
+
+    def test_fold_after_check(self):
+        manager = make_game([100, 100, 100])
+        for p_id in (1, 2, 3):
+            manager.ack_ante(p_id)
+        manager.new_round()
+        manager.bet_check(1)
+        manager.bet_fold(2)
+        self.assertEqual(manager.is_betting_over(), (False, False))
+        manager.bet_call(3)
+        self.assertEqual(manager.is_betting_over(), (True, False))
+
+
+def ring_ids(seat):
+    '''
+    Returns the player IDs in the ring of players still in the hand, going
+    round once from the given seat. Checks that the links both ways agree.
+
+    seat: Seat - a seat in the ring
+    '''
+    ids = []
+    start = seat
+    while True:
+        assert seat.next.prev is seat
+        ids.append(seat.player_id)
+        seat = seat.next
+        if seat is start:
+            return ids
+
+
+def rotate(manager, num_hands):
+    '''
+    Returns the ID of the first player of each of the next hands, passing
+    the turn on after each.
+    '''
+    firsts = []
+    for _ in range(num_hands):
+        firsts.append(manager.first_seat().player_id)
+        manager.increment_turn()
+    return firsts
+
+
+class TurnOrderTest(unittest.TestCase):
+    '''
+    The ring of seats still in the hand, and the turn passed round it.
+    '''
+
+    def test_ring_in_join_order(self):
+        manager = make_game([100] * 4)
+        self.assertEqual(ring_ids(manager.seats[0]), [1, 2, 3, 4])
+        self.assertEqual(ring_ids(manager.seats[2]), [3, 4, 1, 2])
+
+    def test_fold(self):
+        manager = make_game([100] * 4)
+        manager.bet_fold(2)
+        self.assertIsNone(manager.seats[1].next)
+        self.assertEqual(ring_ids(manager.seats[0]), [1, 3, 4])
+        self.assertIs(manager.seats[0].next, manager.seats[2])
+        self.assertIs(manager.seat_in_hand_from(2), manager.seats[2])
+
+    def test_leave(self):
+        manager = make_game([100] * 4)
+        manager.leave(4)
+        self.assertEqual(ring_ids(manager.seats[0]), [1, 2, 3])
+        # The seat after the last one is the first again
+        self.assertIs(manager.seat_in_hand_from(4), manager.seats[0])
+
+    def test_all_in_stays_in_ring(self):
+        manager = make_game([100, 10, 100])
+        manager.bet_raise(2, 20)
+        self.assertTrue(manager.is_all_in(2))
+        self.assertEqual(ring_ids(manager.seats[0]), [1, 2, 3])
+
+        # The turn still passes to a player who is all in
+        manager.turn_id = 1
+        manager.increment_turn()
+        self.assertEqual(manager.turn_id, 2)
+
+    def test_rotation_wraps_to_first_seat(self):
+        manager = make_game([100] * 3)
+        self.assertEqual(rotate(manager, 7), [1, 2, 3, 1, 2, 3, 1])
+
+        # Two players take turns rather than the turn landing on ID 0
+        manager = make_game([100] * 2)
+        self.assertEqual(rotate(manager, 4), [1, 2, 1, 2])
+
+    def test_rotation_skips_players_out(self):
+        manager = make_game([100] * 5)
+        manager.bet_fold(2)
+        manager.leave(5)
+        self.assertEqual(rotate(manager, 5), [1, 3, 4, 1, 3])
+
+    def test_turn_of_player_who_left(self):
+        manager = make_game([100] * 4)
+        manager.turn_id = 3
+        manager.leave(3)
+        # The first player is the next one still in the hand, and the turn
+        # then moves on from them
+        self.assertIs(manager.first_seat(), manager.seats[3])
+        manager.increment_turn()
+        self.assertEqual(manager.turn_id, 4)
+        manager.increment_turn()
+        self.assertEqual(manager.turn_id, 1)
+
+    def test_reset_links_folded_players(self):
+        manager = make_game([100] * 4)
+        manager.bet_fold(1)
+        manager.bet_fold(3)
+        manager.leave(4)
+        self.assertEqual(ring_ids(manager.seats[1]), [2])
+        manager.reset()
+        self.assertEqual(ring_ids(manager.seats[0]), [1, 2, 3])
+        self.assertIsNone(manager.seats[3].next)
+
+    def test_reset_removes_busted_players(self):
+        # A player who went all in and lost has no chips left to ante with
+        manager = make_game([100, 10, 100, 100])
+        manager.bet_raise(2, 10)
+        manager.bet_fold(3)
+        self.assertEqual(manager.seats[1].wallet, 0)
+
+        self.assertEqual(manager.reset(), [manager.seats[1]])
+        self.assertTrue(manager.seats[1].left)
+        self.assertEqual(manager.get_curr_num_players(), 3)
+        self.assertEqual(ring_ids(manager.seats[0]), [1, 3, 4])
+        self.assertEqual(rotate(manager, 4), [1, 3, 4, 1])
+
+        # They stay out, also in a game restored from a snapshot
+        self.assertEqual(manager.reset(), [])
+        restored = gsm.restore(manager.snapshot())
+        self.assertTrue(restored.seats[1].left)
+        self.assertEqual(ring_ids(restored.seats[0]), [1, 3, 4])
+
+    def test_restore_rebuilds_ring(self):
+        manager = make_game([100] * 5)
+        manager.bet_fold(2)
+        manager.leave(4)
+        manager.turn_id = 5
+
+        # The hand is called off, so a player who folded in it is back in
+        restored = gsm.restore(manager.snapshot())
+        self.assertEqual(ring_ids(restored.seats[0]), [1, 2, 3, 5])
+        self.assertIsNone(restored.seats[3].next)
+        self.assertEqual(rotate(restored, 4), [5, 1, 2, 3])
+
+        restored.bet_fold(3)
+        self.assertEqual(ring_ids(restored.seats[0]), [1, 2, 5])
+
+
+class SettleTest(unittest.TestCase):
+    '''
+    GameStateManager.settle, which pays out the main pot and side pots.
+    '''
+
+    def test_side_pots(self):
+        # Player 1 has the best hand but is all in for 10, player 2 is all in
+        # for 30 with the second best, player 3 covers both
+        manager = make_game([10, 30, 100])
+        manager.store_hand(1, make_cards('HA DA SA C2 H3'))
+        manager.store_hand(2, make_cards('HK DK S9 C7 H4'))
+        manager.store_hand(3, make_cards('HQ DJ S8 C6 D2'))
+        total = total_chips(manager)
+
+        manager.new_round()
+        manager.bet_raise(1, 10)
+        manager.bet_raise(2, 20)
+        manager.bet_call(3)
+        self.assertTrue(manager.is_all_in(1))
+        self.assertTrue(manager.is_all_in(2))
+
+        won = manager.settle()
+        # The main pot is what all three paid, the side pot the rest of what
+        # players 2 and 3 paid
+        self.assertEqual(won, {1: 30, 2: 40})
+        manager.reset()
+        self.assertEqual([seat.wallet for seat in manager.seats], [30, 40, 70])
+        self.assertEqual(total_chips(manager), total)
+
+    def test_side_pot_to_covering_player(self):
+        # The short stack wins the main pot only; the side pot goes to the
+        # better hand of the two players who paid into it
+        manager = make_game([10, 100, 100])
+        manager.store_hand(1, make_cards('HA DA SA C2 H3'))
+        manager.store_hand(2, make_cards('HQ DJ S8 C6 D2'))
+        manager.store_hand(3, make_cards('HK DK S9 C7 H4'))
+
+        manager.new_round()
+        manager.bet_raise(1, 10)
+        manager.bet_raise(2, 40)
+        manager.bet_call(3)
+
+        self.assertEqual(manager.settle(), {1: 30, 3: 80})
+
+    def test_folded_chips_go_to_pot(self):
+        # Player 3 folds after betting 30: the chips feed both the main pot
+        # and the side pot, and player 3 wins nothing
+        manager = make_game([10, 100, 100])
+        manager.store_hand(1, make_cards('HA DA SA C2 H3'))
+        manager.store_hand(2, make_cards('HQ DJ S8 C6 D2'))
+        manager.store_hand(3, make_cards('HK DK S9 C7 H4'))
+        total = total_chips(manager)
+
+        manager.new_round()
+        manager.bet_raise(1, 10)
+        manager.bet_raise(2, 20)
+        manager.bet_call(3)
+        manager.bet_fold(3)
+
+        won = manager.settle()
+        self.assertEqual(won, {1: 30, 2: 40})
+        manager.reset()
+        self.assertEqual(total_chips(manager), total)
+
+    def test_folded_bet_above_others(self):
+        # A folded player bet more than anyone still in the hand; the excess
+        # goes to the highest pot that has a winner
+        manager = make_game([100, 100, 100])
+        manager.store_hand(1, make_cards('HA DA SA C2 H3'))
+        manager.store_hand(2, make_cards('HQ DJ S8 C6 D2'))
+        manager.store_hand(3, make_cards('HK DK S9 C7 H4'))
+
+        manager.new_round()
+        manager.bet_raise(1, 10)
+        manager.bet_call(2)
+        manager.bet_raise(3, 50)
+        manager.bet_fold(3)
+
+        self.assertEqual(manager.settle(), {1: 80})
+
+    def test_left_player_chips_stay_in_pot(self):
+        manager = make_game([100, 100, 100])
+        manager.store_hand(1, make_cards('HA DA SA C2 H3'))
+        manager.store_hand(2, make_cards('HQ DJ S8 C6 D2'))
+        manager.store_hand(3, make_cards('HK DK S9 C7 H4'))
+
+        manager.new_round()
+        manager.bet_raise(1, 10)
+        manager.bet_call(2)
+        manager.bet_call(3)
+        manager.leave(1)
+
+        # Player 1 had the best hand but left, so player 3 wins everything
+        self.assertEqual(manager.settle(), {3: 30})
+        self.assertEqual(manager.seats[0].wallet, 90)
+
+    def test_odd_chips(self):
+        # Players 1 and 2 tie; the odd chip of the split goes to the lowest
+        # player ID
+        manager = make_game([100, 100, 100])
+        manager.store_hand(1, make_cards('HA DK S9 C7 H4'))
+        manager.store_hand(2, make_cards('DA HK C9 S7 D4'))
+        manager.store_hand(3, make_cards('HQ DJ S8 C6 D2'))
+        total = total_chips(manager)
+
+        for p_id in (1, 2, 3):
+            manager.ack_ante(p_id)
+
+        won = manager.settle()
+        self.assertEqual(won, {1: 8, 2: 7})
+        manager.reset()
+        self.assertEqual(total_chips(manager), total)
+
+    def test_odd_chips_in_each_pot(self):
+        # Three way tie on the main pot and a two way tie on the side pot;
+        # each pot's odd chips go to its lowest player IDs
+        manager = make_game([5, 100, 100, 100])
+        manager.store_hand(1, make_cards('HA DK S9 C7 H4'))
+        manager.store_hand(2, make_cards('DA HK C9 S7 D4'))
+        manager.store_hand(3, make_cards('CA SK H9 D7 C4'))
+        manager.store_hand(4, make_cards('HQ DJ S8 C6 D2'))
+
+        manager.new_round()
+        manager.bet_raise(1, 5)
+        manager.bet_raise(2, 2)
+        manager.bet_call(3)
+        manager.bet_call(4)
+
+        # Main pot 4 * 5 = 20 split three ways, side pot 3 * 2 = 6 split
+        # between players 2 and 3
+        self.assertEqual(manager.settle(), {1: 7, 2: 7 + 3, 3: 6 + 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
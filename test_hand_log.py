@@ -0,0 +1,120 @@
+'''
+Tests for the `hand_log` module.
+
+Run with `python -m pytest` or `python -m unittest` from the repository root.
+'''
+
+import os
+import random
+import tempfile
+import unittest
+
+import codec
+import hand_log
+import lobby
+
+
+class HandLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'hands.log')
+        self.log = hand_log.HandLog(self.path)
+        self.tables = lobby.Lobby(log=self.log)
+
+    def tearDown(self):
+        self.log.close()
+        self.dir.cleanup()
+
+    def check_replay(self, table):
+        '''
+        Checks that a replay of the whole log matches the table's game.
+
+        table: Table - the table
+        '''
+        self.log.flush()
+        manager = table.manager
+        replayed = hand_log.replay(self.path, table.table_id)
+        self.assertEqual(replayed.hand_no, manager.hand_no)
+        self.assertEqual(replayed.bets.get_pool_amt(), manager.bets.get_pool_amt())
+        self.assertEqual([(seat.player_id, seat.wallet, seat.bet) for seat in replayed.seated()],
+                         [(seat.player_id, seat.wallet, seat.bet) for seat in manager.seated()])
+
+    def test_large_amounts(self):
+        # Wallets and bets past 32 bits, and a raise of the most a message
+        # carries
+        table = self.tables.create_table(2, 2 ** 33, 2 ** 31)
+        manager = table.manager
+        manager.join(None, None, 'alice')
+        manager.join(None, None, 'bob')
+        manager.ack_ante(1)
+        manager.ack_ante(2)
+        manager.bet_raise(1, codec.MAX_AMOUNT)
+        manager.bet_call(2)
+        self.check_replay(table)
+
+        manager.settle()
+        manager.void_hand()
+        self.check_replay(table)
+
+        self.log.flush()
+        for _, event, _, _, payload in hand_log.read_events(self.path):
+            hand_log.describe(event, payload)
+
+    def test_replay_to_reset(self):
+        # Replaying up to each RESET record gives the table as it was right
+        # after that reset: no bets, and every chip back in a wallet
+        rng = random.Random(22)
+        table = self.tables.create_table(3, 1000, 5)
+        manager = table.manager
+        for name in ('alice', 'bob', 'carol'):
+            manager.join(None, None, name)
+
+        resets = []
+        for _ in range(20):
+            for seat in manager.seated():
+                manager.ack_ante(seat.player_id)
+                manager.store_hand(seat.player_id, manager.get_cards(5))
+            manager.new_round()
+            for seat in manager.seated():
+                if rng.random() < 0.5:
+                    manager.bet_raise(seat.player_id, rng.randint(0, 50))
+                else:
+                    manager.bet_call(seat.player_id)
+            manager.settle()
+            manager.reset()
+
+            self.log.flush()
+            offset, event, _, _, _ = list(hand_log.read_events(self.path))[-1]
+            self.assertEqual(event, hand_log.RESET)
+            resets.append((offset, manager.hand_no, [seat.wallet for seat in manager.seated()]))
+
+        for offset, hand_no, wallets in resets:
+            replayed = hand_log.replay(self.path, table.table_id, offset)
+            self.assertEqual(replayed.hand_no, hand_no)
+            self.assertEqual(replayed.bets.get_pool_amt(), 0)
+            self.assertEqual([seat.wallet for seat in replayed.seated()], wallets)
+            self.assertEqual([seat.bet for seat in replayed.seated()], [0, 0, 0])
+            self.assertEqual(sum(wallets), 3000)
+
+    def test_replay_to_offset(self):
+        # Each record is applied up to and including the one at the offset
+        table = self.tables.create_table(2, 100, 5)
+        manager = table.manager
+        manager.join(None, None, 'alice')
+        manager.join(None, None, 'bob')
+        manager.ack_ante(1)
+        manager.ack_ante(2)
+        self.log.flush()
+
+        offsets = [offset for offset, _, _, _, _ in hand_log.read_events(self.path)]
+        self.assertIsNone(hand_log.replay(self.path, table.table_id, offsets[0] - 1))
+        self.assertEqual(hand_log.replay(self.path, table.table_id, offsets[0]).get_curr_num_players(), 0)
+        self.assertEqual(hand_log.replay(self.path, table.table_id, offsets[2]).get_curr_num_players(), 2)
+        self.assertEqual(hand_log.replay(self.path, table.table_id, offsets[3]).bets.get_pool_amt(), 5)
+        self.assertEqual(hand_log.replay(self.path, table.table_id, offsets[3] + 1).bets.get_pool_amt(), 5)
+        self.assertEqual(hand_log.replay(self.path, table.table_id).bets.get_pool_amt(), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,410 @@
+'''
+Tests for the `snapshot` module and the snapshots of GameStateManager.
+
+Run with `python -m pytest` or `python -m unittest` from the repository root.
+'''
+
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import codec
+import framing
+import game_state_manager as gsm
+import hand_log
+import lobby
+import snapshot
+from test_game_state_manager import make_game, play_random
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'poker_server.py')
+
+
+class RoundTripTest(unittest.TestCase):
+    '''
+    GameStateManager.snapshot and gsm.restore.
+    '''
+
+    def check_round_trip(self, manager):
+        '''
+        Checks that a snapshot of the game restores to the game as it is
+        once its hand is called off.
+
+        manager: GameStateManager - the game, which is called off
+        '''
+        data = manager.snapshot()
+        restored = gsm.restore(data)
+        self.assertEqual(gsm.snapshot_seats(data), (manager.num_seated, manager.num_players))
+
+        # Restoring takes nothing more and nothing less than the snapshot
+        self.assertEqual(restored.snapshot(), data)
+        self.assertEqual(restored.bets.get_pool_amt(), 0)
+        for seat in restored.seats:
+            if seat is not None:
+                self.assertIsNone(seat.hand)
+                self.assertFalse(seat.folded or seat.all_in or seat.has_bet)
+
+        # The same game as calling the hand off without a restart
+        restored.void_hand()
+        manager.void_hand()
+        self.assertEqual(restored.snapshot(), manager.snapshot())
+        self.assertEqual(restored.num_seated, manager.num_seated)
+        self.assertEqual(restored.num_folded, 0)
+        for mine, theirs in zip(restored.seats, manager.seats):
+            if mine is None:
+                self.assertIsNone(theirs)
+                continue
+            self.assertEqual((mine.name, mine.wallet, mine.left),
+                             (theirs.name, theirs.wallet, theirs.left))
+            self.assertEqual(mine.next is None, theirs.next is None)
+
+    def test_random_games(self):
+        rng = random.Random(23)
+        for _ in range(2000):
+            manager = make_game([rng.randint(0, 200) for _ in range(rng.randint(2, 5))])
+            for _ in play_random(manager, rng, rng.randint(0, 40)):
+                pass
+            manager.turn_id = rng.randint(1, manager.num_players)
+            self.check_round_trip(manager)
+
+    def test_free_seats(self):
+        manager = gsm.GameStateManager(5, 100, 5)
+        manager.join(None, None, 'alice')
+        manager.join(None, None, 'bob')
+        manager.ack_ante(1)
+        self.check_round_trip(manager)
+
+        restored = gsm.restore(manager.snapshot())
+        self.assertEqual(restored.join(None, None, 'carol'), 3)
+
+    def test_large_amounts(self):
+        # Wallets past 32 bits, which a table of five wallets near
+        # codec.MAX_AMOUNT can reach
+        manager = make_game([codec.MAX_AMOUNT * 4, codec.MAX_AMOUNT], ante_amt=2 ** 31)
+        manager.ack_ante(1)
+        manager.bet_raise(1, codec.MAX_AMOUNT)
+        restored = gsm.restore(manager.snapshot())
+        self.assertEqual(restored.ante_amt, 2 ** 31)
+        self.assertEqual(restored.seats[0].wallet, codec.MAX_AMOUNT * 4)
+        self.check_round_trip(manager)
+
+    def test_bets_given_back(self):
+        manager = make_game([100, 100, 100])
+        for p_id in (1, 2, 3):
+            manager.ack_ante(p_id)
+        manager.bet_raise(1, 20)
+        manager.bet_fold(2)
+        manager.leave(3)
+
+        restored = gsm.restore(manager.snapshot())
+        # Players still at the table get their bets back; a player who left
+        # does not, as in void_hand
+        self.assertEqual([seat.wallet for seat in restored.seats], [100, 100, 95])
+        self.assertEqual(restored.get_curr_num_players(), 2)
+        self.assertTrue(restored.seats[2].left)
+
+    def test_seed(self):
+        # The next hand is shuffled from the seed and hand_no, so a restored
+        # game deals what the game would have dealt
+        manager = gsm.GameStateManager(2, 100, 5, seed=99)
+        manager.join(None, None, 'alice')
+        manager.join(None, None, 'bob')
+        manager.reset()
+        manager.get_cards(5)
+
+        restored = gsm.restore(manager.snapshot())
+        manager.void_hand()
+        restored.void_hand()
+        for _ in range(2):
+            self.assertEqual([card.code for card in restored.get_cards(5)],
+                             [card.code for card in manager.get_cards(5)])
+
+    def test_cut_short(self):
+        data = make_game([100, 50, 70]).snapshot()
+        for end in range(len(data)):
+            with self.assertRaises(ValueError):
+                gsm.restore(data[:end])
+        with self.assertRaises(ValueError):
+            gsm.snapshot_seats(data[:5])
+
+
+class SnapshotStoreTest(unittest.TestCase):
+    '''
+    Writing the tables of a lobby to a snapshot file and restoring them.
+    '''
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'tables.snap')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def make_lobby(self, log=None):
+        '''
+        Returns a lobby with a full table in the middle of a hand and a table
+        waiting for players.
+
+        log: HandLog - optional, the log to record the games in
+        '''
+        tables = lobby.Lobby(log=log)
+        playing = tables.create_table(2, 100, 5).manager
+        playing.join(None, None, 'alice')
+        playing.join(None, None, 'bob')
+        playing.ack_ante(1)
+        playing.ack_ante(2)
+        playing.bet_raise(1, 10)
+        waiting = tables.create_table(3, 50, 1).manager
+        waiting.join(None, None, 'carol')
+        return tables
+
+    def test_save_and_load(self):
+        tables = self.make_lobby()
+        store = snapshot.SnapshotStore(self.path)
+        store.save(tables)
+
+        snapshots = snapshot.SnapshotStore(self.path).load()
+        self.assertEqual(sorted(snapshots), [1, 2])
+        for table in tables.list_tables():
+            self.assertEqual(snapshots[table.table_id], table.manager.snapshot())
+
+    def test_no_file(self):
+        self.assertEqual(snapshot.SnapshotStore(self.path).load(), {})
+
+    def test_bad_file(self):
+        store = snapshot.SnapshotStore(self.path)
+        store.save(self.make_lobby())
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        for bad in (b'NOPE' + data[4:], data[:4] + bytes((snapshot.FORMAT + 1,)) + data[5:],
+                    data[:-1], data[:3]):
+            with open(self.path, 'wb') as f:
+                f.write(bad)
+            with self.assertRaises(snapshot.SnapshotError):
+                store.load()
+
+    def test_only_changes_captured(self):
+        tables = self.make_lobby()
+        store = snapshot.SnapshotStore(self.path)
+        self.assertIsNotNone(store.capture(tables))
+        self.assertIsNone(store.capture(tables))
+
+        tables.get_table(2).manager.join(None, None, 'dave')
+        data = store.capture(tables)
+        self.assertIsNotNone(data)
+        self.assertEqual(store.snapshots[2][1], tables.get_table(2).manager.snapshot())
+
+        # A removed table is left out of the next file
+        tables.remove_table(1)
+        store.capture(tables)
+        self.assertEqual(sorted(store.snapshots), [2])
+
+    def test_table_that_cannot_be_packed(self):
+        tables = self.make_lobby()
+        store = snapshot.SnapshotStore(self.path)
+        store.save(tables)
+        kept = store.snapshots[1][1]
+
+        # Other tables are still snapshot, and the bad one keeps its last
+        tables.get_table(1).manager.seats[0].wallet = -1
+        tables.get_table(2).manager.join(None, None, 'dave')
+        store.save(tables)
+        snapshots = store.load()
+        self.assertEqual(snapshots[1], kept)
+        self.assertEqual(snapshots[2], tables.get_table(2).manager.snapshot())
+
+    def test_lazy_restore(self):
+        store = snapshot.SnapshotStore(self.path)
+        store.save(self.make_lobby())
+
+        tables = lobby.Lobby()
+        tables.restore(store.load())
+        self.assertEqual(tables.create_table(2, 100, 5).table_id, 3)
+
+        # Listing and snapshotting do not restore a table
+        self.assertEqual([table.describe() for table in tables.list_tables()],
+                         ['1:2/2:waiting', '2:1/3:waiting', '3:0/2:waiting'])
+        self.assertIsNotNone(store.capture(tables))
+        self.assertIsNotNone(tables.get_table(1).snapshot)
+        self.assertIsNotNone(tables.get_table(2).snapshot)
+
+        # Only tables being played are joined without an id
+        self.assertEqual(tables.open_table().table_id, 3)
+
+        # First use restores the table, with the hand called off
+        manager = tables.get_table(1).manager
+        self.assertIsNone(tables.get_table(1).snapshot)
+        self.assertEqual([seat.wallet for seat in manager.seated()], [100, 100])
+        self.assertEqual(manager.bets.get_pool_amt(), 0)
+        self.assertEqual(manager.find_seat('bob'), 2)
+        self.assertIsNone(manager.find_seat('mallory'))
+
+        # Closing a table that was never used does not restore it
+        table = tables.get_table(2)
+        tables.remove_table(2)
+        self.assertIsNotNone(table.snapshot)
+        self.assertEqual(len(tables), 2)
+
+    def test_restore_with_hand_log(self):
+        # The hand called off is recorded, so a replay of the log, across
+        # the restart, matches the restored game
+        log_path = os.path.join(self.dir.name, 'hands.log')
+        log = hand_log.HandLog(log_path)
+        before = self.make_lobby(log)
+        store = snapshot.SnapshotStore(self.path)
+        store.save(before)
+        # Lost in the crash: made after the snapshot, but recorded
+        before.get_table(1).manager.bet_call(2)
+
+        tables = lobby.Lobby(log=log)
+        tables.restore(store.load())
+        manager = tables.get_table(1).manager
+        manager.ack_ante(1)
+        tables.remove_table(1)
+        log.close()
+
+        replayed = hand_log.replay(log_path, 1)
+        self.assertEqual([seat.wallet for seat in replayed.seated()],
+                         [seat.wallet for seat in manager.seated()])
+        self.assertEqual(replayed.bets.get_pool_amt(), manager.bets.get_pool_amt())
+        self.assertEqual(replayed.hand_no, manager.hand_no)
+
+
+def free_port():
+    '''
+    Returns a TCP port on the loopback interface that nothing listens on.
+    '''
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class RestartTest(unittest.TestCase):
+    '''
+    A server killed with SIGKILL in the middle of a hand, and started again
+    from its snapshot file.
+    '''
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'tables.snap')
+        self.port = free_port()
+        self.server = None
+        self.conns = []
+
+    def tearDown(self):
+        for conn in self.conns:
+            conn.close()
+        if self.server is not None:
+            self.server.kill()
+            self.server.wait()
+        self.dir.cleanup()
+
+    def start_server(self):
+        self.server = subprocess.Popen(
+            [sys.executable, SERVER, '127.0.0.1', str(self.port), '--snapshot', self.path],
+            stdout=subprocess.DEVNULL)
+
+    def kill_server(self):
+        self.server.kill()
+        self.server.wait()
+        self.server = None
+
+    def connect(self):
+        '''
+        Returns a connection to the server, waiting for it to listen.
+        '''
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                sock = socket.create_connection(('127.0.0.1', self.port))
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        sock.settimeout(10)
+        conn = framing.Connection(sock)
+        self.conns.append(conn)
+        return conn
+
+    def read_until(self, conn, message):
+        '''
+        Reads messages until the given one, skipping any before it.
+        '''
+        while conn.recv() != message:
+            pass
+
+    def wait_for_snapshot(self, since):
+        '''
+        Waits for the snapshot file to be written after a time.
+
+        since: float - a time.time() time
+        '''
+        deadline = time.monotonic() + 10
+        while not (os.path.exists(self.path) and os.stat(self.path).st_mtime > since):
+            self.assertLess(time.monotonic(), deadline, 'no snapshot written')
+            time.sleep(0.05)
+
+    def test_kill_and_restart(self):
+        self.start_server()
+        alice = self.connect()
+        alice.send('start 2 100 5 alice')
+        self.assertEqual(alice.recv(), 'ack join 1 100 1')
+        bob = self.connect()
+        bob.send('join bob 1')
+        self.assertEqual(bob.recv(), 'ack join 2 100 1')
+
+        # A first hand, which alice folds, so bob wins her ante
+        for conn, p_id in ((alice, 1), (bob, 2)):
+            self.read_until(conn, 'begin')
+            self.assertEqual(conn.recv(), '5 0')
+            conn.send_action(codec.ANTE, p_id, 5)
+        for conn in (alice, bob):
+            conn.recv_cards()
+            conn.send('Received')
+        for conn in (alice, bob):
+            self.assertEqual(conn.recv(), '1')
+        self.assertEqual(alice.recv_bet_prompt(), (5, 5, True))
+        alice.send_action(codec.FOLD, 1)
+        for conn, result in ((alice, 'Lose'), (bob, 'Win 10')):
+            self.read_until(conn, result)
+
+        # Killed once both have anted for the second hand
+        for conn in (alice, bob):
+            self.read_until(conn, 'Do you want to start new game? Y/N:')
+            conn.send('Y')
+        for conn, p_id in ((alice, 1), (bob, 2)):
+            self.read_until(conn, 'Start')
+            self.assertEqual(conn.recv(), '5 0')
+            conn.send_action(codec.ANTE, p_id, 5)
+        alice.recv_cards()
+        anted = time.time()
+        self.wait_for_snapshot(anted)
+        self.kill_server()
+
+        # The table waits for its players, who get their antes back
+        self.start_server()
+        conn = self.connect()
+        conn.send('list')
+        self.assertEqual(conn.recv(), 'tables 1:2/2:waiting')
+        alice = self.connect()
+        alice.send('join alice 1')
+        self.assertEqual(alice.recv(), 'ack join 1 95 1')
+        bob = self.connect()
+        bob.send('join bob 1')
+        self.assertEqual(bob.recv(), 'ack join 2 105 1')
+
+        # And the game carries on from the next hand
+        for conn in (alice, bob):
+            self.read_until(conn, 'begin')
+            self.assertEqual(conn.recv(), '5 0')
+
+
+if __name__ == '__main__':
+    unittest.main()
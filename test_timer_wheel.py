@@ -0,0 +1,174 @@
+'''
+Tests for the `timer_wheel` module.
+
+Run with `python -m pytest` or `python -m unittest` from the repository root.
+'''
+
+import itertools
+import random
+import unittest
+
+import timer_wheel
+
+
+def make_wheel(wheel_bits=2, num_levels=3):
+    '''
+    Returns a wheel with a tick of one second, small enough by default that
+    timers cross level boundaries within a few ticks.
+
+    wheel_bits: int - each level has 2 ** wheel_bits slots
+    num_levels: int - the number of levels
+    '''
+    return timer_wheel.TimerWheel(1, wheel_bits, num_levels)
+
+
+class Fired:
+    '''
+    Records the tick each timer fired at.
+    '''
+
+    def __init__(self, wheel):
+        self.wheel = wheel
+        self.ticks = {}
+
+    def __call__(self, name):
+        self.ticks.setdefault(name, []).append(self.wheel.now)
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def check_fires_at(self, wheel, delays, ticks):
+        '''
+        Schedules a timer per delay and checks that each fires exactly once,
+        at now + delay.
+
+        wheel: TimerWheel - the wheel
+        delays: list - delays in ticks
+        ticks: int - the number of ticks to advance by
+        '''
+        fired = Fired(wheel)
+        start = wheel.now
+        for delay in delays:
+            wheel.schedule(delay, fired, delay)
+        wheel.advance(ticks)
+        for delay in delays:
+            self.assertEqual(fired.ticks.get(delay), [start + delay], 'delay {}'.format(delay))
+        self.assertEqual(len(wheel), 0)
+
+    def test_level_boundaries(self):
+        # With 4 slots per level, 4 and 16 ticks are the first distances
+        # placed on levels 1 and 2, and 3 and 15 the last below them
+        wheel = make_wheel()
+        self.check_fires_at(wheel, [3, 4, 5, 15, 16, 17, 63], 64)
+
+    def test_level_boundaries_later(self):
+        # The same distances, and exact multiples of the level sizes, from
+        # every starting tick of a full turn of the wheel
+        for start in range(64):
+            wheel = make_wheel()
+            wheel.advance(start)
+            delays = [3, 4, 5, 15, 16, 17, 63]
+            delays += [d for d in (4 - start % 4, 16 - start % 16, 64 - start) if d > 0]
+            self.check_fires_at(wheel, sorted(set(delays)), 64)
+
+    def test_out_of_range(self):
+        # Later than the wheel covers: waits in the top level and is placed
+        # again when its slot cascades
+        wheel = make_wheel()
+        self.check_fires_at(wheel, [64, 65, 100, 200], 200)
+
+    def test_cancel(self):
+        wheel = make_wheel()
+        fired = Fired(wheel)
+        timers = {delay: wheel.schedule(delay, fired, delay) for delay in (1, 4, 20)}
+        for timer in timers.values():
+            self.assertTrue(timer.pending())
+
+        wheel.cancel(timers[4])
+        timers[20].cancel()
+        self.assertFalse(timers[4].pending())
+        self.assertEqual(len(wheel), 1)
+
+        self.assertEqual(wheel.advance(30), 1)
+        self.assertEqual(fired.ticks, {1: [1]})
+        self.assertFalse(timers[1].pending())
+
+        # Cancelling again, or after firing, does nothing
+        timers[4].cancel()
+        timers[1].cancel()
+        self.assertEqual(len(wheel), 0)
+
+    def test_cancel_after_cascade(self):
+        # A timer that has moved down a level is still cancelled
+        wheel = make_wheel()
+        fired = Fired(wheel)
+        timer = wheel.schedule(18, fired, 18)
+        wheel.advance(16)
+        self.assertTrue(timer.pending())
+        timer.cancel()
+        self.assertEqual(wheel.advance(10), 0)
+        self.assertEqual(fired.ticks, {})
+
+    def test_due_now(self):
+        # No delay, or a delay within the current tick, fires on the next
+        # tick rather than being lost in the slot just passed
+        wheel = make_wheel()
+        wheel.advance(5)
+        fired = Fired(wheel)
+        for delay in (0, 0.5, 1):
+            wheel.schedule(delay, fired, delay)
+        self.assertEqual(wheel.advance(), 3)
+        self.assertEqual(fired.ticks, {0: [6], 0.5: [6], 1: [6]})
+
+    def test_schedule_from_callback(self):
+        # A timer scheduled by a callback as it fires is due next tick
+        wheel = make_wheel()
+        fired = Fired(wheel)
+
+        def again(name):
+            fired(name)
+            wheel.schedule(0, fired, 'again')
+
+        wheel.schedule(3, again, 'first')
+        wheel.advance(5)
+        self.assertEqual(fired.ticks, {'first': [3], 'again': [4]})
+
+    def test_advance_to(self):
+        wheel = make_wheel()
+        fired = Fired(wheel)
+        wheel.schedule(2, fired, 2)
+        self.assertEqual(wheel.advance_to(wheel.started + 1.5), 0)
+        self.assertEqual(wheel.advance_to(wheel.started + 2), 1)
+        # Time going backwards does not move the wheel
+        self.assertEqual(wheel.advance_to(wheel.started), 0)
+        self.assertEqual(wheel.now, 2)
+
+    def test_random(self):
+        # Against a plain list of deadlines, with timers scheduled and
+        # cancelled as the wheel turns
+        rng = random.Random(7)
+        wheel = make_wheel()
+        fired = Fired(wheel)
+        expected = {}
+        timers = []
+        names = itertools.count()
+        for _ in range(400):
+            if timers and rng.random() < 0.2:
+                name, timer = timers.pop(rng.randrange(len(timers)))
+                if timer.pending():
+                    timer.cancel()
+                    del expected[name]
+            for _ in range(rng.randrange(3)):
+                name = next(names)
+                delay = rng.choice((rng.randrange(6), rng.randrange(100)))
+                timers.append((name, wheel.schedule(delay, fired, name)))
+                expected[name] = wheel.now + max(1, delay)
+            wheel.advance(rng.randrange(1, 4))
+        wheel.advance(200)
+
+        self.assertEqual(fired.ticks, {name: [tick] for name, tick in expected.items()})
+        self.assertEqual(len(wheel), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
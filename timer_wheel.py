@@ -0,0 +1,195 @@
+'''
+The `timer_wheel` module keeps track of a large number of deadlines, such as
+one per seat for the current turn, at O(1) cost to schedule or cancel each.
+
+A TimerWheel counts time in ticks. Level 0 of the wheel is a ring of slots,
+one per tick, for timers due within one turn of the ring. Each higher level
+is a ring of slots covering a whole turn of the level below it. When the
+level below completes a turn, the next slot of the level above is emptied
+into it ("cascaded"), so a timer moves down at most once per level before it
+fires. Cancelling a timer just removes it from its slot.
+'''
+
+import asyncio
+import time
+
+# Seconds per tick
+DEFAULT_TICK = 0.1
+
+# Each level has 2 ** WHEEL_BITS slots
+WHEEL_BITS = 8
+
+# Levels of the wheel. Four levels of 256 slots cover 2 ** 32 ticks; later
+# timers wait in the top level until they are in range.
+NUM_LEVELS = 4
+
+
+class Timer:
+    '''
+    A callback scheduled on a TimerWheel. Returned by TimerWheel.schedule,
+    and used to cancel it.
+    '''
+
+    __slots__ = ('expires', 'callback', 'args', 'slot')
+
+    def __init__(self, expires, callback, args):
+        '''
+        Creates a timer that is not in any slot yet.
+
+        expires: int - the tick it is due at
+        callback: function - called with `args` when it fires
+        args: tuple - arguments for the callback
+        '''
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        # The slot holding the timer, or None once it fired or was cancelled
+        self.slot = None
+
+    def cancel(self):
+        '''
+        Cancels the timer. Does nothing if it already fired or was cancelled.
+        '''
+        if self.slot is not None:
+            self.slot.discard(self)
+            self.slot = None
+
+    def pending(self):
+        '''
+        Returns True if the timer has neither fired nor been cancelled.
+        '''
+        return self.slot is not None
+
+
+class TimerWheel:
+    '''
+    A hierarchical timer wheel.
+    '''
+
+    def __init__(self, tick=DEFAULT_TICK, wheel_bits=WHEEL_BITS, num_levels=NUM_LEVELS):
+        '''
+        Creates an empty wheel at tick 0.
+
+        tick: float - seconds per tick
+        wheel_bits: int - each level has 2 ** wheel_bits slots
+        num_levels: int - the number of levels
+        '''
+        self.tick = tick
+        self.bits = wheel_bits
+        self.mask = (1 << wheel_bits) - 1
+        self.num_levels = num_levels
+        self.levels = [[set() for _ in range(1 << wheel_bits)] for _ in range(num_levels)]
+        # Largest distance in ticks the wheel can place a timer at
+        self.span = (1 << (wheel_bits * num_levels)) - 1
+
+        self.now = 0
+        self.started = time.monotonic()
+
+    def schedule(self, delay, callback, *args):
+        '''
+        Schedules callback(*args) to be called after `delay` seconds, rounded
+        up to a whole tick, and returns its Timer.
+
+        delay: float - seconds from now
+        callback: function - the function to call
+        '''
+        ticks = max(1, -int(-delay // self.tick))
+        timer = Timer(self.now + ticks, callback, args)
+        self._insert(timer)
+        return timer
+
+    def cancel(self, timer):
+        '''
+        Cancels a timer. Does nothing if it already fired or was cancelled.
+
+        timer: Timer - a timer returned by schedule
+        '''
+        timer.cancel()
+
+    def _insert(self, timer):
+        '''
+        Puts a timer in the slot its expiry tick falls in.
+
+        timer: Timer - the timer
+        '''
+        # Timers too far away wait in the top level, and are placed again
+        # when that slot cascades
+        expires = min(timer.expires, self.now + self.span)
+        distance = expires - self.now
+
+        level = 0
+        while level < self.num_levels - 1 and distance >> (self.bits * (level + 1)):
+            level += 1
+
+        slot = self.levels[level][(expires >> (self.bits * level)) & self.mask]
+        slot.add(timer)
+        timer.slot = slot
+
+    def advance(self, ticks=1):
+        '''
+        Moves the wheel forward by a number of ticks, firing every timer that
+        becomes due. Returns the number of timers fired.
+
+        ticks: int - the number of ticks to move forward
+        '''
+        fired = 0
+        for _ in range(ticks):
+            self.now += 1
+            now = self.now
+
+            # Empty the slots of the levels that just turned over, highest
+            # first so that their timers can cascade all the way down
+            for level in range(self.num_levels - 1, 0, -1):
+                if now & ((1 << (self.bits * level)) - 1) == 0:
+                    self._cascade(level, (now >> (self.bits * level)) & self.mask)
+
+            slot = self.levels[0][now & self.mask]
+            while slot:
+                timer = slot.pop()
+                timer.slot = None
+                if timer.expires > now:
+                    # Only possible for a timer that was out of range
+                    self._insert(timer)
+                    continue
+                timer.callback(*timer.args)
+                fired += 1
+
+        return fired
+
+    def _cascade(self, level, index):
+        '''
+        Places every timer of a slot again, which moves each to a lower
+        level.
+
+        level: int - the level of the slot
+        index: int - the index of the slot in its level
+        '''
+        slot = self.levels[level][index]
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            self._insert(timer)
+
+    def advance_to(self, now):
+        '''
+        Moves the wheel forward to a point in time and returns the number of
+        timers fired.
+
+        now: float - a time.monotonic() time
+        '''
+        target = int((now - self.started) / self.tick)
+        if target <= self.now:
+            return 0
+        return self.advance(target - self.now)
+
+    async def run(self):
+        '''
+        Drives the wheel from the event loop, one tick at a time, until the
+        task is cancelled.
+        '''
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance_to(time.monotonic())
+
+    def __len__(self):
+        return sum(len(slot) for level in self.levels for slot in level)